@@ -0,0 +1,30 @@
+/*
+
+    This script is injected into a page of products by a delta crawl, see scraping/delta.py, e.g.
+    https://shop.coles.com.au/a/a-national/everything/browse/category/subcategory?pageNumber=1
+
+    It returns just enough of the product listing to tell whether the page changed since the previous crawl - the name,
+    unit price and package size of every product and whether it is on special - as a JSON encoded string.
+
+    It is much cheaper than scrape_products.js, which only needs to run if the listing changed.
+
+*/
+
+var listing = [];
+
+// All of the products are contained in a 'product-list' HTML section
+var product_list = document.getElementById('product-list');
+if (product_list != null) {
+  for (var i=0; i < product_list.childElementCount; i++) {
+    var product_element = product_list.children[i];
+    var fields = ['product-name', 'package-price', 'package-size', 'product-specials'];
+    var product = [];
+    for (var j=0; j < fields.length; j++) {
+      var element = product_element.getElementsByClassName(fields[j]);
+      product.push(element.length > 0 ? element[0].textContent.trim() : null);
+    }
+    listing.push(product);
+  }
+}
+
+return JSON.stringify(listing);
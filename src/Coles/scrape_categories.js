@@ -18,7 +18,8 @@ for (var i=0; i < category_elements.length; i++) {
   var anchor_tag = category_elements[i].children[0];
   var url = anchor_tag.href;
   // We just want the category name so we use replace() to remove unwanted text from the URL
-  var category = url.replace('https://shop.coles.com.au/a/a-national/everything/browse/', '');
+  // (the origin of the page, so this also works on a copy of the site)
+  var category = url.replace(window.location.origin + '/a/a-national/everything/browse/', '');
   category = category.replace('?pageNumber=1', '');
   categories.push(category);
 }
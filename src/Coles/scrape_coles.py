@@ -7,60 +7,280 @@
     The Woolworths web scraper by default will scrape one page per category and will be faster to complete execution.
 
     We use several Javascript files. The Javascript is injected into a web page, extracts data and returns it as a JSON
-    encoded string. Data is saved to the 'src/Datasets' folder as a JSON file with the name of the category.
+    encoded string. Data is saved to the 'src/Datasets' folder as an NDJSON file (one product per line, see
+    ndjson_stream.py) with the name of the category. Products are appended to the file as soon as each page is scraped.
 
     You can use get_all_categories() to get the names of categories which you can then scrape with scrape_products()
 
+    Crawls keep a journal of every page they scrape in '../Datasets/Coles/crawl.journal'. If a crawl fails part way
+    through, run it again with resume=True (or --resume on the command line) to skip every page already scraped.
+
+    A delta crawl (delta=True, or --delta on the command line) only extracts pages whose product listing changed since
+    the previous crawl, see scraping/delta.py. Page fingerprints are kept in '../Datasets/Coles/pages.cache'.
+
+    scrape_products_scheduled() first expands the whole crawl into a list of page URLs (Coles tells us how many pages
+    every subcategory has) and then scrapes the pages with a pool of headless browsers, retrying pages that fail. One
+    huge subcategory no longer holds up everything behind it.
+
+    The scraper can be pointed at a copy of the site with set_site_url() (or --site-url, or the COLES_URL environment
+    variable), and can record every page it extracts with start_recording() (or --record) to replay it later without
+    the live site, see scraping/replay.py.
+
 '''
 
-import json, requests, time, random
+import time, threading, queue, os, sys
+
+# Shared scraper components live in the 'src/scraping' package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraping.rate_limiter import AdaptiveRateLimiter
+from scraping.journal import CrawlJournal
+from scraping.scripts import ScriptCache
+from scraping.browser import BrowserSession
+from scraping.delta import DeltaCrawl
+from scraping.replay import Recording
+from ndjson_stream import NDJSONWriter
+import instrumentation
 
 # Import web scraping library
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 
-base_url = 'https://shop.coles.com.au/a/a-national/everything/browse/'
-
-browser = webdriver.Chrome()
-
-def execute_script(filename):
+# The site to scrape, e.g. a replay server instead of Coles.com.au (see set_site_url())
+site_url = os.environ.get('COLES_URL', 'https://shop.coles.com.au').rstrip('/')
+base_url = site_url + '/a/a-national/everything/browse/'
+
+# The Recording every extracted page is saved to, None unless recording (see start_recording())
+recording = None
+
+# The browser of the serial crawl, Chrome is only started once the browser is first used, see scraping/browser.py
+browser = BrowserSession()
+
+# Every request to the site goes through this rate limiter instead of sleeping a random 1-5 seconds after every page.
+# It ramps up while the site responds quickly and backs off when it slows down or fails. Shared by all workers.
+rate_limiter = AdaptiveRateLimiter()
+
+# Every injected Javascript file, read once when the scraper starts
+scripts = ScriptCache(os.path.dirname(os.path.abspath(__file__)))
+
+# Wait for pages to load inside the page and extract them in the same call (see scraping/scripts.py), set to False to
+# poll for the page with WebDriverWait and inject the extraction script afterwards instead
+EXTRACT_IN_PAGE = True
+
+# The journal of the current crawl, see scraping/journal.py
+JOURNAL_FILENAME = '../Datasets/Coles/crawl.journal'
+
+# The page fingerprints of delta crawls, see scraping/delta.py, and how many unchanged pages in a row end a subcategory
+PAGES_FILENAME = '../Datasets/Coles/pages.cache'
+DELTA_STOP_AFTER = 3
+
+# The most browsers we are willing to run against Coles.com.au at the same time
+MAX_WORKERS = 8
+
+def set_site_url(url):
+    ''' Scrape another copy of the site instead of Coles.com.au, e.g. a replay server (see scraping/replay.py)
+    :param url: the origin of the site, e.g. 'http://127.0.0.1:8000' '''
+    global site_url, base_url
+    site_url = url.rstrip('/')
+    base_url = site_url + '/a/a-national/everything/browse/'
+
+def start_recording(directory):
+    ''' Save the rendered HTML of every page extracted from now on, to replay it later (see scraping/replay.py)
+    :param directory: the directory of the recording
+    :return: the Recording, close() it once the crawl is done '''
+    global recording
+    recording = Recording(directory, site_url)
+    return recording
+
+def record_page(url, driver=None):
+    ''' Save the page the browser is on if recording
+    :param url: the URL the page was loaded from
+    :param driver: the browser, defaults to the module's browser '''
+    if recording is not None:
+        recording.record(driver or browser, url)
+
+def new_browser(headless=True):
+    ''' Create a new browser session for a crawl worker, Chrome is started when the session is first used
+    :param headless: boolean - run Chrome without a window
+    :return: BrowserSession, used in the same way as a Selenium webdriver '''
+    return BrowserSession(headless=headless)
+
+def execute_script(filename, driver=None):
     '''' Injects Javascript into the browser and returns JSON
-    :param filename: the name of the file containing Javascript to inject
+    :param filename: the name of the file containing Javascript to inject, read from the cache of scripts
+    :param driver: the browser to inject into, defaults to the module's browser
     :return: JSON data - can be either a list or dictionary '''
-    f = open(filename, 'r')
-    json_string = browser.execute_script(f.read())
-    f.close()
-    json_data = json.loads(json_string)
-    return json_data
-
-def save_json(filename, data):
-    ''' Saves data as a JSON file named filename
-    :param filename: the name of the file to save
-    :param data: a dictionary that will be encoded as a JSON string '''
-    f = open(filename, 'w+')
-    json_string = json.dumps(data, indent=4, sort_keys=True)
-    f.write(json_string)
-    f.close()
-
-def get_all_categories():
+    return scripts.execute(driver or browser, filename)
+
+def get_page(url, driver=None):
+    ''' Load a page in the browser once the rate limiter allows another request to the site
+    :param url: the URL of the page
+    :param driver: the browser to use, defaults to the module's browser '''
+    driver = driver or browser
+    with instrumentation.span('scrape.get_page'), rate_limiter.request(url):
+        with instrumentation.span('scrape.browser_get'):
+            driver.get(url)
+    instrumentation.count('pages_loaded')
+
+def get_all_categories(journal=None):
     ''' Returns a list of all top level / main product categories for Coles.com.au
+    :param journal: optional CrawlJournal, categories recorded by an earlier crawl are reused
     :return: list of all categories '''
-    browser.get(base_url)
-    return execute_script('scrape_categories.js')
-
-def scrape_all_products(max_num_pages=float('inf')):
+    if journal and journal.done('categories', base_url):
+        return journal.get('categories', base_url)
+    get_page(base_url)
+    categories = execute_script('scrape_categories.js')
+    record_page(base_url)
+    if journal:
+        journal.record('categories', base_url, categories)
+    return categories
+
+def scrape_all_products(max_num_pages=float('inf'), workers=1, resume=False, delta=False):
     ''' Scrape all products for all categories
-    :param max_num_pages: the maximum number of pages to scrape for each category '''
-    all_categories = get_all_categories()
-    scrape_products(all_categories, max_num_pages)
-
-def scrape_products(categories, max_num_pages=float('inf')):
-    ''' Scrape data for all products under the categories provided and save as JSON file
+    :param max_num_pages: the maximum number of pages to scrape for each category
+    :param workers: the number of browsers to scrape with, more than 1 uses the page scheduler
+    :param resume: boolean - skip every page recorded in the journal by an earlier crawl that didn't finish
+    :param delta: boolean - only extract pages whose product listing changed since the previous crawl '''
+    journal = CrawlJournal(JOURNAL_FILENAME, resume)
+    delta = DeltaCrawl(PAGES_FILENAME, DELTA_STOP_AFTER) if delta else None
+    all_categories = get_all_categories(journal)
+    complete = False # every page of every category was scraped, see DeltaCrawl.close()
+    try:
+        if workers > 1:
+            tasks = scrape_products_scheduled(all_categories, workers, max_num_pages, journal=journal, delta=delta)
+            failed = [task for task in tasks if task.error is not None]
+        else:
+            scrape_products(all_categories, max_num_pages, journal, delta)
+            failed = [] # a failed page raises an exception instead
+        complete = not failed and max_num_pages == float('inf')
+    finally:
+        if delta:
+            delta.close(complete)
+            print(delta)
+        # The serial crawl's browser, started again if it is used again
+        browser.quit()
+
+    # Keep the journal if any page failed so the crawl can be resumed
+    if failed:
+        journal.close()
+    else:
+        journal.finish()
+
+def get_subcategories(category, driver=None, journal=None):
+    ''' Get the subcategories of a category
+    Coles does not list all products under the 'main' categories.
+    You have to click on a subcategory to view all products.
+    We use Javascript to retrieve the URL's for all of the subcategories
+    :param category: the category
+    :param driver: the browser to use, defaults to the module's browser
+    :param journal: optional CrawlJournal, subcategories recorded by an earlier crawl are reused
+    :return: list of subcategory names '''
+    driver = driver or browser
+    if journal and journal.done('subcategories', category):
+        return journal.get('subcategories', category)
+
+    # Construct URL for first page of this category
+    url = base_url + category + '?pageNumber=1'
+    get_page(url, driver)
+
+    subcategories = []
+    subcategory_urls = execute_script('scrape_subcategory_urls.js', driver)
+    record_page(url, driver)
+    for sub in subcategory_urls:
+        # Format subcategory
+        subcategory = sub.replace(base_url, '')
+        subcategory = subcategory.replace('?pageNumber=1', '')
+        subcategory = subcategory.replace('#', '')
+        subcategory = subcategory.replace(category + '/', '')
+        subcategories.append(subcategory)
+    if journal:
+        journal.record('subcategories', category, subcategories)
+    return subcategories
+
+def page_url(category, subcategory, page_number):
+    ''' The URL of a page of products in a subcategory '''
+    return base_url + category + '/' + subcategory + '?pageNumber=' + str(page_number)
+
+def get_num_pages(category, subcategory, driver=None, journal=None):
+    ''' Get the number of pages of products in a subcategory
+    :param driver: the browser to use, defaults to the module's browser
+    :param journal: optional CrawlJournal, page counts recorded by an earlier crawl are reused
+    :return: int '''
+    driver = driver or browser
+    url = page_url(category, subcategory, 1)
+    if journal and journal.done('num_pages', url):
+        return journal.get('num_pages', url)
+    get_page(url, driver)
+    num_pages = int(execute_script('get_num_pages.js', driver))
+    record_page(url, driver)
+    if journal:
+        journal.record('num_pages', url, num_pages)
+    return num_pages
+
+def scrape_page(url, driver=None):
+    ''' Extract all product data from one page of products
+    :param url: the page URL
+    :param driver: the browser to use, defaults to the module's browser
+    :return: list of product JSON '''
+    driver = driver or browser
+    get_page(url, driver)
+
+    if EXTRACT_IN_PAGE:
+        # Wait inside the page until the product list has appeared and stopped changing, then extract all product data
+        # from this page in the same call
+        products = scripts.execute_when_ready(driver, 'scrape_products.js', '#product-list, .product-list')
+    else:
+        # Wait for products to be loaded
+        # i.e. until the presence of HTML element with class 'product-list' is detected
+        try:
+            timeout = 10
+            with instrumentation.span('scrape.wait'):
+                WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.CLASS_NAME, 'product-list')))
+        except TimeoutException: # last page of category
+            pass
+
+        # Extract all product data from this page
+        products = execute_script('scrape_products.js', driver)
+
+    record_page(url, driver)
+    instrumentation.count('pages_scraped')
+    return products
+
+def scrape_page_delta(url, delta, driver=None):
+    ''' Extract all product data from one page of products for a delta crawl - the page is only extracted if its product
+    listing changed since the previous crawl, otherwise the products extracted by the previous crawl are returned
+    :param url: the page URL
+    :param delta: the DeltaCrawl
+    :param driver: the browser to use, defaults to the module's browser
+    :return: tuple (list of product JSON, boolean - whether the page changed) '''
+    driver = driver or browser
+    get_page(url, driver)
+
+    # Fingerprint the listing once the product list has loaded
+    fingerprint = delta.fingerprint(scripts.execute_when_ready(driver, 'fingerprint_products.js', '#product-list, .product-list'))
+    record_page(url, driver)
+    products = delta.unchanged(url, fingerprint)
+    if products is not None:
+        return products, False
+
+    # The page has already loaded, so the products can be extracted straight away
+    products = execute_script('scrape_products.js', driver)
+    delta.record(url, fingerprint, products)
+    instrumentation.count('pages_scraped')
+    return products, True
+
+def category_filename(category):
+    ''' The NDJSON file the products of a category are saved to '''
+    return '../Datasets/Coles/' + category + '.ndjson'
+
+def scrape_products(categories, max_num_pages=float('inf'), journal=None, delta=None):
+    ''' Scrape data for all products under the categories provided and save each category as an NDJSON file, products
+    are written to the file page by page as they are scraped
     :param categories: the categories to scrape products for
     :param max_num_pages: the maximum number of pages to scrape for each category
+    :param journal: optional CrawlJournal to record pages in and to skip pages already scraped
+    :param delta: optional DeltaCrawl, only pages whose listing changed since the previous crawl are extracted
     :return: none '''
     # Loop through categories
     for category in categories:
@@ -70,70 +290,310 @@ def scrape_products(categories, max_num_pages=float('inf')):
         if category == 'tobacco':
             break
 
-        # Construct URL for first page of this category
-        url = base_url + category + '?pageNumber=1'
-
-        # Coles does not list all products under the 'main' categories.
-        # You have to click on a subcategory to view all products.
-        # We use Javascript to retrieve the URL's for all of the subcategories
-        browser.get(url)
-        subcategories = execute_script('scrape_subcategory_urls.js')
-
-        category_data = [] # accumulated data for all products in this category
-
-        # Loop through all subcategories
-        for sub in subcategories:
-
-            # Format subcategory
-            subcategory = sub.replace(base_url, '')
-            subcategory = subcategory.replace('?pageNumber=1', '')
-            subcategory = subcategory.replace('#', '')
-            subcategory = subcategory.replace(category + '/', '')
-
-            # Construct subcategory URL
-            url = base_url + category + '/' + subcategory + '?pageNumber=1'
-
-            # Get number of pages for this subcategory
-            browser.get(url)
-            num_pages = execute_script('get_num_pages.js')
-            num_pages = int(num_pages)
-
-            # Loop through all pages in subcategory
-            for page_number in range(1, num_pages + 1):
-
-                # Break if we have scraped the maximum desired number of pages for this subcategory
-                if page_number > max_num_pages:
-                    break
+        subcategories = get_subcategories(category, journal=journal)
+
+        writer = NDJSONWriter(category_filename(category)) # products of this category are streamed to this file
+        try:
+            # Loop through all subcategories
+            for subcategory in subcategories:
+
+                # Get number of pages for this subcategory
+                num_pages = get_num_pages(category, subcategory, journal=journal)
+                unchanged_pages = 0 # number of pages in a row that were unchanged in a delta crawl
+
+                # Loop through all pages in subcategory
+                for page_number in range(1, num_pages + 1):
+
+                    # Break if we have scraped the maximum desired number of pages for this subcategory
+                    if page_number > max_num_pages:
+                        break
+
+                    # Get next page, pages scraped by an earlier crawl come straight from the journal
+                    url = page_url(category, subcategory, page_number)
+                    page_data = journal.get('page', url) if journal else None
+                    if page_data is not None and delta:
+                        delta.visit(url)
+
+                    # After a run of unchanged pages the rest of the subcategory comes from the previous crawl, if it
+                    # has the page
+                    if page_data is None and delta and unchanged_pages >= delta.stop_after:
+                        page_data = delta.reuse(url)
+
+                    if page_data is None:
+                        if delta:
+                            page_data, changed = scrape_page_delta(url, delta)
+                            unchanged_pages = 0 if changed else unchanged_pages + 1
+                        else:
+                            page_data = scrape_page(url)
+                        if journal:
+                            journal.record('page', url, page_data)
+
+                    # Add category and subcategory to product JSON
+                    for product in page_data:
+                        product['category'] = category
+                        product['subcategory'] = subcategory
+
+                    # Write all products on this page to the file for this category
+                    writer.write_many(page_data)
+                    instrumentation.count('products_saved', len(page_data))
+        except:
+            writer.abort()
+            raise
+
+        # The file for this category only replaces the previous one once every page succeeded
+        writer.finalize()
+
+class PageTask:
+    ''' One page of products to scrape, as scheduled by scrape_products_scheduled()
+    - category, subcategory, page_number and url identify the page
+    - subcategory_index is the position of the subcategory in its category, used to put pages back in order
+    - attempts is the number of times we tried to scrape the page
+    - seconds is how long the last attempt took
+    - products is the extracted product JSON, None until the page has been scraped and once its category is saved
+    - num_pages is the number of pages of the subcategory, counted on its first page, None for the other pages
+    - error is the last exception raised while scraping the page, if any '''
+    def __init__(self, category, subcategory, subcategory_index, page_number):
+        self.category = category
+        self.subcategory = subcategory
+        self.subcategory_index = subcategory_index
+        self.page_number = page_number
+        self.url = page_url(category, subcategory, page_number)
+        self.attempts = 0
+        self.seconds = None
+        self.products = None
+        self.num_pages = None
+        self.error = None
+
+def expand_crawl(categories, journal=None):
+    ''' Expand a crawl of categories into the first page of every subcategory, run_page_tasks() adds the other pages
+    once it has counted them on the first page. This visits each category, but no pages of products.
+    :param categories: the categories to scrape products for
+    :param journal: optional CrawlJournal, subcategories recorded by an earlier crawl are reused
+    :return: tuple (list of PageTask, list of the categories expanded) '''
+    tasks = []
+    expanded = []
+    for category in categories:
 
-                # Get next page
-                url = base_url + category + '/' + subcategory + '?pageNumber=' + str(page_number)
-                browser.get(url)
+        # Tobacco category requires the user verify their age, see scrape_products()
+        if category == 'tobacco':
+            break
 
-                # Wait for products to be loaded
-                # i.e. until the presence of HTML element with class 'product-list' is detected
+        expanded.append(category)
+        for subcategory_index, subcategory in enumerate(get_subcategories(category, journal=journal)):
+            tasks.append(PageTask(category, subcategory, subcategory_index, 1))
+    return tasks, expanded
+
+def run_page_tasks(tasks, workers=4, retries=2, journal=None, delta=None, on_finished=None, max_num_pages=float('inf')):
+    ''' Scrape pages with a pool of headless browsers, each worker takes the next page from a shared queue
+    A page that raises an exception is put back on the queue until it has been attempted retries + 1 times. The worker
+    that scrapes the first page of a subcategory also counts the pages of the subcategory on it, and tasks for the
+    other pages are then added to tasks and queued, so no page is loaded twice.
+    :param tasks: list of PageTask, updated in place and extended with the pages counted
+    :param workers: the number of browsers to run at once, capped at MAX_WORKERS
+    :param retries: how many times to retry a page that failed
+    :param journal: optional CrawlJournal to record pages in, pages it already has are not scraped again
+    :param delta: optional DeltaCrawl, only pages whose listing changed since the previous crawl are extracted. Pages
+                  finish out of order, so unlike scrape_products() every page is still loaded and fingerprinted.
+    :param on_finished: optional function called with each task and the list of tasks it added (the other pages of its
+                        subcategory, if it is a first page) once it is finished - scraped, taken from the journal or
+                        failed for the last time. It is called before any of the added tasks finish, from the worker
+                        threads.
+    :param max_num_pages: the maximum number of pages to scrape for each subcategory '''
+
+    task_queue = queue.Queue()
+    lock = threading.Lock()
+
+    def add(task):
+        ''' Queue a task, or finish it straight away if the journal has its page (and page count, for a first page) '''
+        if journal and journal.done('page', task.url) and (task.page_number > 1 or journal.done('num_pages', task.url)):
+            task.products = journal.get('page', task.url)
+            if task.page_number == 1:
+                task.num_pages = journal.get('num_pages', task.url)
+            if delta:
+                delta.visit(task.url)
+            finish(task)
+        else:
+            task_queue.put(task)
+
+    def finish(task):
+        ''' Add the other pages of a subcategory once its first page is done, then hand the task on '''
+        added = []
+        if task.page_number == 1 and task.error is None:
+            num_pages = int(min(task.num_pages, max_num_pages))
+            if num_pages < 1:
+                task.products = []
+            added = [PageTask(task.category, task.subcategory, task.subcategory_index, page_number)
+                     for page_number in range(2, num_pages + 1)]
+            with lock:
+                tasks.extend(added)
+        if on_finished:
+            on_finished(task, added)
+        for page in added:
+            add(page)
+
+    def worker():
+        driver = new_browser()
+        try:
+            while True:
+                task = task_queue.get()
+                if task is None:
+                    return
                 try:
-                    timeout = 10
-                    WebDriverWait(browser, timeout).until(EC.presence_of_element_located((By.CLASS_NAME, 'product-list')))
-                except TimeoutException: # last page of category
-                    pass
-
-                # Extract all product data from this page
-                page_data = execute_script('scrape_products.js')
-
-                # Add category and subcategory to product JSON
-                for product in page_data:
-                    product['category'] = category
-                    product['subcategory'] = subcategory
-
-                # Add all products on this page to accumulative product data for this category
-                category_data += page_data
-
-                # Sleep so we don't overwhelm their website with requests
-                time.sleep(random.randint(1,5))
-
-        # Save product data for this category as JSON file
-        filename = '../Datasets/Coles/' + category + '.json'
-        save_json(filename, category_data)
+                    task.attempts += 1
+                    start = time.perf_counter()
+                    try:
+                        if delta:
+                            task.products = scrape_page_delta(task.url, delta, driver)[0]
+                        else:
+                            task.products = scrape_page(task.url, driver)
+                        # The first page of a subcategory is still loaded, count the pages of the subcategory on it
+                        if task.page_number == 1:
+                            task.num_pages = int(execute_script('get_num_pages.js', driver))
+                        task.error = None
+                        if journal:
+                            if task.page_number == 1:
+                                journal.record('num_pages', task.url, task.num_pages)
+                            journal.record('page', task.url, task.products)
+                    except Exception as e:
+                        task.error = e
+                    task.seconds = time.perf_counter() - start
+                    if task.error is not None and task.attempts <= retries:
+                        task_queue.put(task)
+                    else:
+                        finish(task)
+                finally:
+                    task_queue.task_done()
+        finally:
+            driver.quit()
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, min(workers, MAX_WORKERS)))]
+    for thread in threads:
+        thread.start()
+    for task in list(tasks):
+        add(task)
+    # Every task added while scraping is queued before the task that added it is done, so this waits for all of them
+    task_queue.join()
+    for thread in threads:
+        task_queue.put(None)
+    for thread in threads:
+        thread.join()
+
+def save_category_pages(category, tasks, journal=None):
+    ''' Write the scraped pages of a category to its NDJSON file, in the same order the serial crawl would have
+    scraped them, and free the pages
+    :param category: the category
+    :param tasks: list of every PageTask of the category, all finished
+    :param journal: optional CrawlJournal the pages were recorded in
+    :return: boolean - whether the category was saved. A category with a page that failed every attempt is not
+             saved, its previous file is kept. '''
+
+    # A category missing pages would replace the previous complete file, and merge.py and price_history.py would read
+    # its missing products as removed - keep the old file instead, the journal has the pages that did finish so
+    # --resume only scrapes the failed ones again
+    saved = not any(task.error is not None for task in tasks)
+    if saved:
+        writer = NDJSONWriter(category_filename(category))
+        try:
+            for task in sorted(tasks, key=lambda task: (task.subcategory_index, task.page_number)):
+                for product in task.products:
+                    product['category'] = task.category
+                    product['subcategory'] = task.subcategory
+                    writer.write(product)
+                    instrumentation.count('products_saved')
+        except Exception:
+            writer.abort()
+            raise
+        writer.finalize()
+
+    # The pages are on disk (or in the journal), don't keep them until the whole crawl is done
+    for task in tasks:
+        task.products = None
+        if journal:
+            journal.forget('page', task.url)
+    return saved
+
+def scrape_products_scheduled(categories, workers=4, max_num_pages=float('inf'), retries=2, journal=None, delta=None):
+    ''' Scrape data for all products under the categories provided and save each category as an NDJSON file, the same
+    as scrape_products(), but by scraping the pages on a pool of browsers. The first page of every subcategory is
+    scheduled first and the other pages once their first page has been counted. Pages finish out of order, so the pages
+    of a category are kept until its last page has finished and then written in order and freed.
+    :param categories: the categories to scrape products for
+    :param workers: the number of browsers to run at once, capped at MAX_WORKERS
+    :param max_num_pages: the maximum number of pages to scrape for each subcategory
+    :param retries: how many times to retry a page that failed
+    :param journal: optional CrawlJournal to record pages in and to skip pages already scraped
+    :param delta: optional DeltaCrawl, only pages whose listing changed since the previous crawl are extracted
+    :return: list of PageTask, with the timing of every page. A category with a page that failed every attempt is
+             not saved, its previous file is kept. '''
+
+    tasks, expanded = expand_crawl(categories, journal)
+
+    # The number of unfinished pages of every category, the worker finishing the last page saves the category. A
+    # category's count goes up by the pages of each subcategory as they are counted.
+    category_tasks = {category: [] for category in expanded}
+    for task in tasks:
+        category_tasks[task.category].append(task)
+    unfinished = {category: len(pages) for category, pages in category_tasks.items()}
+    failed_categories = []
+    lock = threading.Lock()
+
+    # A category without any subcategories is saved as an empty file, the same as scrape_products() does
+    for category in expanded:
+        if not category_tasks[category]:
+            save_category_pages(category, [], journal)
+
+    def on_finished(task, added):
+        with lock:
+            category_tasks[task.category].extend(added)
+            unfinished[task.category] += len(added) - 1
+            if unfinished[task.category]:
+                return
+        pages = category_tasks[task.category]
+        try:
+            saved = save_category_pages(task.category, pages, journal)
+        except Exception as e:
+            # A worker thread can't raise, fail the category so the journal is kept
+            print('Failed to save ' + task.category + ': ' + repr(e))
+            for page in pages:
+                page.error = e
+                page.products = None
+            saved = False
+        if not saved:
+            with lock:
+                failed_categories.append(task.category)
+
+    run_page_tasks(tasks, workers, retries, journal, delta, on_finished, max_num_pages)
+
+    # Report pages and categories that failed and the slowest pages
+    for task in tasks:
+        if task.error is not None:
+            print('Failed after ' + str(task.attempts) + ' attempts: ' + task.url + ' ' + repr(task.error))
+    for category in failed_categories:
+        print('Not saved, pages failed: ' + category)
+    timed = sorted((task for task in tasks if task.seconds is not None), key=lambda task: task.seconds, reverse=True)
+    for task in timed[:10]:
+        print('{:.2f}s {}'.format(task.seconds, task.url))
+
+    return tasks
 
 if __name__ == '__main__':
-    scrape_all_products()
+    import argparse
+    parser = argparse.ArgumentParser(description='Scrape product data from Coles.com.au')
+    parser.add_argument('--workers', type=int, default=1, help='number of browsers to scrape pages with in parallel')
+    parser.add_argument('--resume', action='store_true', help='resume a crawl that failed, skipping pages already scraped')
+    parser.add_argument('--delta', action='store_true', help='only extract pages that changed since the previous crawl')
+    parser.add_argument('--site-url', help='scrape this copy of the site instead, e.g. a replay server')
+    parser.add_argument('--record', metavar='DIRECTORY', help='save every page extracted to replay it later')
+    args = parser.parse_args()
+    if args.site_url:
+        set_site_url(args.site_url)
+    if args.record:
+        start_recording(args.record)
+    try:
+        scrape_all_products(workers=args.workers, resume=args.resume, delta=args.delta)
+    finally:
+        if recording is not None:
+            recording.close()
+
+    # Timing and counts of the crawl, if instrumentation is enabled (see instrumentation.py)
+    instrumentation.export('scrape_coles')
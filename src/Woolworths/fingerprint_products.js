@@ -0,0 +1,32 @@
+/*
+
+  This script is injected into a page of products by a delta crawl, see scraping/delta.py, e.g.
+  https://www.woolworths.com.au/shop/browse/fruit-veg?pageNumber=1
+
+  It returns just enough of the product listing to tell whether the page changed since the previous crawl - the name,
+  price, unit price and 'was' price of every product, and the URL of the next page - as a JSON encoded string.
+
+  It is much cheaper than scrape_products.js, which only needs to run if the listing changed.
+
+*/
+
+var listing = [];
+
+// All products are contained in divs with the class 'shelfProductTile-content'
+var products = document.getElementsByClassName('shelfProductTile-content');
+for (var i=0; i < products.length; i++) {
+  var fields = ['shelfProductTile-descriptionLink', 'price-dollars', 'price-cents', 'shelfProductTile-cupPrice',
+                'shelfProductTile-wasPrice'];
+  var product = [];
+  for (var j=0; j < fields.length; j++) {
+    var element = products[i].getElementsByClassName(fields[j]);
+    product.push(element.length > 0 ? element[0].textContent.trim() : null);
+  }
+  listing.push(product);
+}
+
+// A change to the next page link changes the rest of the category
+var nextPage = document.getElementsByClassName('paging-next _pagingNext');
+listing.push(nextPage.length > 0 ? nextPage[0].href : 'NONE');
+
+return JSON.stringify(listing);
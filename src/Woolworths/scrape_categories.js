@@ -18,9 +18,9 @@ var category_elements = document.getElementsByClassName('categoryHeader-navigati
 for (var i=0; i < category_elements.length; i++) {
   // Get category URL
   var url = category_elements[i].href;
-  // Extract category name from URL
-  var category = url.replace('https://www.woolworths.com.au/shop/browse/', '')
-  category = category.replace('http://www.woolworths.com.au/shop/browse/', '')
+  // Extract category name from URL (the origin of the page, so this also works on a copy of the site)
+  var category = url.replace(window.location.origin + '/shop/browse/', '')
+  category = category.replace(window.location.origin.replace('https:', 'http:') + '/shop/browse/', '')
   categories.push(category);
 }
 
@@ -0,0 +1,101 @@
+/*
+
+    We don't currently use nutritional information in our data analysis.
+
+    This script is run with execute_async_script() on a page of products that is already loaded, e.g.
+    https://www.woolworths.com.au/shop/browse/fruit-veg?pageNumber=1
+
+    Instead of navigating the browser to every product page in turn, it downloads the HTML of many product pages from
+    inside the listing page with fetch(), parses each one with DOMParser and runs the extraction logic of
+    scrape_nutrition.js on the parsed page. The Python script puts the source of scrape_nutrition.js in place of the
+    marker below, inside a function whose 'document' parameter is the parsed product page.
+
+    Downloads are throttled in the page: one is started every 'interval' milliseconds (the rate limiter's current rate,
+    the Python script has already taken the rate limiter tokens of the whole batch) and at most 'concurrency' run at
+    once. No images, stylesheets or scripts of the product pages are loaded, and all results come back in one call.
+
+    Arguments: array of product URLs, the most product pages to download at once, the milliseconds between the starts
+    of two downloads, the milliseconds after which to give up and call back with what has finished (so the call ends
+    before Selenium's script timeout), and Selenium's callback.
+
+    It calls back with an array with one object per product URL, in the same order:
+    {
+      url     - the product URL (text)
+      started - whether the download was started before giving up (boolean)
+      status  - the HTTP status code, 0 if the request itself failed or didn't finish (number)
+      seconds - how long the download took, or has taken so far (number)
+      result  - the JSON encoded string scrape_nutrition.js returned for the page, if the page was extracted (text)
+      error   - what went wrong, if the page couldn't be extracted (text)
+    }
+
+*/
+
+var urls = arguments[0];
+var concurrency = arguments[1];
+var interval = arguments[2];
+var timeout = arguments[3];
+var callback = arguments[arguments.length - 1];
+
+// scrape_nutrition.js, run against a parsed product page instead of the current page
+function extract(document) {
+/* NUTRITION SCRIPT */
+}
+
+var parser = new DOMParser();
+var results = urls.map(function (url) { return {url: url, started: false, status: 0, seconds: 0}; });
+var starts = new Array(urls.length);
+var next = 0;         // index of the next URL to download
+var running = 0;      // downloads running
+var finished = 0;     // downloads finished
+var lastStart = null; // when the last download was started
+var done = false;
+
+function finish() {
+  if (done) return;
+  done = true;
+  var now = performance.now();
+  results.forEach(function (result, i) {
+    if (result.started && result.result === undefined && result.error === undefined) {
+      result.seconds = (now - starts[i]) / 1000;
+      result.error = 'timed out';
+    }
+  });
+  callback(results);
+}
+
+function schedule() {
+  if (done) return;
+  if (finished == urls.length) return finish();
+  if (next >= urls.length || running >= concurrency) return;
+  var wait = lastStart === null ? 0 : lastStart + interval - performance.now();
+  if (wait > 0) return setTimeout(schedule, wait);
+  start(next++);
+  schedule();
+}
+
+function start(i) {
+  running++;
+  lastStart = starts[i] = performance.now();
+  results[i].started = true;
+  fetch(urls[i], {credentials: 'same-origin'})
+    .then(function (response) {
+      results[i].status = response.status;
+      if (!response.ok) throw new Error('HTTP ' + response.status);
+      return response.text();
+    })
+    .then(function (html) {
+      results[i].result = extract(parser.parseFromString(html, 'text/html'));
+    })
+    .catch(function (e) {
+      results[i].error = String(e);
+    })
+    .then(function () {
+      results[i].seconds = (performance.now() - starts[i]) / 1000;
+      running--;
+      finished++;
+      schedule();
+    });
+}
+
+setTimeout(finish, timeout);
+schedule();
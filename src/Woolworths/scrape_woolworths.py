@@ -5,87 +5,366 @@
     If you run this file it will scrape a sample of products - one page per category.
 
     We use several Javascript files. The Javascript is injected into a web page, extracts data and returns it as a JSON
-    encoded string. Data is saved to the 'src/Datasets' folder as a JSON file with the name of the category.
+    encoded string. Data is saved to the 'src/Datasets' folder as an NDJSON file (one product per line, see
+    ndjson_stream.py) with the name of the category. Products are appended to the file as soon as each page is scraped.
 
     You can use get_all_categories() to get the names of categories which you can then scrape with scrape_products()
 
-    It takes exponentially longer to retrieve nutritional information or product images because each of these require an
-    extra web request for every single product. We do not currently use nutritional info or images in our analysis.
+    Crawls keep a journal of every page they scrape in '../Datasets/Woolworths/crawl.journal'. If a crawl fails part way
+    through, run it again with resume=True (or --resume on the command line) to skip every page already scraped.
+
+    A delta crawl (delta=True, or --delta on the command line) only extracts pages whose product listing changed since
+    the previous crawl, see scraping/delta.py. Page fingerprints are kept in '../Datasets/Woolworths/pages.cache'.
+
+    scrape_products_parallel() scrapes categories with a pool of headless browsers instead of one browser, each worker
+    takes the next category from a shared queue. The number of workers is capped at MAX_WORKERS to stay polite.
+
+    Nutritional information requires an extra web request for every single product. Rather than navigating the browser
+    to every product page, the product pages of a whole page of products are downloaded and extracted in batches from
+    inside the listing page (see scrape_nutrition_batch.js), and the result for every product URL is cached across
+    crawls in '../Datasets/Woolworths/nutrition.cache'.
+
+    Product images are downloaded by a separate pool of threads while the browser carries on crawling, and each image
+    is only ever downloaded once. Images are stored under the hash of their contents, so a product's 'imgName' is not
+    the name of its file: the file is looked up by the product's 'imgSrc' in the image index, e.g.
+    read_index(IMAGE_DIRECTORY)[product['imgSrc']] (see scraping/downloads.py). We do not currently use nutritional
+    info or images in our analysis.
+
+    The scraper can be pointed at a copy of the site with set_site_url() (or --site-url, or the WOOLWORTHS_URL
+    environment variable), and can record every page it extracts with start_recording() (or --record) to replay it
+    later without the live site, see scraping/replay.py.
 
 
 '''
 
-import json, requests, time, random
+import json, time, threading, queue, os, sys
+
+# Shared scraper components live in the 'src/scraping' package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraping.rate_limiter import AdaptiveRateLimiter
+from scraping.journal import CrawlJournal
+from scraping.scripts import ScriptCache, SCRIPT_TIMEOUT
+from scraping.browser import BrowserSession
+from scraping.downloads import DownloadPipeline
+from scraping.url_cache import URLCache
+from scraping.delta import DeltaCrawl
+from scraping.replay import Recording
+from ndjson_stream import NDJSONWriter
+import instrumentation
 
 # Web scraping library
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 
-browser = webdriver.Chrome()
-base_url = 'https://www.woolworths.com.au/shop/browse/'
-
-def execute_script(filename):
+# The browser of the serial crawl, Chrome is only started once the browser is first used, see scraping/browser.py
+browser = BrowserSession()
+
+# The site to scrape, e.g. a replay server instead of Woolworths.com.au (see set_site_url())
+site_url = os.environ.get('WOOLWORTHS_URL', 'https://www.woolworths.com.au').rstrip('/')
+base_url = site_url + '/shop/browse/'
+
+# The Recording every extracted page is saved to, None unless recording (see start_recording())
+recording = None
+
+# Every request to the site goes through this rate limiter instead of sleeping a random 1-5 seconds after every page.
+# It ramps up while the site responds quickly and backs off when it slows down or fails. Shared by all workers.
+rate_limiter = AdaptiveRateLimiter()
+
+# Every injected Javascript file, read once when the scraper starts
+scripts = ScriptCache(os.path.dirname(os.path.abspath(__file__)))
+
+# Wait for pages to load inside the page and extract them in the same call (see scraping/scripts.py), set to False to
+# poll for the page with WebDriverWait and inject the extraction script afterwards instead
+EXTRACT_IN_PAGE = True
+
+# Product images are downloaded in the background into a content-addressed cache, see scraping/downloads.py
+IMAGE_DIRECTORY = '../Datasets/Woolworths/images'
+DOWNLOAD_WORKERS = 4
+
+# Nutrition info is extracted NUTRITION_BATCH_SIZE product pages at a time, downloading NUTRITION_CONCURRENCY at once,
+# and cached per product URL. Set BATCH_NUTRITION to False to visit every product page with the browser instead.
+BATCH_NUTRITION = True
+NUTRITION_BATCH_SIZE = 24
+NUTRITION_CONCURRENCY = 4
+NUTRITION_BATCH_SECONDS = SCRIPT_TIMEOUT - 5 # a batch gives up in time to return before the browser's script timeout
+nutrition_cache = URLCache('../Datasets/Woolworths/nutrition.cache')
+
+# scrape_nutrition.js inside scrape_nutrition_batch.js, built once
+nutrition_batch_script = scripts.sources['scrape_nutrition_batch.js'].replace('/* NUTRITION SCRIPT */',
+                                                                              scripts.sources['scrape_nutrition.js'])
+
+# The journal of the current crawl, see scraping/journal.py
+JOURNAL_FILENAME = '../Datasets/Woolworths/crawl.journal'
+
+# The page fingerprints of delta crawls, see scraping/delta.py, and how many unchanged pages in a row end a category
+PAGES_FILENAME = '../Datasets/Woolworths/pages.cache'
+DELTA_STOP_AFTER = 3
+
+# The most browsers we are willing to run against Woolworths.com.au at the same time
+MAX_WORKERS = 8
+
+def set_site_url(url):
+    ''' Scrape another copy of the site instead of Woolworths.com.au, e.g. a replay server (see scraping/replay.py)
+    :param url: the origin of the site, e.g. 'http://127.0.0.1:8000' '''
+    global site_url, base_url
+    site_url = url.rstrip('/')
+    base_url = site_url + '/shop/browse/'
+
+def start_recording(directory):
+    ''' Save the rendered HTML of every page extracted from now on, to replay it later (see scraping/replay.py)
+    This turns BATCH_NUTRITION off - batched nutrition info is downloaded inside the listing page, so product pages are
+    only recorded if the browser visits each of them, which is much slower.
+    :param directory: the directory of the recording
+    :return: the Recording, close() it once the crawl is done '''
+    global recording, BATCH_NUTRITION
+    recording = Recording(directory, site_url)
+    if BATCH_NUTRITION:
+        print('Recording: nutrition info is scraped by visiting every product page instead of in batches')
+    BATCH_NUTRITION = False
+    return recording
+
+def record_page(url, driver=None):
+    ''' Save the page the browser is on if recording
+    :param url: the URL the page was loaded from
+    :param driver: the browser, defaults to the module's browser '''
+    if recording is not None:
+        recording.record(driver or browser, url)
+
+def new_browser(headless=True):
+    ''' Create a new browser session for a crawl worker, Chrome is started when the session is first used
+    :param headless: boolean - run Chrome without a window
+    :return: BrowserSession, used in the same way as a Selenium webdriver '''
+    return BrowserSession(headless=headless)
+
+def execute_script(filename, driver=None):
     '''' Injects Javascript into the browser and returns JSON
-    :param filename: the name of the file containing Javascript to inject
+    :param filename: the name of the file containing Javascript to inject, read from the cache of scripts
+    :param driver: the browser to inject into, defaults to the module's browser
     :return: JSON data - can be either a list or dictionary '''
-    f = open(filename, 'r')
-    json_string = browser.execute_script(f.read())
-    f.close()
-    json_data = json.loads(json_string)
-    return json_data
-
-def save_json(filename, data):
-    ''' Saves data as a JSON file named filename
-    :param filename: the name of the file to save
-    :param data: a dictionary that will be encoded as a JSON string '''
-    f = open(filename, 'w+')
-    json_string = json.dumps(data, indent=4, sort_keys=True)
-    f.write(json_string)
-    f.close()
-
-def get_all_categories():
+    return scripts.execute(driver or browser, filename)
+
+def get_page(url, driver=None):
+    ''' Load a page in the browser once the rate limiter allows another request to the site
+    :param url: the URL of the page
+    :param driver: the browser to use, defaults to the module's browser '''
+    driver = driver or browser
+    with instrumentation.span('scrape.get_page'), rate_limiter.request(url):
+        with instrumentation.span('scrape.browser_get'):
+            driver.get(url)
+    instrumentation.count('pages_loaded')
+
+def get_all_categories(journal=None):
     ''' Returns a list of all top level / main product categories for Woolworths.com.au
+    :param journal: optional CrawlJournal, categories recorded by an earlier crawl are reused
     :return: list of all categories '''
-    browser.get('https://www.woolworths.com.au')
+    if journal and journal.done('categories', base_url):
+        return journal.get('categories', base_url)
+    get_page(site_url)
     categories = execute_script('scrape_categories.js')
+    record_page(site_url)
+    if journal:
+        journal.record('categories', base_url, categories)
     return categories
 
-def scrape_all_products(get_nutrition_info = False, save_images = False, max_num_pages=float('inf')):
+def scrape_all_products(get_nutrition_info = False, save_images = False, max_num_pages=float('inf'), workers=1, resume=False,
+                        delta=False):
     ''' Scrape all products for all categories
     :param max_num_pages: the maximum number of pages to scrape for each category
     :param get_nutrition_info: boolean - scrape product nutrition info, requires an extra web request for every product
-    :param save_images: boolean - scrape images of products, requires an extra web request for every product '''
-    all_categories = get_all_categories()
-    scrape_products(all_categories, get_nutrition_info, save_images, max_num_pages)
-
-def scrape_products(categories, get_nutrition_info = False, save_images = False, max_num_pages = float('inf')):
-    ''' Scrape data for all products under the categories provided and save as JSON file
-    :param categories: the categories to scrape products for
+    :param save_images: boolean - download product images in the background, see scraping/downloads.py
+    :param workers: the number of browsers to scrape with, more than 1 scrapes categories in parallel
+    :param resume: boolean - skip every page recorded in the journal by an earlier crawl that didn't finish
+    :param delta: boolean - only extract pages whose product listing changed since the previous crawl '''
+    journal = CrawlJournal(JOURNAL_FILENAME, resume)
+    delta = DeltaCrawl(PAGES_FILENAME, DELTA_STOP_AFTER) if delta else None
+    all_categories = get_all_categories(journal)
+    complete = False # every page of every category was scraped, see DeltaCrawl.close()
+    try:
+        if workers > 1:
+            failed = scrape_products_parallel(all_categories, workers, get_nutrition_info, save_images, max_num_pages, journal,
+                                              delta)
+        else:
+            failed = scrape_products(all_categories, get_nutrition_info, save_images, max_num_pages, journal, delta)
+        complete = not failed and max_num_pages == float('inf')
+    finally:
+        if delta:
+            delta.close(complete)
+            print(delta)
+        # The serial crawl's browser, started again if it is used again
+        browser.quit()
+
+    # Keep the journal if any category failed so the crawl can be resumed
+    if failed:
+        journal.close()
+    else:
+        journal.finish()
+
+def image_downloads():
+    ''' Start a pipeline that downloads product images in the background
+    :return: DownloadPipeline, close() it once the crawl is done '''
+    return DownloadPipeline(IMAGE_DIRECTORY, DOWNLOAD_WORKERS, rate_limiter)
+
+def category_filename(category):
+    ''' The NDJSON file the products of a category are saved to
+    (subcategories may contain slashes - which we replace have to with hyphens for the filename) '''
+    return '../Datasets/Woolworths/' + category.replace('/', '-') + '.ndjson'
+
+def scrape_page(driver, url, get_nutrition_info = False):
+    ''' Scrape one page of products in a category
+    :param driver: the browser to scrape with
+    :param url: the URL of the page
     :param get_nutrition_info: boolean - scrape product nutrition info, requires an extra web request for every product
-    :param save_images: boolean - scrape images of products, requires an extra web request for every product
-    :param max_num_pages: the maximum number of pages to scrape for each category
-    :return: none '''
-
-    # a dictionary of categories
-    # the keys are category names
-    # the values are the accumulated JSON for all products in that category
-    data = {}
-
-    items = set() # use a set of item names to avoid duplicates
-
-    # Loop through all categories
-    for category in categories:
-
-        page_number = 1
-
-        # Construct URL for first page in category
-        url = base_url + category + '?pageNumber=' + str(page_number)
-
-        data[category] = [] # JSON for all products in this category
-
+    :return: page JSON as returned by scrape_products.js '''
+
+    # Get the next page
+    get_page(url, driver)
+
+    # Selenium only waits for the HTML DOM to load.
+    # We are scraping dynamically loaded content so we have to explicitly wait until this is loaded
+    if EXTRACT_IN_PAGE:
+        # Wait inside the page until the product tiles have appeared and stopped changing, then harvest data for all
+        # products on this page in the same call. Every page has product tiles, so the last page doesn't time out.
+        page_data = scripts.execute_when_ready(driver, 'scrape_products.js', '.shelfProductTile-content')
+    else:
+        # Wait until the presence of a HTML element with the class 'paging-next' is detected
+        try:
+            timeout = 10
+            with instrumentation.span('scrape.wait'):
+                WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.CLASS_NAME, 'paging-next')))
+        except TimeoutException: # last page of category
+            pass
+
+        # Inject javascript to harvest data for all products on this page
+        page_data = execute_script('scrape_products.js', driver)
+    record_page(url, driver)
+    instrumentation.count('pages_scraped')
+
+    # Get nutrition info
+    # we didn't use this in our analysis - safe to ignore
+    if get_nutrition_info:
+        get_page_nutrition(driver, page_data['products'])
+
+    return page_data
+
+def scrape_page_delta(driver, url, delta, get_nutrition_info = False):
+    ''' Scrape one page of products in a category for a delta crawl - the page is only extracted if its product listing
+    changed since the previous crawl, otherwise the products extracted by the previous crawl are returned
+    :param driver: the browser to scrape with
+    :param url: the URL of the page
+    :param delta: the DeltaCrawl
+    :param get_nutrition_info: boolean - scrape product nutrition info of pages that changed
+    :return: tuple (page JSON as returned by scrape_products.js, boolean - whether the page changed) '''
+    get_page(url, driver)
+
+    # Fingerprint the listing once the product tiles have loaded
+    fingerprint = delta.fingerprint(scripts.execute_when_ready(driver, 'fingerprint_products.js', '.shelfProductTile-content'))
+    record_page(url, driver)
+    page_data = delta.unchanged(url, fingerprint)
+    if page_data is not None:
+        return page_data, False
+
+    # The page has already loaded, so the products can be extracted straight away
+    page_data = execute_script('scrape_products.js', driver)
+    if get_nutrition_info:
+        get_page_nutrition(driver, page_data['products'])
+    delta.record(url, fingerprint, page_data)
+    instrumentation.count('pages_scraped')
+    return page_data, True
+
+def get_page_nutrition(driver, products):
+    ''' Add nutrition info to every product on the page the browser is on, see BATCH_NUTRITION
+    :param driver: the browser, on the page the products were extracted from
+    :param products: list of product JSON as returned by scrape_products.js, updated in place '''
+    if BATCH_NUTRITION:
+        add_nutrition(driver, products)
+    else:
+        for product in products:
+            get_page(product['href'], driver)
+            product['nutrition'] = execute_script('scrape_nutrition.js', driver)['nutrition']
+            record_page(product['href'], driver)
+
+def scrape_nutrition_batch(driver, urls):
+    ''' Extract the nutrition info of a batch of product pages from inside the page the browser is on, in one round trip
+    The rate limiter tokens of the whole batch are reserved up front and the page spaces the downloads at the limiter's
+    current rate, at most NUTRITION_CONCURRENCY at once. Once the batch is back, every download's own time and status
+    are recorded with the limiter. Downloads still running after NUTRITION_BATCH_SECONDS are given up on and recorded as
+    errors, and pages not started by then are left for the next crawl.
+    :param driver: the browser, on a Woolworths.com.au page so product pages can be fetched from the same origin
+    :param urls: list of product URLs
+    :return: dictionary - key is product URL, value is the nutrition JSON, only for pages that could be extracted '''
+    interval = rate_limiter.reserve(urls[0], len(urls))
+    with instrumentation.span('scrape.nutrition_batch'):
+        results = driver.execute_async_script(nutrition_batch_script, urls, NUTRITION_CONCURRENCY, interval * 1000,
+                                              NUTRITION_BATCH_SECONDS * 1000)
+    instrumentation.count('nutrition_pages', len(urls))
+
+    nutrition = {}
+    for result in results:
+        if not result['started']:
+            continue
+        timed_out = 'result' not in result and result.get('error') == 'timed out'
+        rate_limiter.record(result['url'], result['seconds'],
+                            timed_out or result['status'] == 429 or result['status'] >= 500)
+        if 'result' in result:
+            nutrition[result['url']] = json.loads(result['result'])['nutrition']
+    return nutrition
+
+def add_nutrition(driver, products):
+    ''' Add nutrition info to every product on a page, from the cache or else with scrape_nutrition_batch()
+    Batches hold as many pages as the rate limiter's current rate allows in NUTRITION_BATCH_SECONDS, at most
+    NUTRITION_BATCH_SIZE. Products whose product page couldn't be extracted or had no nutrition info are left without it
+    and are tried again next crawl. A batch that hits the browser's script timeout is skipped and the next batch is
+    still tried.
+    :param driver: the browser, on the page the products were extracted from
+    :param products: list of product JSON as returned by scrape_products.js, updated in place '''
+    urls = [product['href'] for product in products if product.get('href')]
+    missing = [url for url in dict.fromkeys(urls) if url not in nutrition_cache]
+    while missing:
+        size = max(1, min(NUTRITION_BATCH_SIZE, int(rate_limiter.rate(missing[0]) * NUTRITION_BATCH_SECONDS)))
+        batch_urls, missing = missing[:size], missing[size:]
+        try:
+            batch = scrape_nutrition_batch(driver, batch_urls)
+        except TimeoutException as e:
+            print('Nutrition batch skipped: ' + repr(e))
+            instrumentation.count('nutrition_batches_timed_out')
+            continue
+        for url, nutrition in batch.items():
+            # An empty result may be a page that didn't render its nutrition table, don't keep it across crawls
+            if nutrition:
+                nutrition_cache.put(url, nutrition)
+    for product in products:
+        if product.get('href') in nutrition_cache:
+            product['nutrition'] = nutrition_cache.get(product['href'])
+
+def scrape_category(driver, category, items, items_lock, get_nutrition_info = False, downloads = None, max_num_pages = float('inf'), journal=None,
+                    delta=None):
+    ''' Scrape data for all products in one category and save them as an NDJSON file, products are written to the file
+    page by page as they are scraped and the file only replaces the previous one once the whole category succeeded
+    :param driver: the browser to scrape with
+    :param category: the category to scrape products for
+    :param items: a set of the names of products saved by categories that already finished, used to avoid duplicates.
+                  The names of this category's products are only added once the category is saved, so products of a
+                  category that fails aren't skipped by the other categories.
+    :param items_lock: a lock to hold while checking and updating items, items may be shared between workers
+    :param get_nutrition_info: boolean - scrape product nutrition info, requires an extra web request for every product
+    :param downloads: optional DownloadPipeline to queue the image of every product on, None to skip images. The image
+                      is found later by the product's 'imgSrc', see scraping.downloads.read_index()
+    :param max_num_pages: the maximum number of pages to scrape for this category
+    :param journal: optional CrawlJournal, every page is recorded as it is scraped and pages already recorded are skipped
+    :param delta: optional DeltaCrawl, only pages whose listing changed since the previous crawl are extracted
+    :return: the number of products saved '''
+
+    page_number = 1
+
+    # Construct URL for first page in category
+    url = base_url + category + '?pageNumber=' + str(page_number)
+
+    writer = NDJSONWriter(category_filename(category)) # products of this category are streamed to this file
+    names = set() # names of the products written to this category so far
+    unchanged_pages = 0 # number of pages in a row that were unchanged in a delta crawl
+    try:
         # Loop through all pages in this category
         while url != 'NONE':
 
@@ -93,58 +372,155 @@ def scrape_products(categories, get_nutrition_info = False, save_images = False,
             if page_number > max_num_pages:
                 break
 
-            # Get the next page
-            browser.get(url)
-
-            # Selenium only waits for the HTML DOM to load.
-            # We are scraping dynamically loaded content so we have to explicitly make Selenium wait until this is loaded
-            # Wait until the presence of a HTML element with the class 'paging-next' is detected
-            try:
-                timeout = 10
-                WebDriverWait(browser, timeout).until(EC.presence_of_element_located((By.CLASS_NAME, 'paging-next')))
-            except TimeoutException: # last page of category
-                pass
-
-            # Inject javascript to harvest data for all products on this page
-            page_data = execute_script('scrape_products.js')
-
-            # Get nutrition info / product images
-            # we didn't use these in our analysis - safe to ignore
-            if save_images or get_nutrition_info:
-
+            # Pages scraped by an earlier crawl come straight from the journal
+            page_data = journal.get('page', url) if journal else None
+            if page_data is not None and delta:
+                delta.visit(url)
+
+            # After a run of unchanged pages the rest of the category comes from the previous crawl, if it has the page
+            if page_data is None and delta and unchanged_pages >= delta.stop_after:
+                page_data = delta.reuse(url)
+
+            if page_data is None:
+                if delta:
+                    page_data, changed = scrape_page_delta(driver, url, delta, get_nutrition_info)
+                    unchanged_pages = 0 if changed else unchanged_pages + 1
+                else:
+                    page_data = scrape_page(driver, url, get_nutrition_info)
+                if journal:
+                    journal.record('page', url, page_data)
+
+            # Queue product images to be downloaded in the background
+            if downloads:
                 for product in page_data['products']:
+                    downloads.submit(product.get('imgSrc'))
 
-                    # Get product image
-                    if save_images:
-                        f = open(product['imgName'], 'wb')
-                        image = requests.get(product['imgSrc']).content
-                        f.write(image)
-                        f.close()
-                        time.sleep(random.randint(1,5))
-
-                    # Get nutrition information
-                    if get_nutrition_info:
-                        browser.get(product['href'])
-                        product['nutrition'] = execute_script('scrape_nutrition.js')['nutrition']
-                        time.sleep(random.randint(1,5))
-
-            # Add all products on this page to accumulated JSON for this category
+            # Write all new products on this page to the file for this category
             for product in page_data['products']:
-                if product['name'] not in items: # avoid duplicates
-                    items.add(product['name'])
+                with items_lock:
+                    is_new = product['name'] not in items and product['name'] not in names # avoid duplicates
+                if is_new:
+                    names.add(product['name'])
                     product['category'] = category # add category to product JSON
-                    data[category].append(product) # add product JSON to accumulated JSON for this category
-
+                    writer.write(product) # add product JSON to the file for this category
+                    instrumentation.count('products_saved')
 
             # Iterate loop
             url = page_data['nextPage']
             page_number += 1
-            time.sleep(random.randint(1,5))
+        num_products = writer.finalize()
+    except:
+        writer.abort()
+        raise
+
+    # Only now the category is saved, its products are skipped by the categories scraped after it
+    with items_lock:
+        items.update(names)
+    return num_products
+
+def scrape_products(categories, get_nutrition_info = False, save_images = False, max_num_pages = float('inf'), journal=None,
+                    delta=None):
+    ''' Scrape data for all products under the categories provided and save each category as an NDJSON file
+    :param categories: the categories to scrape products for
+    :param get_nutrition_info: boolean - scrape product nutrition info, requires an extra web request for every product
+    :param save_images: boolean - download product images in the background, see scraping/downloads.py
+    :param max_num_pages: the maximum number of pages to scrape for each category
+    :param journal: optional CrawlJournal to record pages in and to skip pages already scraped
+    :param delta: optional DeltaCrawl, only pages whose listing changed since the previous crawl are extracted
+    :return: list of categories that failed, always empty because a failed category raises an exception '''
+
+    items = set() # use a set of item names to avoid duplicates
+    items_lock = threading.Lock()
+
+    downloads = image_downloads() if save_images else None
 
-        # Save data for this category
-        # (subcategories may contain slashes - which we replace have to with hyphens for the filename)
-        filename = '../Datasets/Woolworths/' + category.replace('/', '-') + '.json'
-        save_json(filename, data[category])
+    try:
+        # Loop through all categories
+        for category in categories:
+            # Scrape and save data for this category
+            scrape_category(browser, category, items, items_lock, get_nutrition_info, downloads, max_num_pages, journal,
+                            delta)
+    finally:
+        if downloads:
+            print(downloads.close())
+
+    return []
+
+def scrape_products_parallel(categories, workers=4, get_nutrition_info = False, save_images = False, max_num_pages = float('inf'), journal=None,
+                             delta=None):
+    ''' Scrape data for all products under the categories provided with a pool of headless browsers and save each
+    category as an NDJSON file, exactly as scrape_products() does.
+
+    Each worker runs its own browser and takes the next category from a shared queue until there are none left. The
+    set of product names used to avoid duplicates across categories is shared by all workers, so a product listed in
+    several categories is saved in whichever of those categories finishes first. Categories scraped at the same time
+    can both save a product (merging and processing keep one product per name), but a category that fails never
+    makes the others skip its products.
+
+    :param categories: the categories to scrape products for
+    :param workers: the number of browsers to run at once, capped at MAX_WORKERS
+    :param get_nutrition_info: boolean - scrape product nutrition info, requires an extra web request for every product
+    :param save_images: boolean - download product images in the background, see scraping/downloads.py
+    :param max_num_pages: the maximum number of pages to scrape for each category
+    :param journal: optional CrawlJournal to record pages in and to skip pages already scraped
+    :param delta: optional DeltaCrawl, only pages whose listing changed since the previous crawl are extracted
+    :return: list of categories that failed '''
+
+    category_queue = queue.Queue()
+    for category in categories:
+        category_queue.put(category)
+
+    items = set() # use a set of item names to avoid duplicates, shared by all workers
+    items_lock = threading.Lock()
+    errors = [] # (category, exception) for every category that failed
+    downloads = image_downloads() if save_images else None # shared by all workers
+
+    def worker():
+        driver = new_browser()
+        try:
+            while True:
+                try:
+                    category = category_queue.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    scrape_category(driver, category, items, items_lock, get_nutrition_info, downloads, max_num_pages,
+                                    journal, delta)
+                except Exception as e:
+                    errors.append((category, e))
+        finally:
+            driver.quit()
+
+    threads = [threading.Thread(target=worker) for i in range(max(1, min(workers, MAX_WORKERS)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if downloads:
+        print(downloads.close())
+
+    for category, e in errors:
+        print('Failed to scrape category ' + category + ': ' + repr(e))
+    return [category for category, e in errors]
 
 if __name__ == '__main__':
-    scrape_all_products()
+    import argparse
+    parser = argparse.ArgumentParser(description='Scrape product data from Woolworths.com.au')
+    parser.add_argument('--workers', type=int, default=1, help='number of browsers to scrape categories with in parallel')
+    parser.add_argument('--resume', action='store_true', help='resume a crawl that failed, skipping pages already scraped')
+    parser.add_argument('--delta', action='store_true', help='only extract pages that changed since the previous crawl')
+    parser.add_argument('--site-url', help='scrape this copy of the site instead, e.g. a replay server')
+    parser.add_argument('--record', metavar='DIRECTORY', help='save every page extracted to replay it later')
+    args = parser.parse_args()
+    if args.site_url:
+        set_site_url(args.site_url)
+    if args.record:
+        start_recording(args.record)
+    try:
+        scrape_all_products(workers=args.workers, resume=args.resume, delta=args.delta)
+    finally:
+        if recording is not None:
+            recording.close()
+
+    # Timing and counts of the crawl, if instrumentation is enabled (see instrumentation.py)
+    instrumentation.export('scrape_woolworths')
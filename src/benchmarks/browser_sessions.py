@@ -0,0 +1,66 @@
+'''
+
+    Benchmark browser sessions with and without resource blocking (see scraping/browser.py).
+
+    Loads the same pages in a headless BrowserSession with block_resources off and then on, and prints the pages per
+    minute and the peak memory of Chrome and its processes for each. Only the time spent loading pages is counted, and
+    pages are loaded no faster than one every --delay seconds to stay polite.
+
+    Run from the 'src' folder, e.g.:
+    python benchmarks/browser_sessions.py --pages 20
+    python benchmarks/browser_sessions.py --url https://shop.coles.com.au/a/a-national/everything/browse/bakery
+
+    Memory is only measured if psutil is installed.
+
+'''
+
+import argparse, os, sys, time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scraping.browser import BrowserSession
+
+DEFAULT_URLS = [
+    'https://www.woolworths.com.au/shop/browse/fruit-veg?pageNumber=1',
+    'https://www.woolworths.com.au/shop/browse/bakery?pageNumber=1',
+    'https://shop.coles.com.au/a/a-national/everything/browse/bakery?pageNumber=1',
+    'https://shop.coles.com.au/a/a-national/everything/browse/dairy--eggs-meals?pageNumber=1',
+]
+
+def benchmark(urls, num_pages, block_resources, delay):
+    ''' Load pages in a new session and time them
+    :param urls: the URLs to load, in turn
+    :param num_pages: the number of pages to load
+    :param block_resources: boolean - block images, fonts, media and trackers
+    :param delay: the fewest seconds between starting two pages
+    :return: dictionary with pages, seconds, pages_per_minute and peak_rss_mb (None without psutil) '''
+    session = BrowserSession(headless=True, block_resources=block_resources, max_pages=num_pages + 1)
+    seconds = 0.0
+    try:
+        session.driver # start Chrome before timing
+        for i in range(num_pages):
+            start = time.time()
+            session.get(urls[i % len(urls)])
+            seconds += time.time() - start
+            session.rss_mb()
+            time.sleep(max(0, delay - (time.time() - start)))
+    finally:
+        session.quit()
+    return {
+        'pages': num_pages,
+        'seconds': seconds,
+        'pages_per_minute': num_pages / seconds * 60 if seconds else 0,
+        'peak_rss_mb': session.peak_rss_mb or None,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark browser sessions with and without resource blocking')
+    parser.add_argument('--url', action='append', help='a page to load, may be given more than once')
+    parser.add_argument('--pages', type=int, default=12, help='number of pages to load with each setting')
+    parser.add_argument('--delay', type=float, default=3.0, help='fewest seconds between starting two pages')
+    args = parser.parse_args()
+
+    for block_resources in (False, True):
+        result = benchmark(args.url or DEFAULT_URLS, args.pages, block_resources, args.delay)
+        memory = str(round(result['peak_rss_mb'])) + ' MB' if result['peak_rss_mb'] else 'unknown (install psutil)'
+        print('Blocking ' + ('on ' if block_resources else 'off') + ': ' + str(round(result['pages_per_minute'], 1))
+              + ' pages/minute, peak memory ' + memory)
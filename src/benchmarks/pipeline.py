@@ -0,0 +1,215 @@
+'''
+
+    Benchmark the processing pipeline of process.py on synthetic catalogues (see benchmarks/synthetic.py).
+
+    For each catalogue size, Woolworths and Coles catalogues with that many products each are generated (always the same
+    products for the same size and seed) and each stage of the pipeline is timed separately:
+
+    - read: read_product_json() of both catalogue files
+    - unit_prices: convert_unit_price() of every unit price string, starting with an empty parse cache
+    - matching: find_matching_products()
+    - statistics: price_statistics(), the statistics shown by analysis_and_visualisation() - the mean, median and
+      standard deviation of all prices, and the t-test, bootstrap confidence interval and breakdown by category of the
+      price differences of matched products. No plots are drawn.
+
+    The wall time and the peak memory allocated by Python (measured with tracemalloc, which also counts Numpy arrays) of
+    every stage are saved with the versions of Python and the libraries to a JSON results file. Pass the results file
+    of an earlier run to --compare to print how much faster or slower each stage got.
+
+    Scoring every Woolworths x Coles pair grows with the square of the catalogue size, so catalogues larger than
+    --max-exhaustive products are matched with blocking (matching.Blocking) instead. The results file records which.
+
+    --check-blocking matches catalogues of each size both with blocking and exhaustively and exits with status 1 if
+    blocking lost any match, instead of timing the pipeline. Blocking must find exactly the same matches.
+
+    Run from the 'src' folder, e.g.:
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --sizes 1000,10000 --compare benchmarks/results/pipeline-20210301-120000.json
+    python benchmarks/pipeline.py --sizes 3000 --check-blocking
+
+'''
+
+import argparse, gc, json, os, platform, subprocess, sys, tempfile, time, tracemalloc
+import numpy as np
+import scipy, scipy.special
+# stats_engine and matching import scipy.special and scikit-learn the first time they use them, imported here so the
+# imports aren't timed
+import sklearn.feature_extraction.text
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import matching, process, unit_prices
+import synthetic
+
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def measure(function, *args, trace_memory=True, **kwargs):
+    ''' Call a function and measure its wall time and peak memory
+    :param trace_memory: boolean - measure the peak memory, tracing allocations makes the function a little slower
+    :return: tuple (return value of the function, dictionary with seconds and peak_memory_mb) '''
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024 if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, {'seconds': seconds, 'peak_memory_mb': peak_memory_mb}
+
+def read_catalogues(woolworths_filename, coles_filename):
+    return process.read_product_json(woolworths_filename), process.read_product_json(coles_filename)
+
+def convert_unit_prices(strings):
+    # Parsing is memoized, start from an empty cache so every run does the same work
+    unit_prices.parse_unit_price.cache_clear()
+    return [process.convert_unit_price(s) for s in strings]
+
+def benchmark(num_products, seed=0, similarity_threshold=0.5, max_exhaustive=20000, workers=1, trace_memory=True):
+    ''' Generate catalogues of one size and time each stage of the pipeline on them
+    :param num_products: the number of products in each catalogue
+    :param max_exhaustive: catalogues with more products than this are matched with blocking
+    :param workers: the number of processes find_matching_products() scores similarities with
+    :return: dictionary with the size, the matching mode, the number of matches and the time and memory of each stage '''
+    run = {'size': num_products, 'seed': seed, 'similarity_threshold': similarity_threshold, 'workers': workers, 'stages': {}}
+    directory = tempfile.mkdtemp(prefix='grocery-benchmark-')
+    try:
+        start = time.perf_counter()
+        woolworths_filename, coles_filename = synthetic.write_catalogues(directory, num_products, seed)
+        run['generate_seconds'] = time.perf_counter() - start
+
+        (woolworths, coles), run['stages']['read'] = measure(read_catalogues, woolworths_filename, coles_filename,
+                                                             trace_memory=trace_memory)
+        run['woolworths_products'] = len(woolworths)
+        run['coles_products'] = len(coles)
+
+        strings = [s for s in process.unit_price_strings(woolworths, 'unitPrice') + process.unit_price_strings(coles, 'price') if s]
+        converted, run['stages']['unit_prices'] = measure(convert_unit_prices, strings, trace_memory=trace_memory)
+        run['unit_price_strings'] = len(strings)
+        run['unit_prices_failed'] = sum(1 for parsed in converted if parsed is None)
+
+        blocking = matching.Blocking() if num_products > max_exhaustive else None
+        run['matching_mode'] = 'exhaustive' if blocking is None else 'blocked'
+        matching_products, run['stages']['matching'] = measure(process.find_matching_products, woolworths, coles,
+                                                               similarity_threshold, print_to_console=False,
+                                                               blocking=blocking, workers=workers, trace_memory=trace_memory)
+        run['matches'] = len(matching_products)
+
+        # The same prices compare_products() passes to analysis_and_visualisation()
+        all_woolworths_prices, all_coles_prices = process.all_prices(woolworths, coles)
+        _, run['stages']['statistics'] = measure(process.price_statistics, matching_products, all_woolworths_prices,
+                                                 all_coles_prices, trace_memory=trace_memory)
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    return run
+
+def check_blocking(num_products, seed=0, similarity_threshold=0.5):
+    ''' Match synthetic catalogues of one size with blocking, verified against exhaustive matching
+    :return: matching.BlockingReport, its lost_matches must be 0 '''
+    woolworths, coles = synthetic.generate_catalogues(num_products, seed)
+    woolworths_names = [product['name'] for product in woolworths]
+    coles_names = [product['name'] for product in coles]
+    return matching.blocked_pairs(woolworths_names, coles_names, similarity_threshold, matching.Blocking(verify=True))[3]
+
+def environment():
+    ''' The versions of Python and the libraries and the git commit the benchmark was run with '''
+    import sklearn
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+    }
+
+def compare(results, previous):
+    ''' Print the time and memory of each stage relative to an earlier results file
+    :param results: the results of this run
+    :param previous: the results of the earlier run '''
+    previous_runs = {run['size']: run for run in previous['runs']}
+    print('Compared to ' + previous['timestamp'] + ' (commit ' + str(previous['environment'].get('commit')) + '):')
+    if previous.get('traced_memory') != results['traced_memory']:
+        print('  (memory was traced in only one of the runs, which makes its times a little slower)')
+    for run in results['runs']:
+        if run['size'] not in previous_runs:
+            continue
+        previous_run = previous_runs[run['size']]
+        if previous_run.get('matching_mode') != run['matching_mode']:
+            print('  ' + str(run['size']) + ' products: matched ' + str(previous_run.get('matching_mode')) + ' before, '
+                  + run['matching_mode'] + ' now')
+        for stage, measured in run['stages'].items():
+            before = previous_run['stages'].get(stage)
+            if before is None or not before['seconds']:
+                continue
+            ratio = measured['seconds'] / before['seconds']
+            line = '  ' + str(run['size']).rjust(7) + ' ' + stage.ljust(12) + ' time x' + str(round(ratio, 2))
+            if measured['peak_memory_mb'] and before['peak_memory_mb']:
+                line += ', memory x' + str(round(measured['peak_memory_mb'] / before['peak_memory_mb'], 2))
+            print(line + (' (slower)' if ratio > 1.1 else ' (faster)' if ratio < 0.9 else ''))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the processing pipeline on synthetic catalogues')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='comma separated numbers of products in each catalogue')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic catalogues')
+    parser.add_argument('--threshold', type=float, default=0.5, help='similarity threshold for matching')
+    parser.add_argument('--workers', type=int, default=1, help='processes to score similarities with')
+    parser.add_argument('--max-exhaustive', type=int, default=20000,
+                        help='match catalogues with more products than this with blocking')
+    parser.add_argument('--no-memory', action='store_true', help="don't trace memory, tracing slows down every stage")
+    parser.add_argument('--output', help='results file, by default benchmarks/results/pipeline-<date>-<time>.json')
+    parser.add_argument('--compare', help='an earlier results file to compare with')
+    parser.add_argument('--check-blocking', action='store_true',
+                        help='check blocking finds every match of exhaustive matching instead of benchmarking')
+    args = parser.parse_args()
+
+    if args.check_blocking:
+        lost = 0
+        for size in [int(size) for size in args.sizes.split(',')]:
+            report = check_blocking(size, args.seed, args.threshold)
+            print(str(size) + ' products: ' + str(report.candidate_pairs) + ' candidate pairs, '
+                  + str(report.lost_matches) + ' matches lost')
+            lost += report.lost_matches
+        sys.exit(1 if lost else 0)
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'traced_memory': not args.no_memory,
+        'runs': [],
+    }
+    for size in [int(size) for size in args.sizes.split(',')]:
+        run = benchmark(size, args.seed, args.threshold, args.max_exhaustive, args.workers, not args.no_memory)
+        results['runs'].append(run)
+        print(str(size) + ' products (' + str(run['matches']) + ' matches, ' + run['matching_mode'] + ' matching):')
+        for stage, measured in run['stages'].items():
+            line = '  ' + stage.ljust(12) + str(round(measured['seconds'], 3)).rjust(9) + ' s'
+            if measured['peak_memory_mb'] is not None:
+                line += str(round(measured['peak_memory_mb'], 1)).rjust(10) + ' MB peak'
+            print(line)
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, 'pipeline-' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    f = open(output, 'w')
+    json.dump(results, f, indent=2)
+    f.close()
+    print('Results saved to ' + output)
+
+    if args.compare:
+        f = open(args.compare)
+        previous = json.load(f)
+        f.close()
+        compare(results, previous)
@@ -0,0 +1,180 @@
+'''
+
+    Benchmark the scrapers offline against a recorded crawl (see scraping/replay.py).
+
+    The recording is served by a local ReplayServer with the given latency and jitter, and the scraper is pointed at it
+    with set_site_url(). Then:
+
+    - a crawl of every recorded category (up to --pages pages per category or subcategory) is timed once for every
+      number of workers in --workers, giving pages per minute and how well the crawl scales with more browsers
+    - the extraction scripts are timed on their own, injected again and again into recorded listing pages that are
+      already loaded, giving the milliseconds each script takes per page
+
+    The rate limiter is replaced with one allowing --rate requests per second, so the crawl runs as fast as the replay
+    server and the browsers allow. Scraped products are written to a temporary directory, not to 'src/Datasets'.
+    Results are printed and saved to a JSON results file.
+
+    Run from the 'src' folder, e.g.:
+    python benchmarks/scrapers.py woolworths Datasets/recordings/woolworths --workers 1,2,4 --latency 0.3 --jitter 0.1
+    python benchmarks/scrapers.py coles Datasets/recordings/coles --pages 2
+
+'''
+
+import argparse, importlib.util, json, os, platform, shutil, sys, tempfile, time
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(SRC_DIRECTORY)
+from scraping.browser import BrowserSession
+from scraping.rate_limiter import AdaptiveRateLimiter
+from scraping.replay import ReplayServer
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# The scraper of each store, the extraction scripts to time and the element every listing page has once it has loaded
+STORES = {
+    'woolworths': {
+        'scraper': os.path.join('Woolworths', 'scrape_woolworths.py'),
+        'directory': 'Woolworths',
+        'scripts': ['scrape_products.js', 'fingerprint_products.js'],
+        'ready_selector': '.shelfProductTile-content',
+    },
+    'coles': {
+        'scraper': os.path.join('Coles', 'scrape_coles.py'),
+        'directory': 'Coles',
+        'scripts': ['scrape_products.js', 'get_num_pages.js', 'fingerprint_products.js'],
+        'ready_selector': '#product-list, .product-list',
+    },
+}
+
+def load_scraper(store, site_url, rate):
+    ''' Import the scraper of a store and point it at a replay server
+    Must be called from the directory the scraper writes its '../Datasets/' files relative to
+    :param store: 'woolworths' or 'coles'
+    :param site_url: the URL of the replay server
+    :param rate: requests per second the rate limiter allows
+    :return: the scraper module '''
+    spec = importlib.util.spec_from_file_location('scrape_' + store, os.path.join(SRC_DIRECTORY, STORES[store]['scraper']))
+    scraper = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(scraper)
+    scraper.set_site_url(site_url)
+    scraper.rate_limiter = AdaptiveRateLimiter(initial_rate=rate, max_rate=rate, burst=max(1, int(rate)))
+    return scraper
+
+def crawl(store, scraper, categories, workers, max_num_pages):
+    ''' Crawl categories with a number of browsers, the same way scrape_all_products() does '''
+    if store == 'woolworths':
+        if workers > 1:
+            scraper.scrape_products_parallel(categories, workers, max_num_pages=max_num_pages)
+        else:
+            scraper.scrape_products(categories, max_num_pages=max_num_pages)
+    else:
+        if workers > 1:
+            scraper.scrape_products_scheduled(categories, workers, max_num_pages)
+        else:
+            scraper.scrape_products(categories, max_num_pages)
+    scraper.browser.quit()
+
+def benchmark_crawls(store, scraper, server, worker_counts, max_num_pages):
+    ''' Time a crawl of every category with each number of workers
+    :return: list of dictionaries with workers, pages, seconds and pages_per_minute '''
+    categories = scraper.get_all_categories()
+    scraper.browser.quit()
+    results = []
+    for workers in worker_counts:
+        served = server.served + server.missing
+        start = time.perf_counter()
+        crawl(store, scraper, categories, workers, max_num_pages)
+        seconds = time.perf_counter() - start
+        pages = server.served + server.missing - served
+        results.append({
+            'workers': workers,
+            'pages': pages,
+            'seconds': seconds,
+            'pages_per_minute': pages / seconds * 60 if seconds else 0,
+        })
+    return results
+
+def benchmark_scripts(store, scraper, server, num_pages, repeat):
+    ''' Time the extraction scripts on recorded listing pages that are already loaded
+    :param num_pages: the most listing pages to time the scripts on
+    :param repeat: how many times each script is run on each page
+    :return: dictionary - key is the script, value is the mean milliseconds per run '''
+    urls = sorted(url for url in server.recording.urls() if 'pageNumber=' in url)[:num_pages]
+    seconds = {filename: 0.0 for filename in STORES[store]['scripts']}
+    runs = 0
+    session = BrowserSession(headless=True)
+    try:
+        for url in urls:
+            session.get(server.url + url)
+            # Wait until the page is ready, once, so only the scripts themselves are timed
+            scraper.scripts.execute_when_ready(session, 'fingerprint_products.js', STORES[store]['ready_selector'])
+            for i in range(repeat):
+                for filename in seconds:
+                    start = time.perf_counter()
+                    scraper.scripts.execute(session, filename)
+                    seconds[filename] += time.perf_counter() - start
+            runs += repeat
+    finally:
+        session.quit()
+    return {filename: total / runs * 1000 if runs else None for filename, total in seconds.items()}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark a scraper against a recorded crawl')
+    parser.add_argument('store', choices=sorted(STORES), help='the scraper to benchmark')
+    parser.add_argument('recording', help='the directory of the recording')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated numbers of browsers to crawl with')
+    parser.add_argument('--pages', type=int, default=3, help='most pages to crawl per category or subcategory')
+    parser.add_argument('--latency', type=float, default=0.3, help='seconds the replay server waits before responding')
+    parser.add_argument('--jitter', type=float, default=0.1, help='the most seconds the wait randomly differs by')
+    parser.add_argument('--rate', type=float, default=100.0, help='requests per second the rate limiter allows')
+    parser.add_argument('--script-pages', type=int, default=10, help='listing pages to time the extraction scripts on')
+    parser.add_argument('--repeat', type=int, default=5, help='times to run each extraction script on each page')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the jitter')
+    parser.add_argument('--output', help='results file, by default benchmarks/results/<store>-<date>-<time>.json')
+    args = parser.parse_args()
+
+    recording = os.path.abspath(args.recording)
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIRECTORY, args.store + '-' + time.strftime('%Y%m%d-%H%M%S')
+                                                         + '.json'))
+    server = ReplayServer(recording, args.latency, args.jitter, seed=args.seed)
+    server.start()
+
+    # The scraper writes to '../Datasets/<store>/', which is inside the temporary directory
+    directory = tempfile.mkdtemp(prefix='scraper-benchmark-')
+    os.makedirs(os.path.join(directory, 'Datasets', STORES[args.store]['directory']))
+    os.makedirs(os.path.join(directory, 'work'))
+    os.chdir(os.path.join(directory, 'work'))
+    try:
+        scraper = load_scraper(args.store, server.url, args.rate)
+        crawls = benchmark_crawls(args.store, scraper, server, [int(n) for n in args.workers.split(',')], args.pages)
+        script_ms = benchmark_scripts(args.store, scraper, server, args.script_pages, args.repeat)
+    finally:
+        os.chdir(SRC_DIRECTORY)
+        shutil.rmtree(directory)
+        server.close()
+
+    for result in crawls:
+        print(str(result['workers']) + ' workers: ' + str(result['pages']) + ' pages in ' + str(round(result['seconds'], 1))
+              + ' s, ' + str(round(result['pages_per_minute'], 1)) + ' pages/minute')
+    for filename, ms in script_ms.items():
+        print(filename + ': ' + (str(round(ms, 1)) + ' ms per page' if ms is not None else 'no listing pages recorded'))
+    print(server)
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'store': args.store,
+        'recording': recording,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'rate': args.rate,
+        'max_pages': args.pages,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'crawls': crawls,
+        'scripts_ms': script_ms,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    f = open(output, 'w')
+    json.dump(results, f, indent=2)
+    f.close()
+    print('Results saved to ' + output)
@@ -0,0 +1,214 @@
+'''
+
+    A deterministic generator of synthetic Woolworths and Coles catalogues for benchmarks.
+
+    Products are drawn from one shared catalogue of made up products, so a realistic share of products is sold by both
+    stores under slightly different names, the same way real products are:
+
+    - Woolworths names include the brand and the package size, e.g. 'Bega Tasty Cheese Block 500g'. Products have a
+      price in dollars, a unitPrice string such as '$10.00 / 1KG' and, if on special, a special price.
+    - Coles names leave out the brand, which is a separate field, e.g. 'Tasty Cheese Block'. Products have a unit price
+      string in the 'price' field such as '$22.50 per 1Kg' and a special flag of 'True' or 'False'.
+
+    The same size and seed always produce exactly the same products.
+
+'''
+
+import json, os, random
+
+BRANDS = ['Coles', 'Woolworths', 'Macro', 'Bega', 'Devondale', 'Pauls', 'Dairy Farmers', 'Helga\'s', 'Tip Top',
+          'San Remo', 'Barilla', 'SunRice', 'Moccona', 'Lipton', 'Arnott\'s', 'Cadbury', 'Kellogg\'s', 'Uncle Tobys',
+          'Heinz', 'Masterfoods', 'Leggo\'s', 'Continental', 'Golden Circle', 'Sanitarium', 'Streets', 'Peters',
+          'Ingham\'s', 'Steggles', 'John West', 'Sirena', 'Lurpak', 'Western Star', 'Mainland', 'Chobani', 'Jalna']
+
+# (product, unit the product is sold by, package sizes, typical price per kg / litre / each)
+PRODUCTS = [
+    ('Tasty Cheese Block', 'g', [250, 500, 1000], 12.0),
+    ('Light Cheese Slices', 'g', [250, 500], 16.0),
+    ('Full Cream Milk', 'mL', [1000, 2000, 3000], 1.6),
+    ('Lite Milk', 'mL', [1000, 2000], 1.7),
+    ('Salted Butter', 'g', [250, 500], 14.0),
+    ('Greek Yoghurt', 'g', [170, 500, 1000], 7.0),
+    ('Natural Yoghurt', 'g', [500, 1000], 5.5),
+    ('Free Range Eggs', 'each', [6, 12], 0.6),
+    ('Wholemeal Bread', 'g', [650, 700], 5.0),
+    ('White Sandwich Bread', 'g', [650, 700], 4.0),
+    ('Sourdough Loaf', 'g', [500, 800], 9.0),
+    ('Spaghetti Pasta', 'g', [500, 1000], 3.5),
+    ('Penne Rigate', 'g', [500], 3.8),
+    ('Basmati Rice', 'g', [1000, 2000, 5000], 3.0),
+    ('Jasmine Rice', 'g', [1000, 5000], 2.8),
+    ('Instant Coffee', 'g', [100, 200, 400], 60.0),
+    ('Coffee Beans', 'g', [250, 500, 1000], 40.0),
+    ('Black Tea Bags', 'each', [50, 100], 0.08),
+    ('White Sugar', 'g', [1000, 2000], 1.6),
+    ('Plain Flour', 'g', [1000, 2000], 1.4),
+    ('Self Raising Flour', 'g', [1000], 1.6),
+    ('Chicken Breast Fillets', 'g', [500, 1000], 11.0),
+    ('Lean Beef Mince', 'g', [500, 1000], 13.0),
+    ('Tuna In Springwater', 'g', [95, 185, 425], 20.0),
+    ('Orange Juice', 'mL', [1000, 2000], 3.0),
+    ('Apple Juice', 'mL', [1000, 2000], 2.5),
+    ('Corn Flakes', 'g', [380, 725], 9.0),
+    ('Rolled Oats', 'g', [750, 1000], 5.0),
+    ('Tomato Sauce', 'mL', [500, 1000], 6.0),
+    ('Baked Beans', 'g', [220, 420], 5.5),
+    ('Milk Chocolate Block', 'g', [180, 350], 25.0),
+    ('Chocolate Chip Cookies', 'g', [200, 300], 18.0),
+    ('Vanilla Ice Cream', 'mL', [1000, 2000], 4.5),
+    ('Extra Virgin Olive Oil', 'mL', [500, 750, 1000], 16.0),
+    ('Bananas', 'kg', [1], 3.5),
+    ('Royal Gala Apples', 'kg', [1], 5.0),
+    ('Avocado', 'each', [1], 2.0),
+    ('Dishwashing Liquid', 'mL', [500, 1000], 6.0),
+    ('Toilet Tissue', 'each', [12, 24], 0.5),
+    ('Laundry Powder', 'g', [1000, 2000], 9.0),
+]
+
+VARIANTS = ['', 'Organic', 'Lite', 'Reduced Fat', 'Original', 'Family Pack', 'Value', 'Premium', 'Extra Large',
+            'Gluten Free', 'Australian', 'Classic', 'Smooth', 'Crunchy', 'Honey', 'Spicy', 'Mild', 'No Added Sugar']
+
+CATEGORIES = {
+    'Woolworths': ['fruit-veg', 'meat-seafood-deli', 'bakery', 'dairy-eggs-fridge', 'pantry', 'freezer', 'drinks',
+                   'household'],
+    'Coles': ['fruit-vegetables', 'meat-seafood-deli', 'bread-bakery', 'dairy-eggs-meals', 'pantry', 'frozen',
+              'drinks', 'household'],
+}
+
+def package_size(size, unit):
+    ''' The package size as written on the shelf, e.g. 500g, 2L or 12 pack '''
+    if unit == 'g':
+        return str(size // 1000) + 'kg' if size >= 1000 and size % 1000 == 0 else str(size) + 'g'
+    if unit == 'mL':
+        return str(size // 1000) + 'L' if size >= 1000 and size % 1000 == 0 else str(size) + 'mL'
+    if unit == 'kg':
+        return 'per kg'
+    return str(size) + ' pack'
+
+def catalogue_item(rng, index):
+    ''' One made up product of the shared catalogue
+    :param rng: random.Random
+    :param index: the number of the product, makes the names of products that are otherwise the same unique
+    :return: dictionary '''
+    product, unit, sizes, price_per_unit = PRODUCTS[rng.randrange(len(PRODUCTS))]
+    variant = rng.choice(VARIANTS)
+    # Most real product names are unique, a number stands in for all of the variety of real names
+    name = ' '.join(word for word in [variant, product, str(index) if rng.random() < 0.9 else ''] if word)
+    size = rng.choice(sizes)
+    # Prices spread around the typical price per unit
+    price_per_unit *= rng.lognormvariate(0, 0.35)
+    if unit == 'g' or unit == 'mL':
+        price = price_per_unit * size / 1000
+    else:
+        price = price_per_unit * size
+    return {
+        'name': name,
+        'brand': rng.choice(BRANDS),
+        'unit': unit,
+        'size': size,
+        'price': max(0.5, round(price, 2)),
+        'category': rng.randrange(len(CATEGORIES['Coles'])),
+    }
+
+def woolworths_unit_price(item, price):
+    ''' A Woolworths unit price string, e.g. '$10.00 / 1KG', '$1.50 / 100G', '$0.50 / 1EA' '''
+    if item['unit'] == 'g':
+        if item['size'] < 1000:
+            return '${:.2f} / 100G'.format(price / item['size'] * 100)
+        return '${:.2f} / 1KG'.format(price / item['size'] * 1000)
+    if item['unit'] == 'mL':
+        if item['size'] < 1000:
+            return '${:.2f} / 100ML'.format(price / item['size'] * 100)
+        return '${:.2f} / 1L'.format(price / item['size'] * 1000)
+    if item['unit'] == 'kg':
+        return '${:.2f} / 1KG'.format(price)
+    return '${:.2f} / 1EA'.format(price / item['size'])
+
+def coles_unit_price(item, price):
+    ''' A Coles unit price string, e.g. '$22.50 per 1Kg', '$2.00 per 100g', '$0.50 per 1Ea' '''
+    if item['unit'] == 'g':
+        if item['size'] < 1000:
+            return '${:.2f} per 100g'.format(price / item['size'] * 100)
+        return '${:.2f} per 1Kg'.format(price / item['size'] * 1000)
+    if item['unit'] == 'mL':
+        if item['size'] < 1000:
+            return '${:.2f} per 100mL'.format(price / item['size'] * 100)
+        return '${:.2f} per 1L'.format(price / item['size'] * 1000)
+    if item['unit'] == 'kg':
+        return '${:.2f} per 1Kg'.format(price)
+    return '${:.2f} per 1Ea'.format(price / item['size'])
+
+def woolworths_product(rng, item):
+    ''' A product as scrape_woolworths.py saves it '''
+    price = round(item['price'] * rng.uniform(0.9, 1.1), 2)
+    product = {
+        'name': item['brand'] + ' ' + item['name'] + ' ' + package_size(item['size'], item['unit']),
+        'category': CATEGORIES['Woolworths'][item['category']],
+        'href': 'https://www.woolworths.com.au/shop/productdetails/' + str(rng.randrange(10 ** 6)),
+    }
+    if rng.random() < 0.15: # on special
+        product['special'] = round(price * rng.uniform(0.5, 0.9), 2)
+        # the normal price isn't always displayed for products on special
+        if rng.random() < 0.7:
+            product['price'] = price
+        unit_price = product['special']
+    else:
+        product['price'] = price
+        unit_price = price
+    if rng.random() < 0.95: # some products don't display a unit price
+        product['unitPrice'] = woolworths_unit_price(item, unit_price)
+    return product
+
+def coles_product(rng, item):
+    ''' A product as scrape_coles.py saves it '''
+    price = round(item['price'] * rng.uniform(0.9, 1.1), 2)
+    special = rng.random() < 0.15
+    if special:
+        price = round(price * rng.uniform(0.5, 0.9), 2)
+    category = CATEGORIES['Coles'][item['category']]
+    product = {
+        'name': item['name'],
+        'brand': item['brand'],
+        'package_size': package_size(item['size'], item['unit']),
+        'special': 'True' if special else 'False',
+        'category': category,
+        'subcategory': category + '-' + str(rng.randrange(8)),
+    }
+    if rng.random() < 0.97: # some products don't display a unit price
+        product['price'] = coles_unit_price(item, price)
+    return product
+
+def generate_catalogues(num_products, seed=0, overlap=0.4):
+    ''' Generate a Woolworths and a Coles catalogue
+    :param num_products: the number of products in each catalogue
+    :param seed: the random seed, the same seed always gives the same catalogues
+    :param overlap: the fraction of products sold by both stores
+    :return: tuple of lists of product dictionaries (woolworths, coles) '''
+    rng = random.Random(seed)
+    shared = int(num_products * overlap)
+    woolworths, coles = [], []
+    for i in range(shared):
+        item = catalogue_item(rng, i)
+        woolworths.append(woolworths_product(rng, item))
+        coles.append(coles_product(rng, item))
+    for i in range(shared, num_products):
+        woolworths.append(woolworths_product(rng, catalogue_item(rng, i)))
+        coles.append(coles_product(rng, catalogue_item(rng, i + num_products)))
+    # Stores list products in their own order
+    rng.shuffle(woolworths)
+    rng.shuffle(coles)
+    return woolworths, coles
+
+def write_catalogues(directory, num_products, seed=0):
+    ''' Generate catalogues and save them as JSON files, the same as the merged file of each store
+    :param directory: the directory to write 'woolworths.json' and 'coles.json' to, created if it doesn't exist
+    :return: tuple of filenames (woolworths, coles) '''
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    for name, products in zip(['woolworths', 'coles'], generate_catalogues(num_products, seed)):
+        filename = os.path.join(directory, name + '.json')
+        f = open(filename, 'w')
+        json.dump(products, f, separators=(',', ':'))
+        f.close()
+        filenames.append(filename)
+    return tuple(filenames)
@@ -0,0 +1,252 @@
+'''
+
+    One command line for the whole project, with a subcommand for every job:
+
+    python cli.py merge [--store woolworths|coles|all]    merge the scraped category files (see merge.py)
+    python cli.py parse '$2.50 per 100G' ...              parse unit price strings (see unit_prices.py)
+    python cli.py match [--output matches.json]           find matching products and list or save them
+    python cli.py stats                                   match products and print the price statistics, without plots
+    python cli.py plot [--report DIRECTORY]               the full analysis and visualisations of process.py
+    python cli.py scrape woolworths|coles [options]       run a scraper, options are passed on to it
+    python cli.py check-startup [--budget 0.5]            check merge and parse still start quickly
+
+    Each subcommand imports only the modules it needs, when it runs. Matching imports scikit-learn, the statistics
+    scipy and the plots matplotlib, which take seconds to import between them, so merging category files or
+    parsing a unit price in a cron job or a shell pipeline doesn't wait for any of them.
+
+    check-startup runs the imports of the merge and parse commands in a new interpreter with 'python -X importtime' and
+    fails (exits with status 1) if they take longer than the budget in seconds or if they import any of HEAVY_MODULES,
+    so a top level import that slows every command down is caught before it is committed.
+
+    Run from the 'src' folder. Pass --metrics DIRECTORY before the subcommand to export timing spans and counters of
+    the run (see instrumentation.py) to '<DIRECTORY>/<command>.json' and '.prom', or for 'scrape' to the scraper's own
+    files, e.g. 'scrape_coles.json'.
+
+'''
+
+import argparse, os, subprocess, sys, time
+
+SRC_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+STORE_DIRECTORIES = {'woolworths': 'Datasets/Woolworths/', 'coles': 'Datasets/Coles/'}
+SCRAPERS = {'woolworths': os.path.join('Woolworths', 'scrape_woolworths.py'),
+            'coles': os.path.join('Coles', 'scrape_coles.py')}
+
+# The modules each command checked by check-startup imports
+COMMAND_IMPORTS = {
+    'merge': ['instrumentation', 'merge'],
+    'parse': ['unit_prices'],
+}
+
+# Modules that must never be imported by the commands checked by check-startup
+HEAVY_MODULES = ['sklearn', 'scipy.stats', 'matplotlib', 'selenium']
+
+def run_merge(args):
+    ''' Merge the category files of one or both stores '''
+    import instrumentation, merge
+    stores = sorted(STORE_DIRECTORIES) if args.store == 'all' else [args.store]
+    for store in stores:
+        with instrumentation.span('process.combine'):
+            report = merge.merge(STORE_DIRECTORIES[store])
+        print(store + ': ' + str(len(report['parsed'])) + ' files parsed, ' + str(len(report['reused'])) + ' reused, '
+              + str(len(report['removed'])) + ' removed')
+
+def run_parse(args):
+    ''' Parse unit price strings given as arguments, or one per line from standard input '''
+    import unit_prices
+    strings = args.strings or [line.strip() for line in sys.stdin if line.strip()]
+    parsed = [unit_prices.parse_unit_price(s) for s in strings]
+    normalized, base_units = unit_prices.normalize_unit_prices(strings)
+    failed = 0
+    for s, result, price, base_unit in zip(strings, parsed, normalized.tolist(), base_units.tolist()):
+        if result is None or base_unit == unit_prices.BASE_UNKNOWN:
+            print(s + ' -> could not parse')
+            failed += 1
+            continue
+        listed_price, quantity, unit = result
+        print(s + ' -> $' + str(listed_price) + ' per ' + str(quantity) + ' ' + unit_prices.UNIT_NAMES[unit] + ' = $'
+              + str(round(price, 4)) + ' per ' + unit_prices.BASE_UNIT_NAMES[base_unit])
+    return 1 if failed else 0
+
+def matched_products(args):
+    ''' Combine the category files and match the products of both stores, the way process.compare_all_products() does
+    :return: tuple (list of MatchedProduct objects, list of all Woolworths prices, list of all Coles prices) '''
+    import match_cache, process, product_store
+    process.combine_woolworths()
+    process.combine_coles()
+    cache = match_cache.MatchCache(args.cache) if args.cache and args.date is None else None
+    return process.match_products('Datasets/Woolworths/' + product_store.STORE_DIRNAME,
+                                  'Datasets/Coles/' + product_store.STORE_DIRNAME, args.threshold, cache, args.date,
+                                  print_to_console=False)
+
+def run_match(args):
+    ''' Find matching products and print them, or save them to a JSON file '''
+    import json
+    matching_products = matched_products(args)[0]
+    matches = [{
+        'similarity': matched_product.similarity,
+        'woolworths': matched_product.woolworths_product.name,
+        'coles': matched_product.coles_product.name,
+        'woolworths_price': matched_product.woolworths_product.unit_price.price,
+        'coles_price': matched_product.coles_product.unit_price.price,
+        'unit': matched_product.woolworths_product.unit_price.unit,
+    } for matched_product in matching_products]
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump(matches, f, indent=2)
+        f.close()
+        print(str(len(matches)) + ' matches saved to ' + args.output)
+        return
+    for match in matches:
+        print(str(round(match['similarity'], 3)) + '\t' + match['woolworths'] + '\t' + match['coles'] + '\t$'
+              + str(round(match['woolworths_price'], 2)) + ' vs $' + str(round(match['coles_price'], 2)) + ' per '
+              + match['unit'])
+    print(str(len(matches)) + ' matches')
+
+def run_stats(args):
+    ''' Match products and print the statistics of the analysis without drawing any plots '''
+    import json, process
+    results = process.price_statistics(*matched_products(args), num_resamples=args.bootstrap)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for store in ('woolworths', 'coles'):
+        stats = results[store]
+        if not stats['n']:
+            print(store + ': no prices')
+            continue
+        print(store + ': n = ' + str(stats['n']) + ', mean = $' + str(round(stats['mean'], 2)) + ', median = $'
+              + str(round(stats['median'], 2)) + ', standard deviation = $' + str(round(stats['pstdev'], 2)))
+    if 'differences' not in results:
+        print('Fewer than two matched products, no paired t-test')
+        return
+    differences = results['differences']
+    print('Price differences (Woolworths - Coles) of ' + str(differences['n']) + ' matched products: mean = $'
+          + str(round(differences['mean'], 2)) + ', standard deviation = $' + str(round(differences['stdev'], 2)))
+    if 'confidence_interval' in differences:
+        interval = differences['confidence_interval']
+        print(str(round(interval['confidence'] * 100)) + '% bootstrap confidence interval of the mean: $'
+              + str(round(interval['low'], 2)) + ' to $' + str(round(interval['high'], 2)))
+    print('t = ' + str(round(differences['t_statistic'], 3)) + ', two sided p-value = '
+          + str(differences['two_sided_pvalue']))
+    if args.categories:
+        print('Largest Woolworths categories:')
+        for category, stats in list(differences['categories'].items())[:args.categories]:
+            line = '  ' + str(category).ljust(40) + ' n = ' + str(stats['n']).ljust(7) + ' mean = $' + str(round(stats['mean'], 2))
+            if stats['two_sided_pvalue'] is not None:
+                line += ', p = ' + str(round(stats['two_sided_pvalue'], 4))
+            print(line)
+
+def run_plot(args):
+    ''' The full analysis and visualisations, displayed or rendered to a report directory '''
+    import process
+    process.compare_all_products(args.threshold, args.cache, args.date, args.report)
+
+def run_scrape(args):
+    ''' Run a scraper from its own folder, the way running its file with Python does '''
+    import runpy
+    filename = os.path.join(SRC_DIRECTORY, SCRAPERS[args.store])
+    os.chdir(os.path.dirname(filename))
+    sys.path.insert(0, os.path.dirname(filename))
+    sys.argv = [filename] + args.options
+    runpy.run_path(filename, run_name='__main__')
+
+def import_modules(command):
+    ''' Import the modules of a command, run by check-startup in a new interpreter '''
+    import importlib
+    for module in COMMAND_IMPORTS[command]:
+        importlib.import_module(module)
+
+def startup_time(command):
+    ''' Time the imports of a command in a new interpreter with -X importtime
+    :return: tuple (wall seconds of the interpreter, seconds of the top level imports, list of heavy modules imported) '''
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import cli; cli.import_modules(' + repr(command) + ')'],
+                            cwd=SRC_DIRECTORY, capture_output=True, text=True, check=True)
+    wall_seconds = time.perf_counter() - start
+    import_seconds = 0.0
+    heavy = []
+    # Lines look like 'import time:       123 |       4567 |   package.module', nested imports are indented further
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        if not name[1:].startswith(' '):
+            import_seconds += int(cumulative_us) / 1e6
+        if any(module == heavy_module or module.startswith(heavy_module + '.') for heavy_module in HEAVY_MODULES):
+            heavy.append(module)
+    return wall_seconds, import_seconds, heavy
+
+def run_check_startup(args):
+    ''' Check every command in COMMAND_IMPORTS starts within the budget without importing heavy modules '''
+    failed = False
+    for command in COMMAND_IMPORTS:
+        wall_seconds, import_seconds, heavy = startup_time(command)
+        ok = wall_seconds <= args.budget and not heavy
+        print(command.ljust(8) + str(round(import_seconds, 3)).rjust(7) + ' s imports' + str(round(wall_seconds, 3)).rjust(8)
+              + ' s total' + ('' if ok else '   FAIL') + (' (imports ' + ', '.join(sorted(set(heavy))) + ')' if heavy else ''))
+        failed = failed or not ok
+    print('Budget: ' + str(args.budget) + ' s')
+    return 1 if failed else 0
+
+def add_matching_options(parser):
+    parser.add_argument('--threshold', type=float, default=0.5, help='similarity threshold for matching product names')
+    parser.add_argument('--date', help='compare products as they were on this date, e.g. 2021-03-01')
+    parser.add_argument('--cache', default='Datasets/match_cache.pickle',
+                        help="file matches are cached in between runs, '' to rematch everything")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scrape, merge, match and compare Woolworths and Coles prices')
+    parser.add_argument('--metrics', metavar='DIRECTORY', help='export timing spans and counters of the run here')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    command = commands.add_parser('merge', help='merge the scraped category files')
+    command.add_argument('--store', choices=['all'] + sorted(STORE_DIRECTORIES), default='all', help='the store to merge')
+    command.set_defaults(function=run_merge)
+
+    command = commands.add_parser('parse', help='parse unit price strings')
+    command.add_argument('strings', nargs='*', help='unit price strings, read one per line from standard input if none')
+    command.set_defaults(function=run_parse)
+
+    command = commands.add_parser('match', help='find matching products')
+    add_matching_options(command)
+    command.add_argument('--output', help='save the matches to this JSON file instead of printing them')
+    command.set_defaults(function=run_match)
+
+    command = commands.add_parser('stats', help='print the price statistics of matched products')
+    add_matching_options(command)
+    command.add_argument('--json', action='store_true', help='print the statistics as JSON')
+    command.add_argument('--bootstrap', type=int, default=1000, metavar='RESAMPLES',
+                         help='bootstrap resamples for the confidence interval of the mean difference, 0 for none')
+    command.add_argument('--categories', type=int, default=10, metavar='N', help='print the N largest categories')
+    command.set_defaults(function=run_stats)
+
+    command = commands.add_parser('plot', help='analyse and visualise the prices of matched products')
+    add_matching_options(command)
+    command.add_argument('--report', metavar='DIRECTORY', help='render the visualisations to files instead of showing them')
+    command.set_defaults(function=run_plot)
+
+    command = commands.add_parser('scrape', help='run a scraper')
+    command.add_argument('store', choices=sorted(SCRAPERS), help='the scraper to run')
+    command.add_argument('options', nargs=argparse.REMAINDER, help='options for the scraper, e.g. --workers 4 --resume')
+    command.set_defaults(function=run_scrape)
+
+    command = commands.add_parser('check-startup', help='check the merge and parse commands start quickly')
+    command.add_argument('--budget', type=float, default=0.5, help='the most seconds each command may take to start')
+    command.set_defaults(function=run_check_startup)
+
+    args = parser.parse_args(argv)
+    if args.metrics:
+        import instrumentation
+        instrumentation.enable(args.metrics)
+    status = args.function(args)
+    # The one export of the run - library functions never export, and a scraper run by 'scrape' exports as its own
+    # entry point under its own name (e.g. 'scrape_coles')
+    if args.metrics and args.command != 'scrape':
+        instrumentation.export(args.command)
+    return status or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
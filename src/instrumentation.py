@@ -0,0 +1,183 @@
+'''
+
+    Lightweight timing spans and counters for the scrapers and the processing pipeline.
+
+    Code is instrumented with named spans and counters:
+
+    with instrumentation.span('scrape.browser_get'):
+        driver.get(url)
+    instrumentation.count('pages')
+
+    A span records how many times it ran, the total and the longest time it took. Spans with the same name add up, and
+    spans may be nested (the outer span includes the time of the inner ones). It is safe to record from several threads.
+
+    Instrumentation is off unless enabled with enable(directory), or by setting the GROCERY_METRICS environment variable
+    to a directory. While it is off span() returns one shared do-nothing context manager and count() returns straight
+    away, so instrumented code costs next to nothing.
+
+    At the end of a run export(name) writes, when enabled:
+
+    - '<directory>/<name>.json' - a summary of the run with every span and counter
+    - '<directory>/<name>.prom' - the same metrics in the Prometheus text format, for the node_exporter textfile collector
+
+'''
+
+import contextlib, json, os, threading, time
+
+PROMETHEUS_PREFIX = 'grocery_'
+
+enabled = False
+directory = None
+
+# One do-nothing context manager returned by span() while instrumentation is off
+NO_SPAN = contextlib.nullcontext()
+
+class SpanStats:
+    ''' The number of times a span ran, the total seconds and the most seconds it took '''
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+class Metrics:
+    ''' The spans and counters recorded since the run started, see the module docstring '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def add_span(self, name, seconds):
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.count += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def add_count(self, name, n):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self, name=None):
+        ''' Every span and counter as a JSON serializable dictionary
+        :param name: the name of the run '''
+        with self.lock:
+            now = time.time()
+            return {
+                'run': name,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'finished': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now)),
+                'wall_seconds': now - self.started,
+                'spans': {span: {'count': stats.count, 'seconds': stats.seconds,
+                                 'mean_seconds': stats.seconds / stats.count, 'max_seconds': stats.max_seconds}
+                          for span, stats in sorted(self.spans.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+metrics = Metrics()
+
+class Span:
+    ''' Times the body of a with statement and adds it to a named span '''
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        metrics.add_span(self.name, time.perf_counter() - self.start)
+        return False
+
+def span(name):
+    ''' A context manager timing its body as the span name, e.g. with span('process.matching'): ...
+    :param name: the name of the span, dotted by component, e.g. 'scrape.browser_get'
+    :return: context manager '''
+    if not enabled:
+        return NO_SPAN
+    return Span(name)
+
+def count(name, n=1):
+    ''' Add n to the counter name, e.g. count('pages') or count('unit_price_parse_failures', 3) '''
+    if enabled:
+        metrics.add_count(name, n)
+
+def enable(metrics_directory):
+    ''' Turn instrumentation on and start a new run
+    :param metrics_directory: the directory export() writes to, created if it doesn't exist. A relative directory is
+                              relative to the working directory now, even if the run changes directory later (e.g.
+                              'cli.py scrape' runs the scraper from its own folder). '''
+    global enabled, directory
+    directory = os.path.abspath(metrics_directory)
+    os.makedirs(directory, exist_ok=True)
+    reset()
+    enabled = True
+
+def disable():
+    ''' Turn instrumentation off, spans and counters recorded so far are kept until reset() '''
+    global enabled
+    enabled = False
+
+def reset():
+    ''' Forget every span and counter and start a new run '''
+    global metrics
+    metrics = Metrics()
+
+def prometheus_label(value):
+    ''' Escape a label value for the Prometheus text format '''
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text(summary):
+    ''' The metrics of a run summary in the Prometheus text format
+    :param summary: dictionary as returned by Metrics.summary()
+    :return: string '''
+    run = prometheus_label(summary['run'] or '')
+    lines = []
+    families = [
+        ('span_seconds_total', 'counter', 'Total seconds spent in each span', 'seconds'),
+        ('span_calls_total', 'counter', 'Number of times each span ran', 'count'),
+        ('span_max_seconds', 'gauge', 'Longest time a single run of each span took', 'max_seconds'),
+    ]
+    for metric, metric_type, description, field in families:
+        lines.append('# HELP ' + PROMETHEUS_PREFIX + metric + ' ' + description)
+        lines.append('# TYPE ' + PROMETHEUS_PREFIX + metric + ' ' + metric_type)
+        for name, stats in summary['spans'].items():
+            lines.append(PROMETHEUS_PREFIX + metric + '{run="' + run + '",span="' + prometheus_label(name) + '"} '
+                         + repr(float(stats[field])))
+    lines.append('# HELP ' + PROMETHEUS_PREFIX + 'events_total Counted events, e.g. pages, products, matches')
+    lines.append('# TYPE ' + PROMETHEUS_PREFIX + 'events_total counter')
+    for name, value in summary['counters'].items():
+        lines.append(PROMETHEUS_PREFIX + 'events_total{run="' + run + '",counter="' + prometheus_label(name) + '"} '
+                     + repr(float(value)))
+    lines.append('# HELP ' + PROMETHEUS_PREFIX + 'run_wall_seconds Wall time of the run')
+    lines.append('# TYPE ' + PROMETHEUS_PREFIX + 'run_wall_seconds gauge')
+    lines.append(PROMETHEUS_PREFIX + 'run_wall_seconds{run="' + run + '"} ' + repr(float(summary['wall_seconds'])))
+    lines.append('# HELP ' + PROMETHEUS_PREFIX + 'run_finished_timestamp_seconds When the run finished')
+    lines.append('# TYPE ' + PROMETHEUS_PREFIX + 'run_finished_timestamp_seconds gauge')
+    lines.append(PROMETHEUS_PREFIX + 'run_finished_timestamp_seconds{run="' + run + '"} ' + repr(float(int(time.time()))))
+    return '\n'.join(lines) + '\n'
+
+def write_file(filename, text):
+    ''' Write a file in one step, so the textfile collector never reads half a file '''
+    temporary_filename = filename + '.tmp'
+    f = open(temporary_filename, 'w')
+    f.write(text)
+    f.close()
+    os.replace(temporary_filename, filename)
+
+def export(name):
+    ''' Write the JSON summary and the Prometheus textfile of the run, if instrumentation is enabled
+    :param name: the name of the run, e.g. 'scrape_woolworths', used for the filenames
+    :return: the summary dictionary, or None if instrumentation is off '''
+    if not enabled:
+        return None
+    summary = metrics.summary(name)
+    write_file(os.path.join(directory, name + '.json'), json.dumps(summary, indent=2) + '\n')
+    write_file(os.path.join(directory, name + '.prom'), prometheus_text(summary))
+    return summary
+
+if os.environ.get('GROCERY_METRICS'):
+    enable(os.environ['GROCERY_METRICS'])
@@ -0,0 +1,241 @@
+'''
+
+    A persistent, incremental cache of matched product names.
+
+    Most product names do not change from one scrape to the next, so rematching the whole catalogue on every run is
+    wasted work. The cache is saved to disk between runs and keeps, for each store, the normalized name of every
+    product together with its TF-IDF vector, plus every pair of Woolworths and Coles names found to be similar.
+
+    The vocabulary and the IDF weights (how rare every word is) of the cache are frozen when it is built, and the names
+    of new products are vectorized with the cached vectorizer. The IDF weight of every word depends on how many names
+    of the whole catalogue contain it, so adding or removing any product changes every weight a little. Every run fits
+    the vocabulary over the current names again (cheap next to scoring) and compares it with the cached one:
+
+    - if no name has a word the cached vocabulary doesn't have and no IDF weight has drifted by more than
+      max_idf_drift (a fraction of the current weight, MAX_IDF_DRIFT by default) from the cached one, products that
+      were added (or renamed, which looks like a removal plus an addition) are vectorized and scored, products that
+      disappeared are evicted along with their matches, and everything else is reused
+    - otherwise the whole cache is rebuilt with the current vocabulary and weights
+
+    So the matches are those of matching.similar_pairs() run with the weights the cache was built with. Scores can
+    differ slightly from a fresh run's, and a pair scored right at the similarity threshold may be kept or dropped
+    differently, but the weights never drift further than max_idf_drift before the cache is rebuilt. Words that
+    disappeared from the catalogue don't matter, no name being scored contains them.
+
+    The whole cache is also rebuilt when the similarity threshold changes.
+
+'''
+
+import os, pickle
+import numpy as np
+import scipy.sparse
+import matching
+
+# Bump this when the layout of the cache file changes so old caches are rebuilt instead of misread
+CACHE_VERSION = 2
+
+# The most an IDF weight may drift from the cached weight, as a fraction of the current weight, before the cache is
+# rebuilt. Adding or removing 1% of the products moves the weight of a word by about 1% of its weight or less.
+MAX_IDF_DRIFT = 0.1
+
+def normalize_name(name):
+    ''' Normalize a product name for use as a cache key - lower case with runs of whitespace collapsed
+    :param name: product name
+    :return: normalized product name '''
+    return ' '.join(name.lower().split())
+
+class StoreEntries:
+    ''' The cached products of one store - normalized names (keys) and their TF-IDF vectors, row i belongs to keys[i] '''
+    def __init__(self, keys, tfidf):
+        self.keys = keys
+        self.tfidf = tfidf
+
+    def keep(self, keys):
+        ''' Evict every cached product whose key is not in keys
+        :param keys: set of keys to keep '''
+        rows = [row for row, key in enumerate(self.keys) if key in keys]
+        self.keys = [self.keys[row] for row in rows]
+        self.tfidf = self.tfidf[rows]
+
+    def add(self, keys, tfidf):
+        ''' Append new products to the cache
+        :param keys: list of keys of the new products
+        :param tfidf: sparse matrix of TF-IDF vectors of the new products '''
+        self.keys = self.keys + keys
+        self.tfidf = scipy.sparse.vstack([self.tfidf, tfidf]).tocsr()
+
+class MatchCache:
+    ''' An on-disk match cache, see the module docstring.
+
+    After similar_pairs() has run, added, removed and rebuilt describe what it had to do:
+    - added is a dictionary of the number of new products per store that were vectorized and scored
+    - removed is a dictionary of the number of products per store evicted from the cache
+    - rebuilt is true if the whole cache had to be rebuilt from scratch '''
+    def __init__(self, filename, max_idf_drift=MAX_IDF_DRIFT):
+        ''' :param filename: the file the cache is saved to
+        :param max_idf_drift: rebuild the cache once any IDF weight drifts by more than this fraction, see the module
+                              docstring '''
+        self.filename = filename
+        self.max_idf_drift = max_idf_drift
+        self.added = {'Woolworths': 0, 'Coles': 0}
+        self.removed = {'Woolworths': 0, 'Coles': 0}
+        self.rebuilt = False
+
+    def load(self, similarity_threshold):
+        ''' Load the cache from disk
+        :param similarity_threshold: the threshold matches must have been found with
+        :return: the cached state as a dictionary, or None if there is no usable cache '''
+        if not os.path.exists(self.filename):
+            return None
+        try:
+            f = open(self.filename, 'rb')
+            state = pickle.load(f)
+            f.close()
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError, TypeError):
+            # A corrupt cache, or one pickled with classes or library versions that are gone
+            return None
+        if not isinstance(state, dict) or state.get('version') != CACHE_VERSION or \
+                state.get('similarity_threshold') != similarity_threshold:
+            return None
+        return state
+
+    def save(self, state):
+        ''' Save the cache to disk, writing to a temporary file first so a crash never leaves a corrupt cache
+        :param state: the cache state as a dictionary '''
+        temporary_filename = self.filename + '.tmp'
+        f = open(temporary_filename, 'wb')
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.close()
+        os.replace(temporary_filename, self.filename)
+
+    def vocabulary_changed(self, cached_vectorizer, vectorizer):
+        ''' Check whether the cached vectorizer can no longer vectorize the current names - a name has a word the
+        cached vocabulary doesn't have, or the IDF weight of a word drifted by more than max_idf_drift
+        :param cached_vectorizer: the TfidfVectorizer the cached vectors were computed with
+        :param vectorizer: a TfidfVectorizer fitted on the current names, as a fresh run fits it
+        :return: boolean '''
+        cached_vocabulary = cached_vectorizer.vocabulary_
+        if any(word not in cached_vocabulary for word in vectorizer.vocabulary_):
+            return True
+        words = list(vectorizer.vocabulary_)
+        idf = vectorizer.idf_[[vectorizer.vocabulary_[word] for word in words]]
+        cached_idf = cached_vectorizer.idf_[[cached_vocabulary[word] for word in words]]
+        return bool(np.any(np.abs(cached_idf - idf) > self.max_idf_drift * idf))
+
+    def rebuild(self, vectorizer, woolworths_keys, coles_keys, similarity_threshold, workers, max_block_memory):
+        ''' Vectorize and score every product from scratch
+        :param vectorizer: a TfidfVectorizer fitted on the current names
+        :return: the new cache state as a dictionary '''
+        woolworths_tfidf = vectorizer.transform(woolworths_keys)
+        coles_tfidf = vectorizer.transform(coles_keys)
+        matches = {}
+        for rows, columns, scores in matching.iter_similar_pairs(woolworths_tfidf, coles_tfidf, similarity_threshold, workers, max_block_memory):
+            for row, column, score in zip(rows.tolist(), columns.tolist(), scores.tolist()):
+                matches[(woolworths_keys[row], coles_keys[column])] = score
+        self.rebuilt = True
+        self.added = {'Woolworths': len(woolworths_keys), 'Coles': len(coles_keys)}
+        return {
+            'version': CACHE_VERSION,
+            'similarity_threshold': similarity_threshold,
+            'vectorizer': vectorizer,
+            'Woolworths': StoreEntries(woolworths_keys, woolworths_tfidf),
+            'Coles': StoreEntries(coles_keys, coles_tfidf),
+            'matches': matches,
+        }
+
+    def update(self, state, vectorizer, woolworths_keys, coles_keys, similarity_threshold, workers, max_block_memory):
+        ''' Bring a cached state up to date with the current products, only scoring products that were added
+        :param vectorizer: a TfidfVectorizer fitted on the current names, only compared with the cached one. New
+                           names are vectorized with the cached vectorizer.
+        :return: the updated cache state as a dictionary, or None if the cache has to be rebuilt instead '''
+        if self.vocabulary_changed(state['vectorizer'], vectorizer):
+            return None
+        woolworths = state['Woolworths']
+        coles = state['Coles']
+
+        # Work out which products were added and which disappeared
+        current = {'Woolworths': set(woolworths_keys), 'Coles': set(coles_keys)}
+        cached = {'Woolworths': set(woolworths.keys), 'Coles': set(coles.keys)}
+        new_woolworths = [key for key in woolworths_keys if key not in cached['Woolworths']]
+        new_coles = [key for key in coles_keys if key not in cached['Coles']]
+
+        # Evict products that disappeared, along with their matches
+        self.removed = {'Woolworths': len(cached['Woolworths'] - current['Woolworths']),
+                        'Coles': len(cached['Coles'] - current['Coles'])}
+        woolworths.keep(current['Woolworths'])
+        coles.keep(current['Coles'])
+        matches = state['matches']
+        for pair in [pair for pair in matches if pair[0] not in current['Woolworths'] or pair[1] not in current['Coles']]:
+            del matches[pair]
+
+        # Score new Woolworths products against all Coles products, then old Woolworths products against new Coles products
+        vectorizer = state['vectorizer']
+        num_old_woolworths = len(woolworths.keys)
+        num_old_coles = len(coles.keys)
+        if new_coles:
+            coles.add(new_coles, vectorizer.transform(new_coles))
+        if new_woolworths:
+            woolworths.add(new_woolworths, vectorizer.transform(new_woolworths))
+            new_rows = woolworths.tfidf[num_old_woolworths:]
+            for rows, columns, scores in matching.iter_similar_pairs(new_rows, coles.tfidf, similarity_threshold, workers, max_block_memory):
+                for row, column, score in zip(rows.tolist(), columns.tolist(), scores.tolist()):
+                    matches[(woolworths.keys[num_old_woolworths + row], coles.keys[column])] = score
+        if new_coles and num_old_woolworths > 0:
+            old_rows = woolworths.tfidf[:num_old_woolworths]
+            new_columns = coles.tfidf[num_old_coles:]
+            for rows, columns, scores in matching.iter_similar_pairs(old_rows, new_columns, similarity_threshold, workers, max_block_memory):
+                for row, column, score in zip(rows.tolist(), columns.tolist(), scores.tolist()):
+                    matches[(woolworths.keys[row], coles.keys[num_old_coles + column])] = score
+
+        self.added = {'Woolworths': len(new_woolworths), 'Coles': len(new_coles)}
+        return state
+
+    def similar_pairs(self, woolworths_names, coles_names, similarity_threshold=0.5, workers=1, max_block_memory=matching.MAX_BLOCK_MEMORY):
+        ''' Find all pairs of Woolworths and Coles product names that are more similar than the similarity threshold,
+        reusing the matches saved by previous runs and saving the updated cache afterwards.
+        Takes the same parameters and returns the same as matching.similar_pairs() '''
+
+        woolworths_normalized = [normalize_name(name) for name in woolworths_names]
+        coles_normalized = [normalize_name(name) for name in coles_names]
+        woolworths_keys = list(dict.fromkeys(woolworths_normalized))
+        coles_keys = list(dict.fromkeys(coles_normalized))
+
+        self.rebuilt = False
+        self.added = {'Woolworths': 0, 'Coles': 0}
+        self.removed = {'Woolworths': 0, 'Coles': 0}
+
+        # Nothing to match, leave the cache as it is for the next run that has products of both stores
+        if not len(woolworths_names) or not len(coles_names):
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int32), np.array([], dtype=np.float64)
+
+        # The vocabulary a fresh run fits, over every name as it is (normalizing doesn't change the words of a name)
+        vectorizer = matching.fit_vectorizer(woolworths_names, coles_names)
+        state = self.load(similarity_threshold)
+        if state is not None:
+            state = self.update(state, vectorizer, woolworths_keys, coles_keys, similarity_threshold, workers, max_block_memory)
+        if state is None:
+            state = self.rebuild(vectorizer, woolworths_keys, coles_keys, similarity_threshold, workers, max_block_memory)
+        self.save(state)
+
+        # Several product names can normalize to the same key, so map every key back to all of its names
+        woolworths_rows = {}
+        for row, key in enumerate(woolworths_normalized):
+            woolworths_rows.setdefault(key, []).append(row)
+        coles_columns = {}
+        for column, key in enumerate(coles_normalized):
+            coles_columns.setdefault(key, []).append(column)
+
+        pairs = sorted((row, column, score) for (woolworths_key, coles_key), score in state['matches'].items()
+                       for row in woolworths_rows[woolworths_key] for column in coles_columns[coles_key])
+        rows = np.array([pair[0] for pair in pairs], dtype=np.int64)
+        columns = np.array([pair[1] for pair in pairs], dtype=np.int32)
+        scores = np.array([pair[2] for pair in pairs], dtype=np.float64)
+        return rows, columns, scores
+
+    def __str__(self):
+        if self.rebuilt:
+            return 'Match cache rebuilt: ' + str(self.added['Woolworths']) + ' Woolworths and ' + \
+                str(self.added['Coles']) + ' Coles products scored'
+        return 'Match cache updated: ' + str(self.added['Woolworths']) + ' Woolworths and ' + str(self.added['Coles']) + \
+            ' Coles products added, ' + str(self.removed['Woolworths']) + ' Woolworths and ' + \
+            str(self.removed['Coles']) + ' Coles products removed'
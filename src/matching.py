@@ -0,0 +1,408 @@
+'''
+
+    Find Woolworths and Coles products with similar names.
+
+    The original approach built a new TfidfVectorizer for every single Woolworths product, refitting it on every Coles
+    product name and turning the whole similarity matrix into Python lists. This module fits the vocabulary once over
+    both catalogues and computes the cosine similarity of every Woolworths x Coles pair with a single sparse matrix
+    product, keeping only the pairs above the similarity threshold.
+
+    TfidfVectorizer normalises every row to unit length so the dot product of two rows is their cosine similarity.
+
+'''
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import scipy.sparse
+
+# Default cap on the memory a single block of the similarity matrix may use, in bytes
+MAX_BLOCK_MEMORY = 256 * 1024 * 1024
+
+# Worst case number of bytes used per Coles product for every Woolworths row of a block. A sparse matrix product
+# stores a float64 value and an int32 column index per entry, plus scipy's per-row accumulators while multiplying.
+BYTES_PER_SIMILARITY = 24
+
+
+def fit_vectorizer(woolworths_names, coles_names):
+    ''' Fit a single TF-IDF vocabulary over the product names of both stores
+    :return: the fitted TfidfVectorizer '''
+
+    # scikit-learn takes most of a second to import, so it is only imported once names are actually matched
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    # This code is based on the following discussion on StackOverflow:
+    # https://stackoverflow.com/questions/8897593/similarity-between-two-text-documents/8897648#8897648
+    vectorizer = TfidfVectorizer(min_df=1)
+    vectorizer.fit(list(woolworths_names) + list(coles_names))
+    return vectorizer
+
+def vectorize_names(woolworths_names, coles_names):
+    ''' Fit a single TF-IDF vocabulary over the product names of both stores and vectorize them
+    :param woolworths_names: list of Woolworths product names
+    :param coles_names: list of Coles product names
+    :return: tuple (woolworths_tfidf, coles_tfidf, vectorizer) where the first two are sparse matrices with one row
+    per product name '''
+
+    vectorizer = fit_vectorizer(woolworths_names, coles_names)
+    woolworths_tfidf = vectorizer.transform(woolworths_names)
+    coles_tfidf = vectorizer.transform(coles_names)
+    return woolworths_tfidf, coles_tfidf, vectorizer
+
+def above_threshold(similarity, similarity_threshold):
+    ''' Extract the entries of a sparse similarity matrix that are above the similarity threshold
+    :param similarity: sparse matrix where position (i, j) is the similarity of Woolworths product i and Coles product j
+    :param similarity_threshold: float between 0 and 1, entries must be strictly greater than this to be kept
+    :return: tuple of Numpy arrays (rows, columns, similarities) sorted by row and then by column '''
+
+    similarity = similarity.tocsr()
+    similarity.sort_indices()
+
+    # Expand the compressed row pointers so every stored entry knows which row it belongs to
+    rows = np.repeat(np.arange(similarity.shape[0]), np.diff(similarity.indptr))
+    keep = similarity.data > similarity_threshold
+    return rows[keep], similarity.indices[keep], similarity.data[keep]
+
+def rows_per_block(num_coles, max_block_memory=MAX_BLOCK_MEMORY):
+    ''' The number of Woolworths rows whose similarity to every Coles product fits in max_block_memory
+    :param num_coles: the number of Coles products
+    :param max_block_memory: the memory cap for one block in bytes
+    :return: int, at least 1 '''
+    return max(1, int(max_block_memory // (max(1, num_coles) * BYTES_PER_SIMILARITY)))
+
+def block_pairs(woolworths_block, coles_tfidf_transposed, first_row, similarity_threshold):
+    ''' Score one block of Woolworths rows against every Coles product
+    :param woolworths_block: sparse matrix of consecutive Woolworths product name vectors
+    :param coles_tfidf_transposed: sparse matrix of Coles product name vectors, transposed
+    :param first_row: the index of the first row of the block among all Woolworths products
+    :param similarity_threshold: float between 0 and 1, how similar product names must be in order to match
+    :return: tuple of Numpy arrays (rows, columns, similarities) for the block, rows index all Woolworths products '''
+    rows, columns, scores = above_threshold(woolworths_block @ coles_tfidf_transposed, similarity_threshold)
+    return rows + first_row, columns, scores
+
+# The Coles matrix attached from shared memory by each worker process, see share_matrix() and attach_matrix()
+worker_coles = None
+worker_segments = None
+
+def share_matrix(matrix):
+    ''' Copy the arrays of a compressed row sparse matrix into shared memory once, so worker processes can read it
+    without it being pickled for every task
+    :param matrix: scipy sparse matrix in compressed row format
+    :return: tuple (segments, description) where segments are the SharedMemory blocks (close and unlink them when
+    done) and description is what attach_matrix() needs to rebuild the matrix in a worker '''
+    segments = []
+    description = {'shape': matrix.shape}
+    for name in ('data', 'indices', 'indptr'):
+        array = getattr(matrix, name)
+        segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[:] = array
+        segments.append(segment)
+        description[name] = (segment.name, array.shape, array.dtype.str)
+    return segments, description
+
+def attach_matrix(description):
+    ''' Worker process initializer, rebuilds the shared Coles matrix on top of shared memory without copying it
+    :param description: as returned by share_matrix() '''
+    global worker_coles, worker_segments
+    worker_segments = []
+    arrays = []
+    for name in ('data', 'indices', 'indptr'):
+        segment_name, shape, dtype = description[name]
+        segment = shared_memory.SharedMemory(name=segment_name)
+        worker_segments.append(segment)
+        arrays.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf))
+    worker_coles = scipy.sparse.csr_matrix(tuple(arrays), shape=description['shape'], copy=False)
+
+def worker_block_pairs(task):
+    ''' Score one block of Woolworths rows in a worker process against the shared Coles matrix
+    :param task: tuple (woolworths_block, first_row, similarity_threshold)
+    :return: see block_pairs() '''
+    woolworths_block, first_row, similarity_threshold = task
+    return block_pairs(woolworths_block, worker_coles, first_row, similarity_threshold)
+
+def iter_similar_pairs(woolworths_tfidf, coles_tfidf, similarity_threshold=0.5, workers=1, max_block_memory=MAX_BLOCK_MEMORY):
+    ''' Score every Woolworths x Coles pair one block of Woolworths rows at a time, yielding the pairs above the
+    similarity threshold as each block finishes.
+
+    Blocks are sized so that no block of the similarity matrix uses more than max_block_memory, so memory stays bounded
+    no matter how large the catalogues are. With more than one worker the blocks are spread across a process pool. The
+    Coles matrix is copied into shared memory once and every worker reads it from there. Blocks are yielded in row
+    order, so the results are identical to scoring serially.
+
+    :param woolworths_tfidf: sparse matrix of Woolworths product name vectors
+    :param coles_tfidf: sparse matrix of Coles product name vectors
+    :param similarity_threshold: float between 0 and 1, how similar product names must be in order to match
+    :param workers: the number of worker processes, 1 scores every block in this process
+    :param max_block_memory: cap on the memory used by one block of the similarity matrix (per worker) in bytes
+    :return: generator of tuples of Numpy arrays (rows, columns, similarities) sorted by row and then by column '''
+
+    woolworths_tfidf = woolworths_tfidf.tocsr()
+    coles_tfidf_transposed = coles_tfidf.T.tocsr()
+    num_woolworths = woolworths_tfidf.shape[0]
+    block_size = rows_per_block(coles_tfidf.shape[0], max_block_memory)
+    starts = range(0, num_woolworths, block_size)
+
+    if workers <= 1:
+        for start in starts:
+            yield block_pairs(woolworths_tfidf[start:start + block_size], coles_tfidf_transposed, start, similarity_threshold)
+        return
+
+    segments, description = share_matrix(coles_tfidf_transposed)
+    try:
+        tasks = ((woolworths_tfidf[start:start + block_size], start, similarity_threshold) for start in starts)
+        with multiprocessing.Pool(workers, initializer=attach_matrix, initargs=(description,)) as pool:
+            for pairs in pool.imap(worker_block_pairs, tasks):
+                yield pairs
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+def iter_similar_names(woolworths_names, coles_names, similarity_threshold=0.5, workers=1, max_block_memory=MAX_BLOCK_MEMORY):
+    ''' Vectorize the product names of both stores and stream the pairs above the similarity threshold block by block
+    The parameters are the same as for similar_pairs() and blocks are the same as for iter_similar_pairs() '''
+    # Nothing to vectorize or compare, and fitting a vocabulary over no names fails
+    if not len(woolworths_names) or not len(coles_names):
+        return iter(())
+    woolworths_tfidf, coles_tfidf, _ = vectorize_names(woolworths_names, coles_names)
+    return iter_similar_pairs(woolworths_tfidf, coles_tfidf, similarity_threshold, workers, max_block_memory)
+
+def similar_pairs(woolworths_names, coles_names, similarity_threshold=0.5, workers=1, max_block_memory=MAX_BLOCK_MEMORY):
+    ''' Find all pairs of Woolworths and Coles product names that are more similar than the similarity threshold
+
+    The vocabulary is fitted once over both catalogues and the Woolworths x Coles similarities are computed with sparse
+    matrix products, nothing is ever turned into a dense matrix.
+
+    :param woolworths_names: list of Woolworths product names
+    :param coles_names: list of Coles product names
+    :param similarity_threshold: float between 0 and 1, how similar product names must be in order to match
+    :param workers: the number of worker processes to score with, see iter_similar_pairs()
+    :param max_block_memory: cap on the memory used by one block of the similarity matrix in bytes
+    :return: tuple of Numpy arrays (rows, columns, similarities) where rows index woolworths_names and columns index
+    coles_names, sorted by row and then by column '''
+
+    blocks = list(iter_similar_names(woolworths_names, coles_names, similarity_threshold, workers, max_block_memory))
+    if not blocks:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int32), np.array([])
+    return tuple(np.concatenate(arrays) for arrays in zip(*blocks))
+
+class InvertedIndex:
+    ''' A token -> products inverted index over product names.
+
+    The index is stored as a sparse matrix in compressed column format so the posting list of a token (the products
+    whose names contain it) is a contiguous slice, and the document frequency of every token is known up front. '''
+    def __init__(self, tfidf):
+        ''' :param tfidf: sparse matrix with one row per product and one column per token, as returned by
+        vectorize_names() '''
+        self.incidence = (tfidf > 0).astype(np.int32).tocsc()
+        self.document_frequency = np.diff(self.incidence.indptr)
+
+    def postings(self, token):
+        ''' :param token: the column index of a token in the fitted vocabulary
+        :return: Numpy array of the indices of all products whose names contain the token '''
+        return self.incidence.indices[self.incidence.indptr[token]:self.incidence.indptr[token + 1]]
+
+class Blocking:
+    ''' Settings for the candidate blocking stage run before similarity scoring.
+
+    By default pairs are blocked with prefix filtering, which never loses a match above the similarity threshold. The
+    tokens of every product name are ordered from the rarest to the most common (one order for both stores), and a
+    product is blocked on the shortest run of its rarest tokens (its prefix) such that its remaining, more common tokens
+    can't add up to more than the threshold on their own. Their most possible contribution is bounded both by the sum of
+    each token's weight times the largest weight the token has in any name of the other store, and by the length of
+    those tokens' part of the vector (the other vector has unit length). If two names score above the threshold, the
+    rarest token they share is in the prefix of both, so only pairs sharing a prefix token need to be scored.
+
+    If max_document_frequency is given, the faster but lossy rare token blocking is used instead: only pairs that
+    share a token in at most max_document_frequency (a fraction) of all product names of both stores are scored. A
+    product whose tokens are all common is still blocked on its rarest token so it is never left without candidates.
+
+    Pairs can also be blocked on extra fields. category_map maps a Coles category to the equivalent Woolworths category
+    (the stores use different category names), and on_unit requires both products to have the same unit price unit.
+    Products with an unknown category or unit are never pruned by these fields.
+
+    If verify is true every pair is also scored exhaustively and the number of matches lost to blocking is reported. '''
+    def __init__(self, max_document_frequency=None, category_map=None, on_unit=False, verify=False):
+        self.max_document_frequency = max_document_frequency
+        self.category_map = category_map
+        self.on_unit = on_unit
+        self.verify = verify
+
+class BlockingReport:
+    ''' How many Woolworths x Coles pairs the blocking stage pruned.
+    lost_matches is only known (not None) when blocking was run with verify=True '''
+    def __init__(self, total_pairs, candidate_pairs, lost_matches=None):
+        self.total_pairs = total_pairs
+        self.candidate_pairs = candidate_pairs
+        self.pruned_pairs = total_pairs - candidate_pairs
+        self.lost_matches = lost_matches
+
+    def __str__(self):
+        txt  = 'Total pairs: ' + str(self.total_pairs) + '\n'
+        txt += 'Candidate pairs: ' + str(self.candidate_pairs) + '\n'
+        txt += 'Pruned pairs: ' + str(self.pruned_pairs)
+        if self.total_pairs > 0:
+            txt += ' (' + str(round(100 * self.pruned_pairs / self.total_pairs, 4)) + '%)'
+        if self.lost_matches is not None:
+            txt += '\nMatches lost to blocking: ' + str(self.lost_matches)
+        return txt
+
+def rare_token_incidence(index, num_products, max_document_frequency):
+    ''' Keep only the rare tokens of every product, falling back to its rarest token if it has no rare tokens
+    :param index: InvertedIndex over the product names of both stores
+    :param num_products: the number of products in both stores
+    :param max_document_frequency: tokens in more than this fraction of products are not rare
+    :return: sparse matrix in compressed row format, one row per product, 1 where the product has a blocking token '''
+
+    incidence = index.incidence.tocsr()
+    rare = index.document_frequency <= max(1, max_document_frequency * num_products)
+    blocking = (incidence @ scipy.sparse.diags(rare.astype(np.int32), dtype=np.int32)).tocsr()
+    blocking.eliminate_zeros()
+
+    # Products without any rare token are blocked on their rarest token instead
+    lonely = [product for product in np.flatnonzero(np.diff(blocking.indptr) == 0) if incidence.indptr[product + 1] > incidence.indptr[product]]
+    if lonely:
+        rarest = []
+        for product in lonely:
+            tokens = incidence.indices[incidence.indptr[product]:incidence.indptr[product + 1]]
+            rarest.append(tokens[np.argmin(index.document_frequency[tokens])])
+        fallback = scipy.sparse.csr_matrix((np.ones(len(lonely), dtype=np.int32), (lonely, rarest)), shape=blocking.shape)
+        blocking = blocking + fallback
+
+    return blocking
+
+def prefix_incidence(tfidf, document_frequency, other_max_weight, similarity_threshold):
+    ''' Keep only the prefix tokens of every product, see Blocking
+    :param tfidf: sparse matrix of the product name vectors of one store, rows of unit length
+    :param document_frequency: Numpy array, the number of products of both stores whose names contain each token
+    :param other_max_weight: Numpy array, the largest weight of each token in the names of the other store
+    :param similarity_threshold: pairs must score strictly more than this to match
+    :return: sparse matrix in compressed row format, one row per product, 1 where the product has a prefix token '''
+
+    tfidf = tfidf.tocsr()
+    rows = np.repeat(np.arange(tfidf.shape[0]), np.diff(tfidf.indptr))
+    weights = tfidf.data
+
+    # The global order of tokens, rarest first (ties broken by token)
+    rank = np.empty(len(document_frequency), dtype=np.int64)
+    rank[np.lexsort((np.arange(len(document_frequency)), document_frequency))] = np.arange(len(document_frequency))
+
+    # Walk every product's tokens from the most common to the rarest, adding up the bound of the tokens walked so far
+    order = np.lexsort((-rank[tfidf.indices], rows))
+    sorted_rows = rows[order]
+    contributions = np.cumsum(weights[order] * other_max_weight[tfidf.indices[order]])
+    squares = np.cumsum(weights[order] ** 2)
+    starts = tfidf.indptr[:-1][sorted_rows]
+    contributions -= np.concatenate(([0.0], contributions))[starts]
+    squares -= np.concatenate(([0.0], squares))[starts]
+    bound = np.minimum(contributions, np.sqrt(np.maximum(squares, 0.0)))
+
+    # Tokens whose bound can't reach the threshold (with a margin for rounding) are left out, the rest is the prefix
+    prefix = np.empty(len(order), dtype=np.bool_)
+    prefix[order] = bound > similarity_threshold - 1e-6
+    # eliminate_zeros() works in place, so the blocking matrix gets its own copy of the tfidf matrix's index arrays
+    blocking = scipy.sparse.csr_matrix((prefix.astype(np.int32), tfidf.indices.copy(), tfidf.indptr.copy()),
+                                       shape=tfidf.shape)
+    blocking.eliminate_zeros()
+    return blocking
+
+def same_block(woolworths_labels, coles_labels, rows, columns):
+    ''' Check which candidate pairs have the same label for one blocking field, an unknown label (None) matches anything
+    :param woolworths_labels: list with one label per Woolworths product
+    :param coles_labels: list with one label per Coles product
+    :param rows: Numpy array of Woolworths product indices of the candidate pairs
+    :param columns: Numpy array of Coles product indices of the candidate pairs
+    :return: boolean Numpy array, true for candidate pairs that should be kept '''
+
+    # Turn labels into integer codes so the comparison is a single array operation, -1 means unknown
+    codes = {}
+    def encode(labels):
+        return np.array([-1 if label is None else codes.setdefault(label, len(codes)) for label in labels], dtype=np.int64)
+    woolworths_codes = encode(woolworths_labels)[rows]
+    coles_codes = encode(coles_labels)[columns]
+    return (woolworths_codes == -1) | (coles_codes == -1) | (woolworths_codes == coles_codes)
+
+def score_pairs(woolworths_tfidf, coles_tfidf, rows, columns, chunk_size=1000000):
+    ''' Compute the cosine similarity of selected Woolworths x Coles pairs only
+    :param woolworths_tfidf: sparse matrix of Woolworths product name vectors
+    :param coles_tfidf: sparse matrix of Coles product name vectors
+    :param rows: Numpy array of Woolworths product indices
+    :param columns: Numpy array of Coles product indices
+    :param chunk_size: the number of pairs to score at once, bounds memory use
+    :return: Numpy array with the similarity of each pair '''
+    scores = np.empty(len(rows))
+    for start in range(0, len(rows), chunk_size):
+        end = start + chunk_size
+        products = woolworths_tfidf[rows[start:end]].multiply(coles_tfidf[columns[start:end]])
+        scores[start:end] = np.asarray(products.sum(axis=1)).ravel()
+    return scores
+
+def blocked_pairs(woolworths_names, coles_names, similarity_threshold=0.5, blocking=None, woolworths_blocks=(), coles_blocks=()):
+    ''' Find pairs of similar Woolworths and Coles product names, only scoring candidate pairs that share a blocking token
+    (see Blocking)
+
+    :param woolworths_names: list of Woolworths product names
+    :param coles_names: list of Coles product names
+    :param similarity_threshold: float between 0 and 1, how similar product names must be in order to match
+    :param blocking: Blocking settings, defaults to Blocking()
+    :param woolworths_blocks: extra blocking fields, a list of label lists with one label per Woolworths product
+    :param coles_blocks: the same blocking fields for Coles, in the same order as woolworths_blocks
+    :return: tuple (rows, columns, similarities, report) where the first three are the same as for similar_pairs()
+    and report is a BlockingReport '''
+
+    if blocking is None:
+        blocking = Blocking()
+
+    # Nothing to vectorize or compare
+    if not len(woolworths_names) or not len(coles_names):
+        return (np.array([], dtype=np.int64), np.array([], dtype=np.int32), np.array([]),
+                BlockingReport(0, 0, 0 if blocking.verify else None))
+
+    woolworths_tfidf, coles_tfidf, _ = vectorize_names(woolworths_names, coles_names)
+    num_woolworths = woolworths_tfidf.shape[0]
+
+    # Build the inverted index over the names of both stores and keep only each product's blocking tokens
+    index = InvertedIndex(scipy.sparse.vstack([woolworths_tfidf, coles_tfidf]))
+    if blocking.max_document_frequency is None:
+        woolworths_max_weight = woolworths_tfidf.max(axis=0).toarray().ravel()
+        coles_max_weight = coles_tfidf.max(axis=0).toarray().ravel()
+        woolworths_tokens = prefix_incidence(woolworths_tfidf, index.document_frequency, coles_max_weight, similarity_threshold)
+        coles_tokens = prefix_incidence(coles_tfidf, index.document_frequency, woolworths_max_weight, similarity_threshold)
+    else:
+        tokens = rare_token_incidence(index, index.incidence.shape[0], blocking.max_document_frequency)
+        woolworths_tokens, coles_tokens = tokens[:num_woolworths], tokens[num_woolworths:]
+
+    # Products sharing at least one blocking token are candidate pairs
+    candidates = (woolworths_tokens @ coles_tokens.T).tocsr()
+    candidates.sort_indices()
+    rows = np.repeat(np.arange(num_woolworths), np.diff(candidates.indptr))
+    columns = candidates.indices
+
+    # Prune candidates on the extra blocking fields
+    fields = list(zip(woolworths_blocks, coles_blocks))
+    for woolworths_labels, coles_labels in fields:
+        keep = same_block(woolworths_labels, coles_labels, rows, columns)
+        rows, columns = rows[keep], columns[keep]
+
+    # Score candidate pairs only
+    num_candidates = len(rows)
+    scores = score_pairs(woolworths_tfidf, coles_tfidf, rows, columns)
+    keep = scores > similarity_threshold
+    rows, columns, scores = rows[keep], columns[keep], scores[keep]
+
+    lost_matches = None
+    if blocking.verify:
+        blocks = list(iter_similar_pairs(woolworths_tfidf, coles_tfidf, similarity_threshold))
+        if blocks:
+            all_rows = np.concatenate([block[0] for block in blocks])
+            all_columns = np.concatenate([block[1] for block in blocks])
+        else:
+            all_rows, all_columns = np.array([], dtype=np.int64), np.array([], dtype=np.int32)
+        for woolworths_labels, coles_labels in fields:
+            keep = same_block(woolworths_labels, coles_labels, all_rows, all_columns)
+            all_rows, all_columns = all_rows[keep], all_columns[keep]
+        found = set(zip(rows.tolist(), columns.tolist()))
+        lost_matches = sum(1 for pair in zip(all_rows.tolist(), all_columns.tolist()) if pair not in found)
+
+    report = BlockingReport(num_woolworths * coles_tfidf.shape[0], num_candidates, lost_matches)
+    return rows, columns, scores, report
@@ -0,0 +1,306 @@
+'''
+
+    Incrementally merge the per-category files written by the scrapers into a single 'combined.json'.
+
+    Category files are NDJSON files ('.ndjson', one product per line, see ndjson_stream.py) or, from older crawls, JSON
+    files holding an array of products. If a category has both, the NDJSON file is the newer one and the JSON file is
+    ignored. NDJSON files are read one product at a time.
+
+    A manifest next to the merged file records the size, modification time and SHA-1 hash of every category file, and
+    where that file's products sit in the merged file. It also records the size, modification time and hash of the
+    merged file itself, and the offsets are only trusted if the merged file still matches - if a crash left a merged
+    file the manifest doesn't describe, every category file is parsed again. On the next run only category files whose size or modification
+    time changed are hashed, only files whose hash changed are parsed again, and the products of every other file are
+    copied byte for byte from the previous merged file. If nothing changed the merged file isn't touched at all.
+
+    The merged file is a compact JSON array (no indentation) so it is quick to write and to load, and it is never read
+    back in as one of its own inputs. For the 'Woolworths' and 'Coles' directories the merged products are also written
+    to a columnar product store ('combined.store', see product_store.py) which process.py opens with mmap, and ingested
+    as a snapshot into the price history ('history', see price_history.py) with the time of the newest category file.
+
+    Neither of those loads the merged file. Each category file gets a small product store of its own ('combined.parts',
+    named after the file and its hash) when it is parsed, and the product store is rebuilt by joining the parts with
+    product_store.combine_stores(). The product stores record which category file every product came from, so only the
+    products of the files that were parsed, or that a changed or removed file no longer hides, are passed to the price
+    history, together with the names that are gone. The product store records the number of snapshots in the history
+    when it was ingested, and if that doesn't match (e.g. the history is new, or a crash came between the two) every
+    product is ingested instead.
+
+'''
+
+import json, os, hashlib, shutil
+import numpy as np
+import product_store, ndjson_stream, price_history
+
+MERGED_FILENAME = 'combined.json'
+MANIFEST_FILENAME = 'combined.manifest.json'
+PARTS_DIRNAME = 'combined.parts'
+
+def file_hash(filename):
+    ''' Compute the SHA-1 hash of a file without reading it into memory all at once
+    :param filename: the name of the file
+    :return: hex digest string '''
+    sha1 = hashlib.sha1()
+    f = open(filename, 'rb')
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        sha1.update(chunk)
+    f.close()
+    return sha1.hexdigest()
+
+def merged_matches(directory, merged):
+    ''' Check the merged file of a directory is the one a manifest describes
+    :param directory: the name of the directory, ending with a slash
+    :param merged: dictionary with the size, mtime and sha1 of the merged file as recorded in the manifest
+    :return: boolean '''
+    stat = os.stat(directory + MERGED_FILENAME)
+    if stat.st_size != merged.get('size'):
+        return False
+    if stat.st_mtime_ns == merged.get('mtime'):
+        return True
+    return file_hash(directory + MERGED_FILENAME) == merged.get('sha1')
+
+def load_manifest(directory):
+    ''' Load the manifest of a directory, an empty manifest is returned if there isn't one, the merged file is missing or
+    the merged file isn't the one the manifest describes
+    :param directory: the name of the directory, ending with a slash
+    :return: tuple (files, merged) - files is a dictionary where the key is a category filename and the value is a
+             dictionary with size, mtime, sha1, offset and length, merged is a dictionary with the size, mtime and sha1
+             of the merged file (None for an empty manifest) '''
+    if not os.path.exists(directory + MANIFEST_FILENAME) or not os.path.exists(directory + MERGED_FILENAME):
+        return {}, None
+    try:
+        f = open(directory + MANIFEST_FILENAME, 'r')
+        manifest = json.load(f)
+        f.close()
+    except ValueError:
+        return {}, None
+    merged = manifest.get('merged')
+    if not isinstance(merged, dict) or not merged_matches(directory, merged):
+        return {}, None
+    return manifest.get('files', {}), merged
+
+def save_manifest(directory, files, merged):
+    ''' Save the manifest of a directory, writing to a temporary file first
+    :param directory: the name of the directory, ending with a slash
+    :param files: dictionary of category files as returned by load_manifest()
+    :param merged: dictionary with the size, mtime and sha1 of the merged file '''
+    temporary_filename = directory + MANIFEST_FILENAME + '.tmp'
+    f = open(temporary_filename, 'w')
+    json.dump({'merged': dict(merged, filename=MERGED_FILENAME), 'files': files}, f, indent=4, sort_keys=True)
+    f.close()
+    os.replace(temporary_filename, directory + MANIFEST_FILENAME)
+
+def category_files(directory):
+    ''' List the category NDJSON and JSON files in a directory, never including the merged file or the manifest
+    A JSON file is left out if there is an NDJSON file for the same category
+    :param directory: the name of the directory, ending with a slash
+    :return: sorted list of filenames '''
+    files = os.listdir(directory)
+    ndjson_files = set(file for file in files if file.endswith(ndjson_stream.NDJSON_EXTENSION))
+    json_files = set(file for file in files if file.endswith('.json') and file not in (MERGED_FILENAME, MANIFEST_FILENAME)
+                     and file[:-len('.json')] + ndjson_stream.NDJSON_EXTENSION not in ndjson_files)
+    return sorted(ndjson_files | json_files)
+
+def encode_segment(products):
+    ''' Encode products as the compact body of a JSON array (without the brackets)
+    :param products: list of product dictionaries
+    :return: bytes '''
+    return ','.join(json.dumps(product, separators=(',', ':')) for product in products).encode('utf-8')
+
+def read_segment(directory, entry):
+    ''' Load the products of one category file from the merged file
+    :param directory: the name of the directory, ending with a slash
+    :param entry: the category file's manifest entry
+    :return: list of product dictionaries '''
+    f = open(directory + MERGED_FILENAME, 'rb')
+    f.seek(entry['offset'])
+    segment = f.read(entry['length'])
+    f.close()
+    return json.loads(b'[' + segment + b']')
+
+def store_name(directory):
+    ''' The store a directory holds products of, 'Woolworths' or 'Coles', or None for any other directory '''
+    store = os.path.basename(os.path.normpath(directory))
+    return store if store in ('Woolworths', 'Coles') else None
+
+def load_merged(directory):
+    ''' Load the products in the merged file of a directory
+    :param directory: the name of the directory, ending with a slash
+    :return: list of product dictionaries '''
+    f = open(directory + MERGED_FILENAME, 'r')
+    products = json.load(f)
+    f.close()
+    return products
+
+def part_directory(directory, file, entry):
+    ''' The directory of the product store of one category file '''
+    return os.path.join(directory + PARTS_DIRNAME, file + '.' + entry['sha1'])
+
+def write_parts(directory, files, parsed):
+    ''' Write the product store of every category file that doesn't have one yet, and remove those of files that are
+    gone or have changed
+    :param directory: the name of the directory, ending with a slash
+    :param files: dictionary of category files as in the manifest, with their offsets into the merged file
+    :param parsed: dictionary - key is a category file that was just parsed, value is its list of products '''
+    store = store_name(directory)
+    for file in sorted(files):
+        part = part_directory(directory, file, files[file])
+        if not os.path.exists(os.path.join(part, 'meta.json')):
+            products = parsed[file] if file in parsed else read_segment(directory, files[file])
+            product_store.write_store(part, products, store, file)
+    keep = set(os.path.basename(part_directory(directory, file, files[file])) for file in files)
+    for name in os.listdir(directory + PARTS_DIRNAME):
+        if name not in keep:
+            shutil.rmtree(os.path.join(directory + PARTS_DIRNAME, name))
+
+def ingest_changes(directory, history, old_store, new_store, files, parsed, crawl_time):
+    ''' Ingest the products of a new product store into the price history, passing only the products whose record may
+    have changed since the old product store was ingested
+    :param directory: the name of the directory, ending with a slash
+    :param history: PriceHistory
+    :param old_store: the ProductStore before this merge, or None
+    :param new_store: the ProductStore after this merge
+    :param files: dictionary of category files as in the manifest, with their offsets into the merged file
+    :param parsed: dictionary - key is a category file that was just parsed, value is its list of products
+    :param crawl_time: the time of the crawl in seconds since 1970, or None
+    :return: the number of changes stored '''
+    if old_store is None or old_store.source is None or old_store.meta.get('snapshots') != len(history.snapshots):
+        # The history wasn't ingested from the old store, so it has to see every product
+        return history.ingest(load_merged(directory), crawl_time)
+
+    old_hash, new_hash = np.asarray(old_store.name_hash), np.asarray(new_store.name_hash)
+    removed = [old_store.names[row] for row in np.flatnonzero(~np.isin(old_hash, new_hash)).tolist()]
+
+    # A product may have changed if it comes from a file that was parsed, or from a different file than before
+    old_source = np.array(old_store.sources + [None], dtype=object)[old_store.source]
+    new_source = np.array(new_store.sources + [None], dtype=object)[new_store.source]
+    order = np.argsort(old_hash)
+    position = np.minimum(np.searchsorted(old_hash[order], new_hash), max(len(old_hash) - 1, 0))
+    previous_source = np.full(len(new_hash), None, dtype=object)
+    if len(old_hash):
+        found = old_hash[order][position] == new_hash
+        previous_source[found] = old_source[order][position][found]
+    parsed_source = np.array([source in parsed for source in new_store.sources] + [False])[new_store.source]
+    rows = np.flatnonzero(parsed_source | (new_source != previous_source))
+
+    products = []
+    for file in sorted(set(new_source[rows].tolist()) - {None}):
+        by_name = {product['name']: product
+                   for product in (parsed[file] if file in parsed else read_segment(directory, files[file]))
+                   if 'name' in product}
+        products.extend(by_name[new_store.names[row]] for row in rows[new_source[rows] == file].tolist())
+    return history.ingest(products, crawl_time, removed=removed)
+
+def update_product_store(directory, files, parsed=None, crawl_time=None):
+    ''' Rebuild the columnar product store of a 'Woolworths' or 'Coles' directory from the product stores of its
+    category files, and ingest it into the price history if a crawl was merged.
+    The new store is written next to the old one and swapped in, so a half-written store is never opened
+    :param directory: the name of the directory, ending with a slash
+    :param files: dictionary of category files as in the manifest, with their offsets into the merged file
+    :param parsed: dictionary - key is a category file that was just parsed, value is its list of products. None if
+                   nothing was merged, e.g. the store is only being rebuilt, then the history isn't touched.
+    :param crawl_time: the time of the crawl in seconds since 1970, or None '''
+    store = store_name(directory)
+    if store is None:
+        return
+    os.makedirs(directory + PARTS_DIRNAME, exist_ok=True)
+    write_parts(directory, files, parsed or {})
+    store_directory = directory + product_store.STORE_DIRNAME
+    if os.path.exists(store_directory + '.tmp'):
+        shutil.rmtree(store_directory + '.tmp')
+    product_store.combine_stores(store_directory + '.tmp',
+                                 [product_store.open_store(part_directory(directory, file, files[file]))
+                                  for file in sorted(files)], store)
+    new_store = product_store.open_store(store_directory + '.tmp')
+
+    snapshots = None
+    if parsed is not None:
+        history = price_history.open_history(directory)
+        old_store = product_store.open_store(store_directory) \
+            if os.path.exists(os.path.join(store_directory, 'meta.json')) else None
+        ingest_changes(directory, history, old_store, new_store, files, parsed, crawl_time)
+        snapshots = len(history.snapshots)
+    product_store.write_meta(store_directory + '.tmp', dict(new_store.meta, snapshots=snapshots))
+
+    if os.path.exists(store_directory):
+        shutil.rmtree(store_directory)
+    os.rename(store_directory + '.tmp', store_directory)
+
+def merge(directory):
+    ''' Incrementally merge all category NDJSON and JSON files in a directory into 'combined.json'
+    Intended usage: merge('Datasets/Woolworths/') or merge('Datasets/Coles/')
+    :param directory: the name of the directory, ending with a slash
+    :return: dictionary with lists of the category files that were 'parsed', 'reused' and 'removed' '''
+
+    old_files, old_merged_entry = load_manifest(directory)
+    new_files = {}
+    report = {'parsed': [], 'reused': [], 'removed': sorted(set(old_files) - set(category_files(directory)))}
+
+    # Work out which category files changed since the last merge
+    for file in category_files(directory):
+        stat = os.stat(directory + file)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        old_entry = old_files.get(file)
+        if old_entry and old_entry['size'] == entry['size'] and old_entry['mtime'] == entry['mtime']:
+            entry['sha1'] = old_entry['sha1']
+        else:
+            # The file was touched, but its contents may still be the same
+            entry['sha1'] = file_hash(directory + file)
+        if old_entry and old_entry['sha1'] == entry['sha1']:
+            report['reused'].append(file)
+        else:
+            report['parsed'].append(file)
+        new_files[file] = entry
+
+    # Nothing changed - keep the merged file as it is, just record any new modification times
+    if not report['parsed'] and not report['removed']:
+        for file in new_files:
+            new_files[file]['offset'] = old_files[file]['offset']
+            new_files[file]['length'] = old_files[file]['length']
+        if any(new_files[file]['mtime'] != old_files[file]['mtime'] for file in new_files):
+            save_manifest(directory, new_files, old_merged_entry)
+        if not os.path.exists(directory + product_store.STORE_DIRNAME):
+            update_product_store(directory, new_files)
+        return report
+
+    # Write the new merged file, copying unchanged products from the old merged file instead of parsing them again
+    old_merged = open(directory + MERGED_FILENAME, 'rb') if report['reused'] else None
+    temporary_filename = directory + MERGED_FILENAME + '.tmp'
+    merged = open(temporary_filename, 'wb')
+    sha1 = hashlib.sha1()
+    def write(data):
+        merged.write(data)
+        sha1.update(data)
+    write(b'[')
+    offset = 1
+    parsed = {}
+    for file in sorted(new_files):
+        if file in report['reused']:
+            old_merged.seek(old_files[file]['offset'])
+            segment = old_merged.read(old_files[file]['length'])
+        else:
+            parsed[file] = list(ndjson_stream.iter_products(directory + file))
+            segment = encode_segment(parsed[file])
+        if segment:
+            if offset > 1:
+                write(b',')
+                offset += 1
+            write(segment)
+        new_files[file]['offset'] = offset
+        new_files[file]['length'] = len(segment)
+        offset += len(segment)
+    write(b']')
+    merged.close()
+    if old_merged:
+        old_merged.close()
+
+    # The manifest records the merged file it describes, so offsets into an older or newer merged file left behind by
+    # a crash between these steps are never trusted, and everything after the merged file is redone on the next run
+    os.replace(temporary_filename, directory + MERGED_FILENAME)
+    # The newest category file is when the crawl finished, ingest() moves it forward to the latest snapshot if a
+    # category file was restored from an older crawl
+    crawl_time = max([entry['mtime'] for entry in new_files.values()] or [0]) / 1e9
+    update_product_store(directory, new_files, parsed, crawl_time or None)
+    stat = os.stat(directory + MERGED_FILENAME)
+    save_manifest(directory, new_files, {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1.hexdigest()})
+    return report
@@ -0,0 +1,89 @@
+'''
+
+    Stream products to and from newline-delimited JSON (NDJSON) files.
+
+    The scrapers used to keep every product of a category in a list and write it with one json.dumps() call once the
+    last page was scraped, and process.py read category files back with one json.load() call. An NDJSON file has one
+    compact JSON product per line, so products can be written the moment a page is extracted and read back one at a
+    time - neither side ever needs a whole category in memory.
+
+    NDJSONWriter writes to a '.partial' file next to the real one, fsyncs it every so many products and renames it into
+    place in finalize(), so a category file is either complete or not there at all. merge.py ignores '.partial' files.
+
+'''
+
+import json, os
+import instrumentation
+
+NDJSON_EXTENSION = '.ndjson'
+PARTIAL_EXTENSION = '.partial'
+
+class NDJSONWriter:
+    ''' Append products to an NDJSON file as they are scraped, see the module docstring '''
+    def __init__(self, filename, sync_every=500):
+        ''' :param filename: the final name of the file, e.g. '../Datasets/Coles/bakery.ndjson'
+        :param sync_every: fsync the file after every sync_every products '''
+        self.filename = filename
+        self.partial_filename = filename + PARTIAL_EXTENSION
+        self.sync_every = sync_every
+        self.count = 0 # products written so far
+        self.unsynced = 0 # products written since the last fsync
+        self.file = open(self.partial_filename, 'w', encoding='utf-8')
+
+    def write(self, product):
+        ''' Append one product
+        :param product: a dictionary that will be encoded as one line of JSON '''
+        self.file.write(json.dumps(product, sort_keys=True, separators=(',', ':')) + '\n')
+        self.count += 1
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def write_many(self, products):
+        ''' Append every product in a list, e.g. one page of products '''
+        for product in products:
+            self.write(product)
+
+    def sync(self):
+        ''' Make sure every product written so far is on disk '''
+        with instrumentation.span('save.sync'):
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def finalize(self):
+        ''' Sync and close the file and rename it to its final name, replacing any older file
+        :return: the number of products written '''
+        self.sync()
+        self.file.close()
+        os.replace(self.partial_filename, self.filename)
+        return self.count
+
+    def abort(self):
+        ''' Close and delete the partial file, leaving any older file with the final name untouched '''
+        self.file.close()
+        if os.path.exists(self.partial_filename):
+            os.remove(self.partial_filename)
+
+def iter_ndjson(filename):
+    ''' Read an NDJSON file one product at a time, blank lines are skipped
+    :param filename: the name of the NDJSON file
+    :return: generator of dictionaries '''
+    f = open(filename, 'r', encoding='utf-8')
+    try:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        f.close()
+
+def iter_products(filename):
+    ''' Read products from either an NDJSON file, streamed one at a time, or a JSON file holding an array of products
+    :param filename: the name of the file, NDJSON files must end with '.ndjson'
+    :return: iterator of dictionaries '''
+    if filename.endswith(NDJSON_EXTENSION):
+        return iter_ndjson(filename)
+    f = open(filename, 'r', encoding='utf-8')
+    products = json.load(f)
+    f.close()
+    return iter(products)
@@ -0,0 +1,383 @@
+'''
+
+    An append-only history of the products and prices of one retailer, e.g. in 'Datasets/Woolworths/history'.
+
+    Every crawl overwrites the category files, so without a history there is no way to see how prices changed. Keeping a
+    full copy of every crawl would waste a lot of disk because most prices don't change from one day to the next, so
+    each crawl is ingested as a snapshot and only the products whose record changed are stored (delta encoding):
+
+    - names.ndjson      every product name ever seen, one JSON string per line, the line number is the product id
+    - values.ndjson     every distinct product record ever seen (price, special, unit price and category), one JSON
+                        object per line, the line number is the value id. Identical records share one value id.
+    - snapshots.ndjson  the time of every snapshot ingested
+    - log.ndjson        changes not compacted yet, one [product id, time, value id] per line. Value id -1 means the
+                        product disappeared from the crawl.
+    - segments/         compacted changes, one directory per segment with columns product.npy, time.npy and value.npy
+                        sorted by product then time, plus by_time.npy (rows in time order) and times.npy (the times in
+                        that order) so a segment can be searched by time as well as by product
+    - latest.npz        the value id of every product in the latest snapshot, so ingesting a crawl only compares it
+                        with the latest snapshot instead of reading every change. It is a cache - it records how many
+                        changes it reflects and is rebuilt from the changes if that isn't the number on disk.
+
+    Times are seconds since 1970 (UTC). A snapshot is never earlier than the one before it, a crawl timed earlier (e.g.
+    category files with an older modification time) is ingested at the time of the latest snapshot instead. Once the log holds compact_every changes it is compacted into a new sorted
+    segment, and once there are more than max_segments segments they are merged into one.
+
+    Because segments are sorted, the price series of one product is found with a binary search in each segment, and the
+    changes in a time range with a binary search of each segment's time index (segments outside the range are skipped
+    entirely) - neither has to read every snapshot. snapshot() rebuilds the products as they were at any point in time,
+    in the same format as read_product_json() returns, so compare_products() in process.py can be run on any date.
+
+'''
+
+import json, os, shutil, time, datetime, zipfile
+import numpy as np
+
+HISTORY_DIRNAME = 'history'
+LATEST_FILENAME = 'latest.npz'
+
+# The fields of a product record that are kept in the history, for each store
+FIELDS = {
+    'Woolworths': ['price', 'special', 'unitPrice', 'category'],
+    'Coles': ['price', 'special', 'category'],
+}
+
+# Value id of a product that disappeared from the crawl
+REMOVED = -1
+
+def to_timestamp(when):
+    ''' Convert a point in time to seconds since 1970
+    :param when: a number of seconds, a datetime (naive datetimes are local time), a date (the end of that day, local
+                 time) or an ISO 8601 string such as '2021-03-01' or '2021-03-01T12:00:00'
+    :return: int '''
+    if isinstance(when, str):
+        when = datetime.datetime.fromisoformat(when) if 'T' in when or ' ' in when else datetime.date.fromisoformat(when)
+    if isinstance(when, datetime.datetime):
+        return int(when.timestamp())
+    if isinstance(when, datetime.date):
+        return int(datetime.datetime.combine(when, datetime.time.max).timestamp())
+    return int(when)
+
+def read_lines(filename):
+    ''' Read every complete JSON line of an append-only file, skipping a line cut short by a crash
+    :return: list '''
+    records = []
+    if not os.path.exists(filename):
+        return records
+    f = open(filename, 'r', encoding='utf-8')
+    for line in f:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    f.close()
+    return records
+
+def append_lines(filename, records):
+    ''' Append records to an append-only file as JSON lines and make sure they are on disk '''
+    if not records:
+        return
+    # Never append to the end of a line cut short by a crash, it is skipped by read_lines() instead
+    torn = False
+    if os.path.exists(filename) and os.path.getsize(filename) > 0:
+        f = open(filename, 'rb')
+        f.seek(-1, os.SEEK_END)
+        torn = f.read(1) != b'\n'
+        f.close()
+    f = open(filename, 'a', encoding='utf-8')
+    if torn:
+        f.write('\n')
+    f.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+class Segment:
+    ''' A compacted, sorted segment of changes, opened with mmap '''
+    def __init__(self, directory):
+        f = open(os.path.join(directory, 'meta.json'), 'r')
+        meta = json.load(f)
+        f.close()
+        self.directory = directory
+        self.count = meta['count']
+        self.min_time = meta['min_time']
+        self.max_time = meta['max_time']
+        self.product = np.load(os.path.join(directory, 'product.npy'), mmap_mode='r')
+        self.time = np.load(os.path.join(directory, 'time.npy'), mmap_mode='r')
+        self.value = np.load(os.path.join(directory, 'value.npy'), mmap_mode='r')
+        self.by_time = np.load(os.path.join(directory, 'by_time.npy'), mmap_mode='r')
+        self.times = np.load(os.path.join(directory, 'times.npy'), mmap_mode='r')
+
+def write_segment(directory, product, time, value):
+    ''' Write changes as a sorted segment
+    :param directory: the segment directory, created
+    :param product: Numpy array of product ids
+    :param time: Numpy array of times
+    :param value: Numpy array of value ids '''
+    order = np.lexsort((time, product))
+    product, time, value = product[order], time[order], value[order]
+    by_time = np.argsort(time, kind='stable')
+    os.makedirs(directory)
+    np.save(os.path.join(directory, 'product.npy'), product.astype(np.int32))
+    np.save(os.path.join(directory, 'time.npy'), time.astype(np.int64))
+    np.save(os.path.join(directory, 'value.npy'), value.astype(np.int32))
+    np.save(os.path.join(directory, 'by_time.npy'), by_time.astype(np.int64))
+    np.save(os.path.join(directory, 'times.npy'), time[by_time].astype(np.int64))
+    # meta.json is written last so a segment is only ever opened once all of its columns exist
+    f = open(os.path.join(directory, 'meta.json'), 'w')
+    json.dump({'count': len(product), 'min_time': int(time.min()) if len(time) else 0,
+               'max_time': int(time.max()) if len(time) else 0}, f)
+    f.close()
+
+class PriceHistory:
+    ''' The price history of one retailer, see the module docstring '''
+    def __init__(self, directory, store, compact_every=100000, max_segments=8):
+        ''' :param directory: the history directory, created if it doesn't exist
+        :param store: either 'Woolworths' or 'Coles'
+        :param compact_every: compact the log into a segment once it holds this many changes
+        :param max_segments: merge all segments into one once there are more than this many '''
+        assert(store == 'Woolworths' or store == 'Coles')
+        self.directory = directory
+        self.store = store
+        self.fields = FIELDS[store]
+        self.compact_every = compact_every
+        self.max_segments = max_segments
+        os.makedirs(os.path.join(directory, 'segments'), exist_ok=True)
+
+        self.names = read_lines(self.path('names.ndjson'))
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+        self.values = read_lines(self.path('values.ndjson'))
+        self.value_ids = {json.dumps(value, sort_keys=True): i for i, value in enumerate(self.values)}
+        self.snapshots = read_lines(self.path('snapshots.ndjson'))
+        log = np.array(read_lines(self.path('log.ndjson')), dtype=np.int64).reshape(-1, 3)
+        self.log_product, self.log_time, self.log_value = log[:, 0], log[:, 1], log[:, 2]
+        self.segments = [Segment(os.path.join(directory, 'segments', name))
+                         for name in sorted(os.listdir(os.path.join(directory, 'segments')))
+                         if os.path.exists(os.path.join(directory, 'segments', name, 'meta.json'))]
+        self.latest = None # value id of every product id in the latest snapshot, loaded by the first ingest()
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def columns(self):
+        ''' Every change in the segments and the log
+        :return: tuple of Numpy arrays (product, time, value) '''
+        parts = [(segment.product, segment.time, segment.value) for segment in self.segments]
+        parts.append((self.log_product, self.log_time, self.log_value))
+        return tuple(np.concatenate([np.asarray(part[i], dtype=np.int64) for part in parts]) for i in range(3))
+
+    def latest_values(self, when=None):
+        ''' The value id of every product as of a point in time
+        :param when: seconds since 1970, None for the latest
+        :return: tuple of Numpy arrays (product ids, value ids), REMOVED for products that had disappeared '''
+        product, times, value = self.columns()
+        if when is not None:
+            keep = times <= when
+            product, times, value = product[keep], times[keep], value[keep]
+        order = np.lexsort((times, product))
+        product, value = product[order], value[order]
+        last = np.ones(len(product), dtype=np.bool_)
+        last[:-1] = product[1:] != product[:-1]
+        return product[last], value[last]
+
+    def num_changes(self):
+        ''' The number of changes in the segments and the log '''
+        return sum(segment.count for segment in self.segments) + len(self.log_product)
+
+    def load_latest(self):
+        ''' The value id of every product in the latest snapshot, from latest.npz if it is up to date or else from
+        every change
+        :return: Numpy array indexed by product id, REMOVED for products that aren't in the latest snapshot '''
+        latest = np.full(len(self.names), REMOVED, dtype=np.int32)
+        try:
+            with np.load(self.path(LATEST_FILENAME)) as state:
+                if int(state['changes']) == self.num_changes() and len(state['value']) <= len(self.names):
+                    latest[:len(state['value'])] = state['value']
+                    return latest
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            pass # no state yet, or one left behind by a crash
+        product_ids, value_ids = self.latest_values()
+        latest[product_ids] = value_ids
+        return latest
+
+    def save_latest(self):
+        ''' Save the latest snapshot's value ids, writing to a temporary file first so latest.npz is always whole '''
+        temporary_filename = self.path(LATEST_FILENAME + '.tmp')
+        f = open(temporary_filename, 'wb')
+        np.savez(f, value=self.latest, changes=np.int64(self.num_changes()))
+        f.close()
+        os.replace(temporary_filename, self.path(LATEST_FILENAME))
+
+    def encode(self, product):
+        ''' The value id of a product record, adding the record to the values table if it is new
+        :return: tuple (value id, the record if it is new or else None) '''
+        record = {field: product[field] for field in self.fields if field in product}
+        key = json.dumps(record, sort_keys=True)
+        if key in self.value_ids:
+            return self.value_ids[key], None
+        self.value_ids[key] = len(self.values)
+        self.values.append(record)
+        return self.value_ids[key], record
+
+    def ingest(self, products, timestamp=None, removed=None):
+        ''' Ingest a crawl as a snapshot, storing only the products that changed, appeared or disappeared since the last one
+        :param products: iterable of product dictionaries as scraped, or a dictionary of them as returned by
+                         read_product_json(), products without a name are skipped
+        :param timestamp: the time of the crawl, anything to_timestamp() accepts, defaults to now. Snapshots are
+                          compared with the latest one ingested, so a time earlier than the latest snapshot is moved
+                          forward to it.
+        :param removed: None if products is the whole crawl, so any product not in it disappeared. Otherwise products
+                        are only the ones that may have changed, removed is a list of the names of products that
+                        disappeared, and every other product is the same as in the latest snapshot.
+        :return: the number of changes stored '''
+        timestamp = to_timestamp(timestamp if timestamp is not None else time.time())
+        if self.snapshots:
+            timestamp = max(timestamp, max(self.snapshots))
+        if isinstance(products, dict):
+            products = products.values()
+        if self.latest is None:
+            self.latest = self.load_latest()
+
+        new_names, new_values, changes = [], [], {}
+        for product in products:
+            name = product.get('name')
+            if not name:
+                continue
+            if name not in self.name_ids:
+                self.name_ids[name] = len(self.names)
+                self.names.append(name)
+                new_names.append(name)
+            value_id, new_value = self.encode(product)
+            if new_value is not None:
+                new_values.append(new_value)
+            changes[self.name_ids[name]] = value_id # a later duplicate of a name replaces an earlier one
+
+        # Products that changed, appeared or disappeared since the last snapshot
+        previous = np.full(len(self.names), REMOVED, dtype=np.int32)
+        previous[:len(self.latest)] = self.latest
+        if removed is None:
+            latest = np.full(len(self.names), REMOVED, dtype=np.int32)
+        else:
+            latest = previous.copy()
+            for name in removed:
+                if name in self.name_ids and self.name_ids[name] not in changes:
+                    latest[self.name_ids[name]] = REMOVED
+        latest[np.fromiter(changes.keys(), dtype=np.int64, count=len(changes))] = \
+            np.fromiter(changes.values(), dtype=np.int64, count=len(changes))
+        changed = np.flatnonzero(latest != previous)
+        rows = [[product_id, timestamp, value_id] for product_id, value_id in zip(changed.tolist(), latest[changed].tolist())]
+
+        # Names and values first, so the log never refers to one that isn't on disk
+        append_lines(self.path('names.ndjson'), new_names)
+        append_lines(self.path('values.ndjson'), new_values)
+        append_lines(self.path('log.ndjson'), rows)
+        append_lines(self.path('snapshots.ndjson'), [timestamp])
+        self.snapshots.append(timestamp)
+        if rows:
+            log = np.array(rows, dtype=np.int64)
+            self.log_product = np.concatenate([self.log_product, log[:, 0]])
+            self.log_time = np.concatenate([self.log_time, log[:, 1]])
+            self.log_value = np.concatenate([self.log_value, log[:, 2]])
+        self.latest = latest
+
+        if len(self.log_product) >= self.compact_every:
+            self.compact()
+        self.save_latest()
+        return len(rows)
+
+    def compact(self):
+        ''' Move the log into a new sorted segment, and merge all segments into one if there are too many '''
+        segments_directory = os.path.join(self.directory, 'segments')
+        if len(self.log_product):
+            number = int(os.path.basename(self.segments[-1].directory)) + 1 if self.segments else 1
+            directory = os.path.join(segments_directory, '%06d' % number)
+            write_segment(directory, self.log_product, self.log_time, self.log_value)
+            self.segments.append(Segment(directory))
+            # The changes are now in the segment, so the log can be emptied
+            open(self.path('log.ndjson'), 'w').close()
+            self.log_product = self.log_product[:0]
+            self.log_time = self.log_time[:0]
+            self.log_value = self.log_value[:0]
+
+        if len(self.segments) > self.max_segments:
+            product, times, value = self.columns()
+            number = int(os.path.basename(self.segments[-1].directory)) + 1
+            directory = os.path.join(segments_directory, '%06d' % number)
+            write_segment(directory, product, times, value)
+            old_segments = self.segments
+            self.segments = [Segment(directory)]
+            for segment in old_segments:
+                shutil.rmtree(segment.directory)
+
+    def record(self, value_id, name):
+        ''' The product dictionary of a value id, None for REMOVED '''
+        if value_id == REMOVED:
+            return None
+        product = dict(self.values[value_id])
+        product['name'] = name
+        return product
+
+    def series(self, name):
+        ''' The price history of one product
+        :param name: the name of the product
+        :return: list of (time, product dictionary) in time order, the product is None from when it disappeared '''
+        product_id = self.name_ids.get(name)
+        if product_id is None:
+            return []
+        times, values = [], []
+        for segment in self.segments:
+            start = np.searchsorted(segment.product, product_id, 'left')
+            end = np.searchsorted(segment.product, product_id, 'right')
+            times.append(np.asarray(segment.time[start:end]))
+            values.append(np.asarray(segment.value[start:end]))
+        in_log = self.log_product == product_id
+        times.append(self.log_time[in_log])
+        values.append(self.log_value[in_log])
+        times, values = np.concatenate(times), np.concatenate(values)
+        order = np.argsort(times, kind='stable')
+        return [(int(times[i]), self.record(int(values[i]), name)) for i in order]
+
+    def changes(self, start, end=None):
+        ''' Every change between two points in time
+        :param start: the start of the range, anything to_timestamp() accepts
+        :param end: the end of the range (inclusive), defaults to now
+        :return: list of (time, name, product dictionary) in time order, the product is None if it disappeared '''
+        start = to_timestamp(start)
+        end = to_timestamp(end if end is not None else time.time())
+        product, times, value = [], [], []
+        for segment in self.segments:
+            if segment.max_time < start or segment.min_time > end:
+                continue
+            lo = np.searchsorted(segment.times, start, 'left')
+            hi = np.searchsorted(segment.times, end, 'right')
+            rows = np.sort(np.asarray(segment.by_time[lo:hi]))
+            product.append(np.asarray(segment.product[rows]))
+            times.append(np.asarray(segment.time[rows]))
+            value.append(np.asarray(segment.value[rows]))
+        in_range = (self.log_time >= start) & (self.log_time <= end)
+        product.append(self.log_product[in_range])
+        times.append(self.log_time[in_range])
+        value.append(self.log_value[in_range])
+        product, times, value = np.concatenate(product), np.concatenate(times), np.concatenate(value)
+        order = np.lexsort((product, times))
+        return [(int(times[i]), self.names[product[i]], self.record(int(value[i]), self.names[product[i]]))
+                for i in order]
+
+    def snapshot(self, when=None):
+        ''' The products as they were at a point in time
+        :param when: anything to_timestamp() accepts, None for the latest snapshot
+        :return: dictionary - key is product name, value is product JSON (another dictionary), like read_product_json() '''
+        product_ids, value_ids = self.latest_values(to_timestamp(when) if when is not None else None)
+        products = {}
+        for product_id, value_id in zip(product_ids.tolist(), value_ids.tolist()):
+            if value_id != REMOVED:
+                name = self.names[product_id]
+                products[name] = self.record(value_id, name)
+        return products
+
+def open_history(directory):
+    ''' Open the price history in a retailer's directory
+    :param directory: the retailer's directory, e.g. 'Datasets/Woolworths/', its name is the store name
+    :return: PriceHistory '''
+    store = os.path.basename(os.path.normpath(directory))
+    return PriceHistory(os.path.join(directory, HISTORY_DIRNAME), store)
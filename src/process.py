@@ -7,27 +7,49 @@
     prices of these products and perform a t-distribution test to determine if there is a statistically significant
     difference in price between Woolworths and Coles as well as generating some visualisations.
 
+    Run with --report DIRECTORY to render every visualisation to a file in that directory instead of showing it in a
+    window, e.g. for a nightly job on a server without a display. Figures are then rendered in parallel on the
+    non-interactive Agg backend and the animated bar plot is encoded straight to a video (or a GIF without ffmpeg).
+
+    cli.py runs the steps on their own as well, e.g. 'python cli.py match' or 'python cli.py stats' without the plots.
+
 '''
 
-import json, re, os, scipy.stats, statistics
-from sklearn.feature_extraction.text import TfidfVectorizer
-import matplotlib.pyplot as plt
+import json, re, os, multiprocessing, subprocess
+import instrumentation, matching, match_cache, merge, ndjson_stream, price_history, product_store, stats_engine, unit_prices
 import numpy as np
-from matplotlib import animation
 from textwrap import wrap
 
+# matplotlib takes seconds to import, so it is imported by the functions that use it rather than here - reading,
+# merging and matching products doesn't pay for it
+
+# Scatter plots of more points than this are binned (2D) or randomly sampled (3D), drawing every point is very slow
+MAX_SCATTER_POINTS = 20000
+
+# Histograms use one bin for every 4 data points, but never more bins than this
+MAX_HISTOGRAM_BINS = 250
+
+# The animated bar plot shows each matched product for this many milliseconds
+ANIMATION_INTERVAL = 2000
+
+# The most matched products in an animated bar plot saved to a file, spread evenly over all matched products
+MAX_ANIMATION_FRAMES = 300
+
 
 class UnitPrice:
     '''
     This class represents the unit price of a product.
 
     A unit price has three components:
-    - unit is a string either 'kg', 'grams' or 'each'.
+    - unit is a string either 'kg', 'litre' or 'each'.
     - quantity is an integer.
     - price is a float in dollars.
 
     So for example if the price of apples is $5 per kg then:
     price = 5, unit = 'kg', quantity = 1
+
+    Matched products always have their unit price normalized to a quantity of 1 base unit, so $2 per 100 grams is
+    price = 20, unit = 'kg', quantity = 1
     '''
     def __init__(self, price, unit, quantity):
         self.price = price
@@ -35,13 +57,15 @@ class UnitPrice:
         self.quantity = quantity
 
 class Product:
-    ''' This class represents a product including the product name, store (either Woolworths or Coles) and unit price '''
-    def __init__(self, name, store, unit_price):
+    ''' This class represents a product including the product name, store (either Woolworths or Coles), unit price and
+    the category the store lists it in (None if the category wasn't scraped) '''
+    def __init__(self, name, store, unit_price, category=None):
         self.name = name
         assert(store == 'Woolworths' or store == 'Coles')
         self.store = store
         assert(type(unit_price) == UnitPrice)
         self.unit_price = unit_price
+        self.category = category
 
 class MatchedProduct:
     ''' This class represents a matched product - i.e. a pair of similar products from Coles and Woolworths
@@ -64,27 +88,13 @@ def load_json(filename):
     return data
 
 def combine(directory):
-    ''' Combine all JSON files in a directory into 'combined.json'
+    ''' Combine all category NDJSON and JSON files in a directory into 'combined.json'
     Intended usage: combine('Datasets/Woolworths/') or combine('Datasets/Coles/')
+    Only files that changed since the last run are parsed again, see merge.py
     :param directory: the name of the directory
     :return: None '''
-    files = os.listdir(directory) # list of all files in directory
-    combined = [] # combined JSON data
-
-    # Loop through all files
-    for file in files:
-        # If the file is a JSON file open it and add data to combined JSON
-        if '.json' in file:
-            f = open(directory + file, 'r')
-            data = json.load(f)
-            f.close()
-            combined += data
-
-    # Save combined JSON file
-    f = open(directory + 'combined.json', 'w+')
-    json_string = json.dumps(combined, indent=4, sort_keys=True)
-    f.write(json_string)
-    f.close()
+    with instrumentation.span('process.combine'):
+        merge.merge(directory)
 
 def combine_woolworths():
     ''' Combine all JSON files in Datasets/Woolworths into combined.json'''
@@ -94,17 +104,30 @@ def combine_coles():
     ''' Combine all JSON files in Datasets/Coles into combined.json '''
     combine('Datasets/Coles/')
 
-def histogram(data, title, xlabel, ylabel, text=None, text_x=0.5, text_y=0.5):
+def show_or_save(fig, filename=None):
+    ''' Display a figure in a window, or save it to a file and close it
+    :param fig: the matplotlib figure
+    :param filename: the file to save the figure to, None to display it '''
+    import matplotlib.pyplot as plt
+    if filename is None:
+        plt.show()
+    else:
+        fig.savefig(filename)
+        plt.close(fig)
+
+def histogram(data, title, xlabel, ylabel, text=None, text_x=0.5, text_y=0.5, filename=None):
     ''' Create and display a histogram with matplotlib
-    It uses one bin for every 4 data points which is fine for the datasets we are working with.
+    It uses one bin for every 4 data points, up to MAX_HISTOGRAM_BINS bins.
     :param data: data to use for histogram
     :param text: description text to display on the histogram
     :param title : title to display
     :param xlabel: x axis label to display
     :param ylabel: y axis label to display
     :param text_x: horizontal displacement of text
-    :param text_y: vertical displacement of text '''
+    :param text_y: vertical displacement of text
+    :param filename: save the histogram to this file instead of displaying it '''
 
+    import matplotlib.pyplot as plt
     fig = plt.figure()
     ax = fig.add_subplot(111)
 
@@ -113,14 +136,14 @@ def histogram(data, title, xlabel, ylabel, text=None, text_x=0.5, text_y=0.5):
         plt.text(text_x, text_y, text, horizontalalignment='left', verticalalignment='center', transform = ax.transAxes)
 
     # Create histogram with title and axis labels
-    num_bins = int(len(data)/4)
+    num_bins = max(1, min(int(len(data)/4), MAX_HISTOGRAM_BINS))
     ax.hist(data, num_bins)
     ax.set_title(title)
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
-    plt.show()
+    show_or_save(fig, filename)
 
-def paired_data_test(differences):
+def paired_data_test(differences, filename=None):
     ''' Note: we are not statisticians, our comment here might not be helpful, feel free to ignore it
     With the sample data we used we believe there was not a statistically significant difference in prices
 
@@ -141,7 +164,7 @@ def paired_data_test(differences):
     In order to use a t-distribution the data has to be a simple random sample of less than 10 percent of the population
     and the data has to be roughly normal although as the sample size increases this becomes less important.
 
-    We pass 0.0 as the popmean parameter to the scipy t-test function.
+    We pass 0.0 as the popmean parameter to the t-test function (stats_engine.t_test(), the same test as Scipy's).
 
     What this means is Scipy will perform a hypothesis test to determine the probability the population mean is equal to zero.
     If the population mean was equal to zero the difference in prices, Woolworths minus Coles would be equal to zero.
@@ -159,11 +182,15 @@ def paired_data_test(differences):
     The documentation for Scipy's one sample t-test function:
     https://docs.scipy.org/doc/scipy-0.15.1/reference/generated/scipy.stats.ttest_1samp.html
 
-    :param differences: the price difference for each matched product, Woolworths price minus Coles price '''
+    :param differences: the price difference for each matched product, Woolworths price minus Coles price
+    :param filename: save the histogram of differences to this file instead of displaying it '''
+
+    # All statistics of the price differences in one pass (see stats_engine.py)
+    summary = stats_engine.summary(differences)
 
     # Print some information to the console about the price differences
-    total_difference = sum(differences)
-    num_similar_products = len(differences)
+    total_difference = summary['total']
+    num_similar_products = summary['n']
     print('Number of similar products found: ' + str(num_similar_products))
     print('Total difference in price, woolworths - coles: ' + str(total_difference))
     if total_difference < 0:
@@ -174,9 +201,8 @@ def paired_data_test(differences):
         print('Coles wins')
 
     # Perform statistical test
-    diff_array = np.array(differences)
     popmean = 0.0
-    t_statistic, two_sided_pvalue = scipy.stats.ttest_1samp(diff_array, popmean, axis=0)
+    t_statistic, two_sided_pvalue = stats_engine.t_test(summary['n'], summary['mean'], summary['stdev'], popmean)
     print('t-score: ' + str(t_statistic))
     print('two sided p-value: ' + str(two_sided_pvalue))
 
@@ -191,20 +217,20 @@ def paired_data_test(differences):
 
     # Create histogram of price differences with p-value and test statistic
     txt  = 'n = ' + str(len(differences)) + '\n'
-    txt += 'sample mean = ' + str(round(statistics.mean(differences),2)) + '\n'
-    txt += 'sample stdev = ' + str(round(statistics.stdev(differences),2)) + '\n'
+    txt += 'sample mean = ' + str(round(summary['mean'],2)) + '\n'
+    txt += 'sample stdev = ' + str(round(summary['stdev'],2)) + '\n'
     txt += 't-score: ' + str(round(t_statistic,2)) + '\n'
     txt += 'two sided p-value: ' + str(round(two_sided_pvalue,2)) + '\n'
     title='Price Difference of Matched Products'
     xlabel='Woolworths price - Coles price'
     ylabel='# occurrences'
-    histogram(differences, title, xlabel, ylabel, txt, text_x=0.1, text_y=0.7)
+    histogram(differences, title, xlabel, ylabel, txt, text_x=0.1, text_y=0.7, filename=filename)
 
 def convert_unit_price(s):
     ''' This function takes a string representing the unit price of a product and parses the string into data that we can
-    work with. It returns a three tuple (price, unit, quantity) where price and quantity are numbers and unit is a string
-    with a value of of 'kg', 'grams', or 'each'. This function only works with the format of strings used on Woolworths.com.au
-    and Coles.com.au. If it fails to parse the string and an exception is thrown it returns None.
+    work with. It returns a three tuple (price, quantity, unit) where price and quantity are numbers and unit is a string
+    with a value of of 'kg', 'grams', 'litre', 'ml' or 'each'. This function only works with the format of strings used on Woolworths.com.au
+    and Coles.com.au. If it fails to parse the string it returns None.
 
     For example if apples cost $5 per kg this would be represented as:
     price = 5, unit = 'kg', quantity = 1
@@ -216,82 +242,21 @@ def convert_unit_price(s):
     "$price per unit"
     "$price / unit"
 
-    where unit is one of 'kg', 'g', 'ea' or 'each' and price is a float
+    where unit is one of 'kg', 'g', 'L', 'mL', 'ea' or 'each' and price is a float
 
-    :param s: unit price string formatted according to rules outlined above
-    :return: tuple (price, unit, quantity) where unit is a string - either 'kg', 'grams', 'each', quantity and price are floats '''
+    Parsing is memoized, and whole columns of strings should be parsed with unit_prices.parse_unit_prices() instead.
 
-    try:
+    :param s: unit price string formatted according to rules outlined above
+    :return: tuple (price, quantity, unit) where unit is a string - either 'kg', 'grams', 'litre', 'ml', 'each', quantity
+    and price are floats '''
 
-        # Split string with either 'per' or '/'
-        if ' per ' in s:
-            l = s.split(' per ')
-        elif ' / ' in s:
-            l = s.split(' / ')
-        else:
-            return None
-
-        price_string = l[0] # a string "$price"
-        price = float(price_string[1:]) # splice away dollar sign
-
-        unit_and_quantity = l[1] # a string - '10kg', '50g', 5 each', etc
-        unit_and_quantity = unit_and_quantity.lower()
-
-        # Branch on unit and extract quantity from string
-        if 'kg' in unit_and_quantity:
-            quantity = float(unit_and_quantity.replace('kg', ''))
-            unit = 'kg'
-            return (price, quantity, unit)
-        elif 'ea' in unit_and_quantity or 'each' in unit_and_quantity:
-            quantity = float(unit_and_quantity.replace('ea', '').replace('each', ''))
-            unit = 'each'
-            return (price, quantity, unit)
-        elif 'g' in unit_and_quantity:
-            quantity = float(unit_and_quantity.replace('g', ''))
-            unit = 'grams'
-            return (price, quantity, unit)
-        else:
-            # This try block seemed to help parse a few products that were causing exceptions
-            try:
-                quantity = float(unit_and_quantity)
-                unit = 'ea'
-            except ValueError:
-                quantity = 'unknown'
-                unit = 'unknown'
-            return (price, quantity, unit)
-    except Exception:
+    parsed = unit_prices.parse_unit_price(s)
+    if parsed is None:
         return None
+    price, quantity, unit = parsed
+    return (price, quantity, unit_prices.UNIT_NAMES[unit])
 
-def text_similarity(string, list_of_strings):
-    ''' This function is used to find the text similarity between a string and every element in a list of strings
-
-    This function is passed the name of a product from one store (string) and a list of names of all products from another
-    store (list_of_strings). It computes the text similarity between the individual product and all products in the list.
-
-    It returns a list of floats - where the (i+1)th element is the similarity between 'string' and the ith element of
-    'list_of_strings', the similarity is between 0 and 1, where higher is more similar.
-
-    :param string: a string - the name of a product from one store
-    :param list_of_strings: a list of strings - names of products from the other store
-    :return: a list where the (i+1)th element is the similarity between 'string' and ith element of 'list_of_strings'
-    the first element of the list is 1.0 - the similarity between 'string' and itself '''
-
-    strings = [string] + list_of_strings
-
-    # This code is based on the following discussion on StackOverflow:
-    # https://stackoverflow.com/questions/8897593/similarity-between-two-text-documents/8897648#8897648
-    vect = TfidfVectorizer(min_df=1)
-    tfidf = vect.fit_transform(strings)
-
-    # similarity_array is a Numpy ndarray where position (i, j) is the similarity between element i and j of strings
-    similarity_array = (tfidf * tfidf.T).A
-
-    # Get the first column as a list - we only care about the first column because this gives us the similarity between
-    # 'string' and every element in list_of_strings. We don't care about similarity between products from the same store.
-    first_column = similarity_array[:,:1]
-    return first_column.tolist()
-
-def barplot_animated(woolworths_prices, coles_prices, matched_product_names):
+def barplot_animated(woolworths_prices, coles_prices, matched_product_names, filename=None, max_frames=None):
     ''' Create animated bar plot displaying price at Coles and Woolworths for each matched product
 
     This code is based on the following discussions on StackOverflow.
@@ -301,7 +266,23 @@ def barplot_animated(woolworths_prices, coles_prices, matched_product_names):
     woolworths_prices, coles_prices and matched_product_names are lists where the ith element of each list correspond to
     each other. For the ith product woolworths_prices[i] is it's price at Woolworths, coles_prices[i] is it's price at
     Coles and matched_product_names[i] is a tuple where the first element is the name of the product at Coles and the
-    second element is the name at Woolworths. '''
+    second element is the name at Woolworths.
+
+    Product names are drawn inside the plot rather than as tick labels, so only the bars and the names have to be
+    redrawn for each product (blitting).
+
+    :param filename: encode the animation to this file instead of displaying it, a video if the filename ends with
+                     '.mp4' (requires ffmpeg) or a GIF if it ends with '.gif'
+    :param max_frames: the most products to animate, spread evenly over all matched products, None for all '''
+
+    import matplotlib.pyplot as plt
+    from matplotlib import animation
+
+    # Only animate every nth product if there are too many
+    if max_frames is not None and len(matched_product_names) > max_frames:
+        frames = np.linspace(0, len(matched_product_names) - 1, max_frames).astype(int).tolist()
+    else:
+        frames = list(range(len(matched_product_names)))
 
     # Setup plot, title, and y-label
     fig, ax = plt.subplots()
@@ -316,56 +297,144 @@ def barplot_animated(woolworths_prices, coles_prices, matched_product_names):
     first_item_prices = [coles_prices[0], woolworths_prices[0]]
     barlist = ax.bar(x_location, first_item_prices, width)
 
-    # Set x-tick labels to the names of the first matched product
+    # Label the bars with the stores, the names of the products are drawn above the bars
     ax.set_xticks(x_location)
-    coles_name = matched_product_names[0][0]
-    woolworths_name = matched_product_names[0][1]
-    ax.set_xticklabels((coles_name + '\n(Coles)', woolworths_name + '\n(Woolworths)'))
+    ax.set_xticklabels(('Coles', 'Woolworths'))
+    labels = [ax.text(x, 0.97, '', horizontalalignment='center', verticalalignment='top', fontsize=8,
+                      transform=ax.get_xaxis_transform()) for x in x_location]
 
     # Set color of Coles bar to red and Woolworths bar to green
     barlist[0].set_color('r')
     barlist[1].set_color('g')
 
-    # Set the height of the barplot to the maximum price of any product
-    plt.ylim(0, max(coles_prices + woolworths_prices))
+    # Set the height of the barplot to the maximum price of any product, leaving room for the product names
+    plt.ylim(0, max(coles_prices + woolworths_prices) * 1.3)
 
     def animate(i):
-        ''' Called once for each pair of matched products, sets height of bars and updates x-tick labels
+        ''' Called once for each pair of matched products, sets height of bars and updates the product names
         :param i: integer between 0 and number of matched products - 1, corresponding to the ith matched product '''
 
         # Set the height of the bars to the prices of the ith matched products
         barlist[0].set_height(coles_prices[i])
         barlist[1].set_height(woolworths_prices[i])
 
-        # Set the x-tick labels to the names of the ith matched products
+        # Set the names of the ith matched products
         coles_product_name = matched_product_names[i][0]
         woolies_product_name = matched_product_names[i][1]
 
         # Wrap long product names over multiple lines
-        coles_label = '\n'.join(wrap(coles_product_name, 25)) + '\n(Coles)'
-        woolworths_label = '\n'.join(wrap(woolies_product_name, 25)) + '\n(Woolworths)'
-
-        ax.set_xticklabels((coles_label, woolworths_label))
+        labels[0].set_text('\n'.join(wrap(coles_product_name, 25)))
+        labels[1].set_text('\n'.join(wrap(woolies_product_name, 25)))
 
-        return barlist
+        return list(barlist) + labels
 
-    # Start bar plot animation
-    anim = animation.FuncAnimation(fig, animate, frames=len(matched_product_names), interval=2000)
-    plt.show()
+    if filename is None:
+        # Start bar plot animation
+        anim = animation.FuncAnimation(fig, animate, frames=frames, interval=ANIMATION_INTERVAL, blit=True)
+        plt.show()
+    else:
+        encode_animation(fig, list(barlist) + labels, animate, frames, filename)
+        plt.close(fig)
+
+def encode_animation(fig, artists, update, frames, filename):
+    ''' Encode an animation straight to a file, redrawing only the artists that change in every frame (blitting)
+    Animation.save() redraws the whole figure - axes, ticks, title - for every frame, which is most of the time it takes.
+    :param fig: the matplotlib figure
+    :param artists: the artists update() changes, everything else is drawn once
+    :param update: function called with each frame before it is drawn
+    :param frames: the frames to pass to update()
+    :param filename: a '.mp4' file (encoded by ffmpeg) or a '.gif' file '''
+    import matplotlib.pyplot as plt
+    for artist in artists:
+        artist.set_animated(True)
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    width, height = fig.canvas.get_width_height()
+    fps = 1000 / ANIMATION_INTERVAL
+
+    def draw(frame):
+        ''' Draw one frame over the background and return its RGBA pixels '''
+        fig.canvas.restore_region(background)
+        update(frame)
+        for artist in artists:
+            artist.axes.draw_artist(artist)
+        return bytes(fig.canvas.buffer_rgba())
+
+    if filename.endswith('.mp4'):
+        # Pipe raw frames to ffmpeg
+        command = [plt.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error', '-f', 'rawvideo',
+                   '-pix_fmt', 'rgba', '-s', str(width) + 'x' + str(height), '-r', str(fps), '-i', '-',
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', filename]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        try:
+            for frame in frames:
+                process.stdin.write(draw(frame))
+        finally:
+            process.stdin.close()
+            if process.wait() != 0:
+                raise RuntimeError('ffmpeg failed to encode ' + filename)
+    else:
+        # Every frame uses the colours of the first frame, which the bars and text are drawn in
+        from PIL import Image
+        images = []
+        palette = None
+        for frame in frames:
+            image = Image.frombuffer('RGBA', (width, height), draw(frame), 'raw', 'RGBA', 0, 1).convert('RGB')
+            if palette is None:
+                palette = image.quantize(64)
+            images.append(image.quantize(palette=palette))
+        # (optimize=False skips Pillow's search for a smaller palette, which takes longer than everything else)
+        images[0].save(filename, save_all=True, append_images=images[1:], duration=ANIMATION_INTERVAL, loop=0,
+                       optimize=False)
+
+def scatter_plot(x, y, title, xlabel, ylabel, text=None, filename=None):
+    ''' Create a 2D scatter plot with title and axis labels
+    With more than MAX_SCATTER_POINTS points, the points are binned into hexagons shaded by how many points they hold
+    :param x: the x axis data points
+    :param y: the y axis data points
+    :param title: the title of the plot
+    :param xlabel: the x axis label
+    :param ylabel: the y axis label
+    :param text: description text to display in the top left corner
+    :param filename: save the plot to this file instead of displaying it '''
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    if len(x) > MAX_SCATTER_POINTS:
+        binned = ax.hexbin(x, y, gridsize=100, bins='log', mincnt=1)
+        fig.colorbar(binned, ax=ax, label='# products')
+    else:
+        ax.scatter(x, y)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if text:
+        plt.text(0.1, 0.9, text, horizontalalignment='left', verticalalignment='center', transform = ax.transAxes)
+    show_or_save(fig, filename)
 
-def scatter_plot_3D(x, y, z, title, xlabel, ylabel, zlabel):
+def scatter_plot_3D(x, y, z, title, xlabel, ylabel, zlabel, filename=None):
     ''' Create a basic 3D scatter plot with title and axis labels
     Based on an example from the official matplotlib documentation:
     https://matplotlib.org/examples/mplot3d/scatter3d_demo.html
+    With more than MAX_SCATTER_POINTS points, a random sample of MAX_SCATTER_POINTS points is plotted (always the same
+    sample for the same data)
     :param x: the x axis data points
     :param y: the y axis data points
     :param z: the z axis daata points
     :param title: the title of the plot
     :param xlabel: the x axis label
     :param ylabel: the y axis label
-    :param zlabel: the z axis label '''
+    :param zlabel: the z axis label
+    :param filename: save the plot to this file instead of displaying it '''
+
+    # Sample the points if there are too many
+    if len(x) > MAX_SCATTER_POINTS:
+        sample = np.sort(np.random.default_rng(0).choice(len(x), MAX_SCATTER_POINTS, replace=False))
+        x, y, z = np.asarray(x)[sample], np.asarray(y)[sample], np.asarray(z)[sample]
+        title += ' (sample of ' + str(MAX_SCATTER_POINTS) + ')'
 
     # Boilerplate
+    import matplotlib.pyplot as plt
     from mpl_toolkits.mplot3d import Axes3D
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
@@ -376,16 +445,33 @@ def scatter_plot_3D(x, y, z, title, xlabel, ylabel, zlabel):
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
     ax.set_zlabel(zlabel)
-    plt.show()
-
-def analysis_and_visualisation(matching_products, all_woolworths_prices, all_coles_prices):
+    show_or_save(fig, filename)
+
+def render_figure(task):
+    ''' Render one figure of a report to its file, run by the worker processes of analysis_and_visualisation()
+    :param task: tuple (name of the plotting function in this module, dictionary of its arguments) '''
+    import matplotlib.pyplot as plt
+    function, arguments = task
+    plt.switch_backend('Agg')
+    globals()[function](**arguments)
+    return arguments['filename']
+
+def analysis_and_visualisation(matching_products, all_woolworths_prices, all_coles_prices, output_directory=None, workers=None):
+    ''' Analyse the prices of matched products and visualise them, see compare_products()
+    :param output_directory: render every figure to a file in this directory instead of displaying it, the figures are
+                             rendered in parallel on the non-interactive Agg backend
+    :param workers: the number of processes to render figures with, defaults to the number of CPUs
+    :return: list of the files written, empty if the figures were displayed '''
+    import matplotlib.pyplot as plt
+    from matplotlib import animation
 
     # lists of prices of matched products
     woolworths_matched_prices = [matched_product.woolworths_product.unit_price.price for matched_product in matching_products]
     coles_matched_prices = [matched_product.coles_product.unit_price.price for matched_product in matching_products]
 
     # list of price difference of matched products, Woolworths price minus Coles price
-    differences = [matched_product.woolworths_product.unit_price.price - matched_product.coles_product.unit_price.price for matched_product in matching_products]
+    # (unit prices of matched products are always per 1 kg, litre or each so they can be subtracted directly)
+    differences = (np.array(woolworths_matched_prices) - np.array(coles_matched_prices)).tolist()
 
     # list of similarity scores for matched products
     similarities = [matched_product.similarity for matched_product in matching_products]
@@ -393,79 +479,149 @@ def analysis_and_visualisation(matching_products, all_woolworths_prices, all_col
     # list of matched product names
     matched_product_names = [(matched_product.coles_product.name, matched_product.woolworths_product.name) for matched_product in matching_products]
 
+    # Every figure is a task - the name of the plotting function, its arguments and the file it is saved to
+    figures = []
+
     # Create histogram of all Woolworths prices (not just matched products) displaying mean, median, stddev, etc
     txt =  'n = ' + str(len(all_woolworths_prices)) + '\n'
-    txt += 'mean   = $' + str(round(statistics.mean(all_woolworths_prices),2)) + '\n'
-    txt += 'median = $' + str(round(statistics.median(all_woolworths_prices),2)) + '\n'
-    txt += 'standard deviation = $' + str(round(statistics.pstdev(all_woolworths_prices),2)) + '\n'
-    title='All Woolworths Product Prices'
-    xlabel='Price ($)'
-    ylabel='# products'
-    histogram(all_woolworths_prices, title, xlabel, ylabel, txt, text_x=0.5, text_y=0.5)
+    summary = stats_engine.summary(all_woolworths_prices)
+    txt += 'mean   = $' + str(round(summary['mean'],2)) + '\n'
+    txt += 'median = $' + str(round(summary['median'],2)) + '\n'
+    txt += 'standard deviation = $' + str(round(summary['pstdev'],2)) + '\n'
+    figures.append(('histogram', {'data': all_woolworths_prices, 'title': 'All Woolworths Product Prices', 'xlabel': 'Price ($)',
+                                  'ylabel': '# products', 'text': txt, 'text_x': 0.5, 'text_y': 0.5}, 'woolworths_prices.png'))
 
     # Create histogram of all Coles prices (not just matched products) displaying mean, median, stddev, etc
     txt =  'n = ' + str(len(all_coles_prices)) + '\n'
-    txt += 'mean   = $' + str(round(statistics.mean(all_coles_prices),2)) + '\n'
-    txt += 'median = $' + str(round(statistics.median(all_coles_prices),2)) + '\n'
-    txt += 'standard deviation = $' + str(round(statistics.pstdev(all_coles_prices),2)) + '\n'
-    title='All Coles Product Prices'
-    xlabel='Price ($)'
-    ylabel='# products'
-    histogram(all_coles_prices, title, xlabel, ylabel, txt, text_x=0.5, text_y=0.5)
+    summary = stats_engine.summary(all_coles_prices)
+    txt += 'mean   = $' + str(round(summary['mean'],2)) + '\n'
+    txt += 'median = $' + str(round(summary['median'],2)) + '\n'
+    txt += 'standard deviation = $' + str(round(summary['pstdev'],2)) + '\n'
+    figures.append(('histogram', {'data': all_coles_prices, 'title': 'All Coles Product Prices', 'xlabel': 'Price ($)',
+                                  'ylabel': '# products', 'text': txt, 'text_x': 0.5, 'text_y': 0.5}, 'coles_prices.png'))
 
     # Create scatter plot for prices of matched products, Woolworths price on x-axis, Coles price on y-axis
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    ax.scatter(woolworths_matched_prices, coles_matched_prices)
-    ax.set_title('Matched Products')
-    ax.set_xlabel('Woolworths price ($)')
-    ax.set_ylabel('Coles price ($)')
-    txt = 'n = ' + str(len(woolworths_matched_prices))
-    plt.text(0.1, 0.9, txt, horizontalalignment='left', verticalalignment='center', transform = ax.transAxes)
-    plt.show()
+    figures.append(('scatter_plot', {'x': woolworths_matched_prices, 'y': coles_matched_prices, 'title': 'Matched Products',
+                                     'xlabel': 'Woolworths price ($)', 'ylabel': 'Coles price ($)',
+                                     'text': 'n = ' + str(len(woolworths_matched_prices))}, 'matched_products.png'))
 
     # Create scatter plot for price difference and similarity score
     # A lower similarity score is associated with higher variance in price
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    ax.scatter(differences, similarities)
-    ax.set_title('Price Difference vs Similarity')
-    ax.set_xlabel('Price Difference, Woolworths - Coles ($)')
-    ax.set_ylabel('Similarity [0.0,1.0]')
-    plt.show()
+    figures.append(('scatter_plot', {'x': differences, 'y': similarities, 'title': 'Price Difference vs Similarity',
+                                     'xlabel': 'Price Difference, Woolworths - Coles ($)',
+                                     'ylabel': 'Similarity [0.0,1.0]'}, 'difference_vs_similarity.png'))
 
     # Create 3D scatter plot displaying matched product prices and similarity score
     # SHows the same association above but on a 3D plot
-    scatter_plot_3D(x=woolworths_matched_prices, y=coles_matched_prices, z=similarities, title='Matched Products', \
-        xlabel='Woolworths price ($)', ylabel='Coles price ($)', zlabel='Similarity Score [0.0,1.0]')
+    figures.append(('scatter_plot_3D', {'x': woolworths_matched_prices, 'y': coles_matched_prices, 'z': similarities,
+                                        'title': 'Matched Products', 'xlabel': 'Woolworths price ($)',
+                                        'ylabel': 'Coles price ($)', 'zlabel': 'Similarity Score [0.0,1.0]'},
+                    'matched_products_3d.png'))
 
-    # Perform statistical hypothesis test
-    paired_data_test(differences)
+    # Perform statistical hypothesis test (which needs at least two matched products)
+    if len(differences) > 1:
+        figures.append(('paired_data_test', {'differences': differences}, 'price_differences.png'))
 
     # Create animated bar plot displaying names and prices of each matched product
-    barplot_animated(woolworths_matched_prices, coles_matched_prices, matched_product_names)
+    animation_filename = 'matched_products.mp4' if animation.writers.is_available('ffmpeg') else 'matched_products.gif'
+    if matched_product_names:
+        figures.append(('barplot_animated', {'woolworths_prices': woolworths_matched_prices, 'coles_prices': coles_matched_prices,
+                                         'matched_product_names': matched_product_names,
+                                         'max_frames': MAX_ANIMATION_FRAMES}, animation_filename))
+
+    # Display every figure in turn
+    if output_directory is None:
+        for function, arguments, filename in figures:
+            arguments.pop('max_frames', None) # the whole animation is shown
+            globals()[function](**arguments)
+        return []
+
+    # Or render them all to files at once
+    os.makedirs(output_directory, exist_ok=True)
+    plt.switch_backend('Agg')
+    tasks = []
+    for function, arguments, filename in figures:
+        arguments['filename'] = os.path.join(output_directory, filename)
+        tasks.append((function, arguments))
+    workers = min(len(tasks), workers or os.cpu_count() or 1)
+    if workers > 1:
+        # The slowest figures first, so they don't hold up the end of the report
+        tasks.sort(key=lambda task: task[0] != 'barplot_animated')
+        pool = multiprocessing.Pool(workers)
+        try:
+            filenames = pool.map(render_figure, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        filenames = [render_figure(task) for task in tasks]
+    return filenames
 
 def read_product_json(filename):
-    ''' Read in product data from JSON file and turn it into a dictionary using product name as key (to make sure there
-    aren't any duplicates) and the product data as value. The product data is a dictionary.
-    :param filename: the JSON file to read in
+    ''' Read in product data from a JSON or NDJSON file and turn it into a dictionary using product name as key (to make
+    sure there aren't any duplicates) and the product data as value. The product data is a dictionary.
+    NDJSON files (ending with '.ndjson', as written by the scrapers) are read one product at a time.
+    :param filename: the JSON or NDJSON file to read in
     :return: dictionary - key is product name, value is product JSON (another dictionary) '''
 
-    # Load JSON data from file
-    file_data = load_json(filename)
     products = {}
 
     # Loop through all products
-    for product in file_data:
-        # some products don't have names for some reason
-        # we're only interested in products with names
-        if 'name' in product:
-            # Add product to dictionary
-            products[product['name']] = product
-
+    with instrumentation.span('process.read_product_json'):
+        for product in ndjson_stream.iter_products(filename):
+            # some products don't have names for some reason
+            # we're only interested in products with names
+            if 'name' in product:
+                # Add product to dictionary
+                products[product['name']] = product
+
+    instrumentation.count('products_read', len(products))
     return products
 
-def find_matching_products(woolworths, coles, similarity_threshold = 0.5, print_to_console=True):
+def unit_price_strings(products, field):
+    ''' Get the unit price string of every product, in the same order as products.keys()
+    :param products: dictionary (or product store) of products as returned by load_products()
+    :param field: the field holding the unit price string - 'unitPrice' for Woolworths and 'price' for Coles
+    :return: list of strings, None for products without a unit price '''
+    if isinstance(products, product_store.ProductStore):
+        return [string or None for string in products.unit_prices.to_list()]
+    return [product.get(field) for product in products.values()]
+
+def special_flags(products):
+    ''' Check which products are on special
+    :param products: dictionary (or product store) of products as returned by load_products()
+    :return: boolean Numpy array in the same order as products.keys() '''
+    if isinstance(products, product_store.ProductStore):
+        return np.asarray(products.on_special)
+    return np.array([product.get('special') not in (None, 'False') for product in products.values()], dtype=np.bool_)
+
+def product_categories(products):
+    ''' Get the category of every product, in the same order as products.keys()
+    :param products: dictionary (or product store) of products as returned by load_products()
+    :return: list of category names, None for products without a category '''
+    if isinstance(products, product_store.ProductStore):
+        return [products.categories[code] if code >= 0 else None for code in products.category.tolist()]
+    return [product.get('category') for product in products.values()]
+
+def load_products(filename):
+    ''' Load products from either a JSON file or a columnar product store directory (see product_store.py)
+    :param filename: the JSON filename or the store directory
+    :return: dictionary-like - key is product name, value is product JSON (another dictionary) '''
+    if os.path.isdir(filename):
+        return product_store.open_store(filename)
+    return read_product_json(filename)
+
+def load_products_on(filename, date):
+    ''' Load products as they were on a date from the price history kept next to a JSON file or product store
+    (see price_history.py), e.g. load_products_on('Datasets/Coles/combined.store', '2021-03-01')
+    :param filename: the JSON filename or the store directory, its directory holds the history
+    :param date: anything price_history.to_timestamp() accepts, a date means the end of that day
+    :return: dictionary - key is product name, value is product JSON (another dictionary) '''
+    directory = os.path.dirname(os.path.normpath(filename))
+    return price_history.open_history(directory).snapshot(date)
+
+def find_matching_products(woolworths, coles, similarity_threshold = 0.5, print_to_console=True, blocking=None, workers=1,
+                           max_block_memory=matching.MAX_BLOCK_MEMORY, cache=None):
     ''' This function takes two dictionaries of Woolworths and Coles products, as returned by read_product_json(), and
     finds products with similar names using the similarity threshold.
 
@@ -480,153 +636,222 @@ def find_matching_products(woolworths, coles, similarity_threshold = 0.5, print_
 
     :param print_to_console: boolean, whether or not to print information to console as data is processed
 
-    :return: list of MatchedProduct objects '''
-
-    coles_names = list(coles.keys()) # list of names of all Coles products
-
-    matching_products = [] # list of MatchedProduct objects
-
-    # Iterate through all Woolworths products
-    for woolworths_product_name, woolworths_product_value in woolworths.items():
-
-        # Compute text similarity for the current Woolworths product and all Coles products
-        similarity_scores = text_similarity(woolworths_product_name, coles_names)
-
-        # Iterate through all Coles products
-        for i in range(len(coles_names)):
+    :param blocking: matching.Blocking settings, if provided only candidate pairs that share a blocking token (and
+                     optionally the same category and unit) are scored instead of every Woolworths x Coles pair
 
-            # Lookup similarity for current Woolworths product and ith Coles product
-            similarity = similarity_scores[i+1][0]
+    :param workers: the number of processes to score similarities with, Woolworths products are split into blocks
+                    that are scored in parallel, the results are the same as with a single process
 
-            # If similarity > threshold, the products are similar enough to compare prices
-            if similarity > similarity_threshold:
+    :param max_block_memory: cap in bytes on the memory each worker uses for its block of the similarity matrix
 
-                # When Coles products are on special they don't include the normal price
-                # So if a Coles product is on special we don't won't to include it in the comparison
-                coles_not_on_special = coles[coles_names[i]]['special'] != 'True'
-                if coles_not_on_special:
+    :param cache: match_cache.MatchCache, if provided matches found by previous runs are reused and only products that
+                  were added since are scored
 
-                    # Get unit price for matched Coles product
-                    coles_unit_price = convert_unit_price(coles[coles_names[i]]['price'])
-                    if coles_unit_price is None: break
-                    coles_price = coles_unit_price[0]
-                    coles_quantity = coles_unit_price[1]
-                    coles_unit = coles_unit_price[2]
-                    coles_unit_price = None
-
-                    # Print to console
-                    if print_to_console:
-                        print('Similarity: ' + str(similarity))
-                        print('Coles product: ' + coles_names[i])
-                        print('Woolworths product: ' + woolworths_product_name)
-                        print('Coles price: $' + str(coles_price) + ' per ' + str(coles_quantity) + ' ' + coles_unit)
-
-                    # We can only compare products if we have their unit price
-                    if 'unitPrice' in woolworths_product_value:
-
-                        # Get unit price for matched Woolworths product
-                        woolworths_price, woolworths_quantity, woolworths_unit = convert_unit_price(woolworths_product_value['unitPrice'])
-
-                        if print_to_console:
-                            print('Woolworths price: $' + str(woolworths_price) + ' per ' + str(woolworths_quantity) + ' ' + woolworths_unit)
-
-
-                        woolworths_unit_price = None
-                        coles_unit_price = None
-
-                        # if products are of the same unit e.g. 'kg', 'g', 'ea'
-                        if woolworths_unit == coles_unit:
-
-                            # if the products also have the same quantity e.g. 1 kilogram, 10 grams, etc
-                            # then we can directly compare prices
-                            if woolworths_quantity == coles_quantity:
-
-                                woolworths_unit_price = UnitPrice(woolworths_price, woolworths_unit, woolworths_quantity)
-                                coles_unit_price = UnitPrice(coles_price, coles_unit, coles_quantity)
-
-                                if print_to_console:
-                                    print('Difference: ' + str(woolworths_price - coles_price))
+    :return: list of MatchedProduct objects '''
 
-                            else: # products have same unit but different quantities
+    woolworths_names = list(woolworths.keys()) # list of names of all Woolworths products
+    coles_names = list(coles.keys()) # list of names of all Coles products
 
-                                # This code uses some simple math to convert the price and quantites so the products
-                                # can be compared. This only works if one quantity is perfectly divisible by the other.
-                                # i.e. the quantities are multiples.
+    # Normalize the unit price of every product to a price per kg, litre or each once up front
+    with instrumentation.span('process.unit_prices'):
+        woolworths_strings = unit_price_strings(woolworths, 'unitPrice')
+        coles_strings = unit_price_strings(coles, 'price')
+        woolworths_unit_prices, woolworths_base_units = unit_prices.normalize_unit_prices(woolworths_strings)
+        coles_unit_prices, coles_base_units = unit_prices.normalize_unit_prices(coles_strings)
 
-                                woolworths_div_coles = woolworths_quantity // coles_quantity
-                                coles_div_woolworths = coles_quantity // woolworths_quantity
-                                if woolworths_div_coles > 0: # Woolworths quantity is larger than Coles quantity
-                                    if woolworths_quantity % coles_quantity == 0:
-                                        # the woolworths quantity is perfectly divisible by the coles quantity
-                                        coles_quantity *= woolworths_div_coles
-                                        coles_price    *= woolworths_div_coles
+    # Unit prices that were displayed but couldn't be used
+    if instrumentation.enabled:
+        for strings, base_units in ((woolworths_strings, woolworths_base_units), (coles_strings, coles_base_units)):
+            instrumentation.count('unit_price_parse_failures', sum(1 for string, unit in zip(strings, base_units.tolist())
+                                                                   if string and unit == unit_prices.BASE_UNKNOWN))
 
-                                        woolworths_unit_price = UnitPrice(woolworths_price, woolworths_unit, woolworths_quantity)
-                                        coles_unit_price = UnitPrice(coles_price, coles_unit, coles_quantity)
+    # When Coles products are on special they don't include the normal price
+    # So if a Coles product is on special we don't won't to include it in the comparison
+    coles_on_special = special_flags(coles)
 
-                                        if print_to_console:
-                                            print('Difference: ' + str(woolworths_price - coles_price))
+    # The category of every product, kept with matched products for the breakdown by category
+    woolworths_categories = product_categories(woolworths)
+    coles_categories = product_categories(coles)
 
-                                # This elif block is exactly the same as the above if block, but vice versa for Coles/Woolworths
-                                elif coles_div_woolworths > 0:
-                                    if coles_quantity % woolworths_quantity == 0:
-                                        woolworths_quantity *= coles_div_woolworths
-                                        woolworths_price    *= coles_div_woolworths
-                                        woolworths_unit_price = UnitPrice(woolworths_price, woolworths_unit, woolworths_quantity)
-                                        coles_unit_price = UnitPrice(coles_price, coles_unit, coles_quantity)
-                                        if print_to_console:
-                                            print('Difference: ' + str(woolworths_price - coles_price))
+    matching_products = [] # list of MatchedProduct objects
 
-                    # If the Woolworths and Coles unit prices are set we were able to convert to the same unit and quantity
-                    # meaning we can compare the prices, so we add the products to the list of matched products
-                    if woolworths_unit_price and coles_unit_price:
-                        # Create Product objects for Woolies and Coles product
-                        woolworths_product = Product(woolworths_product_name, 'Woolworths', woolworths_unit_price)
-                        coles_product = Product(coles_names[i], 'Coles', coles_unit_price)
-                        # Create MatchedProduct object and add it to list of matched products
-                        matched_product = MatchedProduct(woolworths_product, coles_product, similarity)
-                        matching_products.append(matched_product)
-
-                    # Print separator between each product
-                    if print_to_console:
-                        print('\n===========================================\n')
+    # Compute text similarity for all Woolworths and Coles products, keeping only pairs above the threshold
+    # The pairs arrive in blocks sorted by Woolworths product and then by Coles product
+    if cache is not None:
+        pair_blocks = [cache.similar_pairs(woolworths_names, coles_names, similarity_threshold, workers, max_block_memory)]
+        if print_to_console:
+            print(cache)
+            print('\n===========================================\n')
+    elif blocking is None:
+        pair_blocks = matching.iter_similar_names(woolworths_names, coles_names, similarity_threshold, workers, max_block_memory)
+    else:
+        woolworths_blocks = []
+        coles_blocks = []
+
+        # The stores use different category names so Coles categories are mapped to Woolworths categories
+        if blocking.category_map is not None:
+            woolworths_blocks.append(woolworths_categories)
+            coles_blocks.append([blocking.category_map.get(category) for category in coles_categories])
+
+        # Products can only be compared if their unit prices have the same base unit
+        if blocking.on_unit:
+            unknown = unit_prices.BASE_UNKNOWN
+            woolworths_blocks.append([None if unit == unknown else unit for unit in woolworths_base_units.tolist()])
+            coles_blocks.append([None if unit == unknown else unit for unit in coles_base_units.tolist()])
+
+        rows, columns, scores, report = matching.blocked_pairs(woolworths_names, coles_names, similarity_threshold,
+                                                               blocking, woolworths_blocks, coles_blocks)
+        pair_blocks = [(rows, columns, scores)]
+        if print_to_console:
+            print(report)
+            print('\n===========================================\n')
+
+    # Process each block of similar pairs as it is scored
+    for rows, columns, scores in pair_blocks:
+
+        # We can only compare products if we have both unit prices in the same base unit (e.g. both per kg)
+        # and the Coles product isn't on special
+        comparable = (woolworths_base_units[rows] != unit_prices.BASE_UNKNOWN) & \
+                     (woolworths_base_units[rows] == coles_base_units[columns]) & ~coles_on_special[columns]
+        rows, columns, scores = rows[comparable], columns[comparable], scores[comparable]
+
+        # Price difference of every comparable pair, Woolworths price minus Coles price
+        woolworths_matched_prices = woolworths_unit_prices[rows]
+        coles_matched_prices = coles_unit_prices[columns]
+        differences = woolworths_matched_prices - coles_matched_prices
+        units = woolworths_base_units[rows]
+
+        for row, i, similarity, woolworths_price, coles_price, difference, unit in zip(rows.tolist(), columns.tolist(),
+                scores.tolist(), woolworths_matched_prices.tolist(), coles_matched_prices.tolist(), differences.tolist(), units.tolist()):
+
+            unit = unit_prices.BASE_UNIT_NAMES[unit]
+
+            # Print to console
+            if print_to_console:
+                print('Similarity: ' + str(similarity))
+                print('Coles product: ' + coles_names[i])
+                print('Woolworths product: ' + woolworths_names[row])
+                print('Coles price: $' + str(coles_price) + ' per ' + unit)
+                print('Woolworths price: $' + str(woolworths_price) + ' per ' + unit)
+                print('Difference: ' + str(difference))
+                print('\n===========================================\n')
+
+            # Create Product objects for Woolies and Coles product
+            woolworths_product = Product(woolworths_names[row], 'Woolworths', UnitPrice(woolworths_price, unit, 1),
+                                         woolworths_categories[row])
+            coles_product = Product(coles_names[i], 'Coles', UnitPrice(coles_price, unit, 1), coles_categories[i])
+            # Create MatchedProduct object and add it to list of matched products
+            matched_product = MatchedProduct(woolworths_product, coles_product, similarity)
+            matching_products.append(matched_product)
 
     return matching_products
 
-def compare_products(woolworths_filename, coles_filename, similarity_threshold=0.5):
-    ''' Read in data for all Woolworths and Coles products contained in JSON files provided as parameters
-    Call functions to find matching Coles and Woolworths products, analyse data and visualise results
-    :param woolworths_filename: the name of the JSON file containing Woolworths products
-    :param coles_filename: the name of the JSON file containing Coles products
-    :param similarity_threshold: the similarity threshold to use when finding products with similar names '''
-
-    # Read product data from JSON files into dictionaries
-    woolworths = read_product_json(woolworths_filename)
-    coles = read_product_json(coles_filename)
+def all_prices(woolworths, coles):
+    ''' Get the prices of all Woolworths products and all Coles products, not just matching products
+    (products on special don't always show their normal price)
+    :param woolworths: dictionary (or product store) of Woolworths products as returned by load_products()
+    :param coles: dictionary (or product store) of Coles products as returned by load_products()
+    :return: tuple (list of Woolworths prices, list of Coles prices) '''
+    if isinstance(woolworths, product_store.ProductStore):
+        all_woolworths_prices = woolworths.price[~np.isnan(woolworths.price)].tolist()
+    else:
+        all_woolworths_prices = [product['price'] for product in woolworths.values() if 'price' in product]
+    coles_prices, _, _, coles_failed = unit_prices.parse_unit_prices(unit_price_strings(coles, 'price'))
+    all_coles_prices = coles_prices[~coles_failed].tolist()
+    return all_woolworths_prices, all_coles_prices
+
+def price_statistics(matching_products, all_woolworths_prices, all_coles_prices, num_resamples=1000):
+    ''' The statistics analysis_and_visualisation() and paired_data_test() show, without plotting or printing anything,
+    with a bootstrap confidence interval of the mean price difference and a breakdown by category (see stats_engine.py)
+    :param num_resamples: the number of bootstrap resamples, 0 for no confidence interval
+    :return: dictionary - the mean, median and standard deviation of the prices of each store, and the paired t-test of
+             the price differences of matched products under 'differences' if there are at least two, with the
+             statistics of each Woolworths category under 'categories' '''
+    results = {}
+    for store, prices in (('woolworths', all_woolworths_prices), ('coles', all_coles_prices)):
+        summary = stats_engine.summary(prices)
+        results[store] = {'n': summary['n'], 'mean': summary['mean'], 'median': summary['median'], 'pstdev': summary['pstdev']}
+
+    woolworths_matched_prices = np.fromiter((matched_product.woolworths_product.unit_price.price
+                                             for matched_product in matching_products), dtype=np.float64)
+    coles_matched_prices = np.fromiter((matched_product.coles_product.unit_price.price
+                                        for matched_product in matching_products), dtype=np.float64)
+    differences = woolworths_matched_prices - coles_matched_prices
+    if len(differences) > 1:
+        results['differences'] = stats_engine.summary(differences, num_resamples)
+        categories = [matched_product.woolworths_product.category for matched_product in matching_products]
+        results['differences']['categories'] = stats_engine.grouped_stats(differences, categories)
+    return results
+
+def match_products(woolworths_filename, coles_filename, similarity_threshold=0.5, cache=None, date=None,
+                   print_to_console=True):
+    ''' Read in data for all Woolworths and Coles products contained in JSON files (or product stores) provided as
+    parameters and find matching Coles and Woolworths products, see compare_products()
+    :return: tuple (list of MatchedProduct objects, list of all Woolworths prices, list of all Coles prices) '''
+
+    # Read product data from JSON files or product stores into dictionaries
+    with instrumentation.span('process.load'):
+        if date is None:
+            woolworths = load_products(woolworths_filename)
+            coles = load_products(coles_filename)
+        else:
+            woolworths = load_products_on(woolworths_filename, date)
+            coles = load_products_on(coles_filename, date)
 
-    # Get the prices of all Woolworths products and all Coles products, not just matching products, only used for visualisation
-    all_woolworths_prices = [product['price'] for product in woolworths.values()]
-    all_coles_prices = [convert_unit_price(product['price'])[0] for product in coles.values() if convert_unit_price(product['price'])]
+    # Get the prices of all Woolworths products and all Coles products, only used for visualisation
+    all_woolworths_prices, all_coles_prices = all_prices(woolworths, coles)
 
     # Find matching products using similarity threshold
-    matching_products = find_matching_products(woolworths, coles, similarity_threshold)
+    with instrumentation.span('process.matching'):
+        matching_products = find_matching_products(woolworths, coles, similarity_threshold, print_to_console, cache=cache)
+    instrumentation.count('matches', len(matching_products))
+    return matching_products, all_woolworths_prices, all_coles_prices
+
+def compare_products(woolworths_filename, coles_filename, similarity_threshold=0.5, cache=None, date=None,
+                     output_directory=None):
+    ''' Read in data for all Woolworths and Coles products contained in JSON files (or product stores) provided as parameters
+    Call functions to find matching Coles and Woolworths products, analyse data and visualise results
+    :param woolworths_filename: the name of the JSON file or product store directory containing Woolworths products
+    :param coles_filename: the name of the JSON file or product store directory containing Coles products
+    :param similarity_threshold: the similarity threshold to use when finding products with similar names
+    :param cache: optional match_cache.MatchCache to reuse matches from previous runs
+    :param date: compare products as they were on this date (from the price history), None for the latest crawl
+    :param output_directory: render the visualisations to files in this directory instead of displaying them '''
+
+    matching_products, all_woolworths_prices, all_coles_prices = match_products(woolworths_filename, coles_filename,
+                                                                                similarity_threshold, cache, date)
 
     # Create visualisaations and perform statistical tests
-    analysis_and_visualisation(matching_products, all_woolworths_prices, all_coles_prices)
+    # (the span includes the time plot windows are left open)
+    with instrumentation.span('process.analysis'):
+        analysis_and_visualisation(matching_products, all_woolworths_prices, all_coles_prices, output_directory)
 
-def compare_all_products(similarity_threshold=0.5):
+def compare_all_products(similarity_threshold=0.5, cache_filename='Datasets/match_cache.pickle', date=None,
+                         output_directory=None):
     ''' Compare prices of Woolworths and Coles using all JSON files in 'Datasets/Woolworths' and 'Datasets/Coles'
     :param similarity_threshold: float between 0 and 1 given to scikit-learn TfidfVectorizer, a higher threshold means
-    a Coles and Woolworths product names must be more similar in order to be considered similar products and to compare prices '''
+    a Coles and Woolworths product names must be more similar in order to be considered similar products and to compare prices
+    :param cache_filename: the file matches are cached in between runs, None to rematch everything from scratch
+    :param date: compare products as they were on this date, e.g. '2021-03-01', None for the latest crawl. The match
+                 cache follows the latest crawl, so it isn't used for other dates.
+    :param output_directory: render the visualisations to files in this directory instead of displaying them '''
 
     # Combine all JSON files
     combine_woolworths()
     combine_coles()
-    woolworths_filename = 'Datasets/Woolworths/combined.json'
-    coles_filename = 'Datasets/Coles/combined.json'
+    woolworths_filename = 'Datasets/Woolworths/' + product_store.STORE_DIRNAME
+    coles_filename = 'Datasets/Coles/' + product_store.STORE_DIRNAME
 
     # Run code to find similar products, analyse data and produce visualisations
-    compare_products(woolworths_filename, coles_filename, similarity_threshold)
+    cache = match_cache.MatchCache(cache_filename) if cache_filename and date is None else None
+    compare_products(woolworths_filename, coles_filename, similarity_threshold, cache, date, output_directory)
 
 if __name__ == '__main__':
-    compare_all_products()
+    import argparse
+    parser = argparse.ArgumentParser(description='Compare Woolworths and Coles prices')
+    parser.add_argument('--report', metavar='DIRECTORY', help='render the visualisations to files instead of showing them')
+    args = parser.parse_args()
+    compare_all_products(output_directory=args.report)
+
+    # Timing and counts of the run, if instrumentation is enabled (see instrumentation.py)
+    instrumentation.export('process')
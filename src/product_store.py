@@ -0,0 +1,276 @@
+'''
+
+    A columnar, memory-mapped store of the products of one retailer.
+
+    read_product_json() loads a whole JSON file into a list of dictionaries and then builds a second dictionary keyed
+    by product name, even though the analysis only ever needs a handful of fields. A product store keeps just those
+    fields, one file per column, in a directory such as 'Datasets/Woolworths/combined.store':
+
+    - price.npy, special_price.npy  float64 shelf price and special price in dollars (Woolworths only), NaN if missing
+    - on_special.npy                bool, whether the product is on special
+    - category.npy                  int32 index into the 'categories' list in meta.json, -1 if missing
+    - names.heap, names.offsets.npy the product names as one UTF-8 string heap, name i is heap[offsets[i]:offsets[i+1]]
+    - unit_prices.heap, unit_prices.offsets.npy
+                                    the unit price strings ('unitPrice' for Woolworths, 'price' for Coles) the same way
+    - name_hash.npy                 uint64 hash of each product name, see name_hashes()
+    - source.npy                    int32 index into the 'sources' list in meta.json, the category file the product
+                                    was last seen in, -1 if not known
+    - meta.json                     the store name, number of products, category names and source files
+
+    Every column is opened with mmap, so opening a store is near instant and only the pages that are actually read are
+    loaded into memory.
+
+    merge.py writes one small store per category file (a part) when the file is parsed, and combine_stores() joins the
+    parts into the store of the whole retailer with Numpy, without parsing any JSON, so a category file that hasn't
+    changed is never read again.
+
+'''
+
+import json, os, hashlib
+from collections.abc import Mapping
+import numpy as np
+
+STORE_DIRNAME = 'combined.store'
+
+def write_heap(filename, strings):
+    ''' Write a list of strings as a UTF-8 string heap plus an offsets column
+    :param filename: the heap filename, the offsets are written to the same name with '.offsets.npy' in place of '.heap'
+    :param strings: list of strings, None is written as an empty string '''
+    encoded = [(string or '').encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    f = open(filename, 'wb')
+    f.write(b''.join(encoded))
+    f.close()
+    np.save(filename.replace('.heap', '.offsets.npy'), offsets)
+
+def name_hashes(names):
+    ''' 64-bit hashes of product names, so duplicate names in different stores can be found without decoding them
+    :param names: list of product names
+    :return: uint64 Numpy array '''
+    return np.array([int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'little')
+                     for name in names], dtype=np.uint64)
+
+def write_meta(directory, meta):
+    ''' Write the meta.json of a store, last, so a store is only ever opened once all of its columns exist '''
+    f = open(os.path.join(directory, 'meta.json'), 'w')
+    json.dump(meta, f, indent=4, sort_keys=True)
+    f.close()
+
+def write_store(directory, products, store, source=None):
+    ''' Write products to a columnar product store
+    :param directory: the store directory, created if it doesn't exist
+    :param products: list of product dictionaries as scraped, later duplicates of a name replace earlier ones the same
+                     way read_product_json() does, products without a name are skipped
+    :param store: either 'Woolworths' or 'Coles'
+    :param source: the category file the products were read from, if they all come from one '''
+    assert(store == 'Woolworths' or store == 'Coles')
+
+    # Keep one product per name, in the order names are first seen
+    unique = {}
+    for product in products:
+        if 'name' in product:
+            unique[product['name']] = product
+    products = list(unique.values())
+
+    categories = sorted(set(product['category'] for product in products if product.get('category')))
+    category_codes = {category: code for code, category in enumerate(categories)}
+
+    def number(value):
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+
+    if store == 'Woolworths':
+        price = [number(product.get('price')) for product in products]
+        special_price = [number(product.get('special')) for product in products]
+        on_special = [product.get('special') is not None for product in products]
+        unit_prices = [product.get('unitPrice') for product in products]
+    else:
+        price = [np.nan] * len(products)
+        special_price = [np.nan] * len(products)
+        on_special = [product.get('special') == 'True' for product in products]
+        unit_prices = [product.get('price') for product in products]
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'price.npy'), np.array(price, dtype=np.float64))
+    np.save(os.path.join(directory, 'special_price.npy'), np.array(special_price, dtype=np.float64))
+    np.save(os.path.join(directory, 'on_special.npy'), np.array(on_special, dtype=np.bool_))
+    np.save(os.path.join(directory, 'category.npy'),
+            np.array([category_codes.get(product.get('category'), -1) for product in products], dtype=np.int32))
+    names = [product['name'] for product in products]
+    write_heap(os.path.join(directory, 'names.heap'), names)
+    write_heap(os.path.join(directory, 'unit_prices.heap'), unit_prices)
+    np.save(os.path.join(directory, 'name_hash.npy'), name_hashes(names))
+    np.save(os.path.join(directory, 'source.npy'), np.full(len(products), 0 if source else -1, dtype=np.int32))
+    write_meta(directory, {'store': store, 'count': len(products), 'categories': categories,
+                           'sources': [source] if source else []})
+
+def gather_heap(filename, heaps, rows):
+    ''' Write the strings in some rows of several string heaps, one after the other, as a new string heap
+    :param filename: the heap filename, see write_heap()
+    :param heaps: list of StringHeap, their rows are numbered one after the other
+    :param rows: Numpy array of the rows to write, in order '''
+    data = np.concatenate([np.asarray(heap.heap) for heap in heaps] + [np.zeros(0, np.uint8)])
+    bases = np.cumsum([0] + [len(heap.heap) for heap in heaps[:-1]])
+    offsets = np.concatenate([np.asarray(heap.offsets[:-1]) + base for heap, base in zip(heaps, bases)] +
+                             [np.zeros(0, np.int64)])
+    ends = np.concatenate([np.asarray(heap.offsets[1:]) + base for heap, base in zip(heaps, bases)] +
+                          [np.zeros(0, np.int64)])
+    starts, lengths = offsets[rows], ends[rows] - offsets[rows]
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(lengths)
+    # Index of every byte to copy: each string's start, counting up along its length
+    index = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    f = open(filename, 'wb')
+    f.write(data[index].tobytes())
+    f.close()
+    np.save(filename.replace('.heap', '.offsets.npy'), new_offsets)
+
+def combine_stores(directory, stores, store):
+    ''' Write the products of several stores, one after the other, as one store. It holds the same products in the same
+    order as write_store() of all their products would: one per name, where the name is first seen, with its last value.
+    :param directory: the store directory, created if it doesn't exist
+    :param stores: list of ProductStore, each with one product per name, e.g. one per category file
+    :param store: either 'Woolworths' or 'Coles' '''
+    assert(store == 'Woolworths' or store == 'Coles')
+    def column(name, dtype):
+        return np.concatenate([np.asarray(getattr(part, name)) for part in stores] + [np.zeros(0, dtype)])
+
+    hashes = column('name_hash', np.uint64)
+    # The first row of each name is where it goes, the last row is its value
+    _, first = np.unique(hashes, return_index=True)
+    _, last = np.unique(hashes[::-1], return_index=True)
+    last = len(hashes) - 1 - last
+    rows = last[np.argsort(first)]
+
+    # Category and source codes are numbered per store, renumber them into one list
+    all_categories = sorted(set(category for part in stores for category in part.categories))
+    category = np.concatenate([np.array([all_categories.index(c) for c in part.categories] + [-1], dtype=np.int32)[part.category]
+                               for part in stores] + [np.zeros(0, np.int32)])[rows]
+    used = np.unique(category[category >= 0])
+    codes = np.full(len(all_categories) + 1, -1, dtype=np.int32)
+    codes[used] = np.arange(len(used))
+    category = codes[category]
+    sources = [source for part in stores for source in part.sources]
+    bases = np.cumsum([0] + [len(part.sources) for part in stores[:-1]])
+    source = np.concatenate([np.where(part.source >= 0, part.source + base, -1) for part, base in zip(stores, bases)] +
+                            [np.zeros(0, np.int32)])[rows]
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'price.npy'), column('price', np.float64)[rows])
+    np.save(os.path.join(directory, 'special_price.npy'), column('special_price', np.float64)[rows])
+    np.save(os.path.join(directory, 'on_special.npy'), column('on_special', np.bool_)[rows])
+    np.save(os.path.join(directory, 'category.npy'), category.astype(np.int32))
+    gather_heap(os.path.join(directory, 'names.heap'), [part.names for part in stores], rows)
+    gather_heap(os.path.join(directory, 'unit_prices.heap'), [part.unit_prices for part in stores], rows)
+    np.save(os.path.join(directory, 'name_hash.npy'), hashes[rows])
+    np.save(os.path.join(directory, 'source.npy'), source.astype(np.int32))
+    write_meta(directory, {'store': store, 'count': len(rows), 'categories': [all_categories[code] for code in used],
+                           'sources': sources})
+
+class StringHeap:
+    ''' A memory-mapped UTF-8 string heap with an offsets column, see write_heap() '''
+    def __init__(self, filename):
+        offsets_filename = filename.replace('.heap', '.offsets.npy')
+        self.offsets = np.load(offsets_filename, mmap_mode='r')
+        # np.memmap can't map an empty file
+        self.heap = np.memmap(filename, dtype=np.uint8, mode='r') if os.path.getsize(filename) > 0 else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.heap[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def to_list(self):
+        ''' Decode every string, much faster than indexing one string at a time '''
+        data = self.heap.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+class ProductStore(Mapping):
+    ''' A memory-mapped product store, see the module docstring.
+
+    It can be used in place of the dictionary returned by read_product_json() - it maps product names to product
+    dictionaries with the same fields the scrapers write (only name, price, unitPrice/price, special and category).
+    The columns themselves are available as Numpy arrays: price, special_price, on_special and category. '''
+    def __init__(self, directory):
+        ''' :param directory: the store directory written by write_store() '''
+        f = open(os.path.join(directory, 'meta.json'), 'r')
+        meta = json.load(f)
+        f.close()
+        self.directory = directory
+        self.store = meta['store']
+        self.categories = meta['categories']
+        self.sources = meta.get('sources', [])
+        self.meta = meta
+        self.price = np.load(os.path.join(directory, 'price.npy'), mmap_mode='r')
+        self.special_price = np.load(os.path.join(directory, 'special_price.npy'), mmap_mode='r')
+        self.on_special = np.load(os.path.join(directory, 'on_special.npy'), mmap_mode='r')
+        self.category = np.load(os.path.join(directory, 'category.npy'), mmap_mode='r')
+        self.names = StringHeap(os.path.join(directory, 'names.heap'))
+        self.unit_prices = StringHeap(os.path.join(directory, 'unit_prices.heap'))
+        # Stores written before name hashes and sources were kept don't have these columns
+        self.name_hash = self.optional_column('name_hash.npy')
+        self.source = self.optional_column('source.npy')
+        self.index = None # name -> row, only built if products are looked up by name
+
+    def optional_column(self, filename):
+        ''' A column that older stores may not have, or None '''
+        filename = os.path.join(self.directory, filename)
+        return np.load(filename, mmap_mode='r') if os.path.exists(filename) else None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names.to_list())
+
+    def __getitem__(self, name):
+        if self.index is None:
+            self.index = {name: row for row, name in enumerate(self.names.to_list())}
+        return self.record(self.index[name])
+
+    def keys(self):
+        ''' Names of all products, in store order '''
+        return self.names.to_list()
+
+    def values(self):
+        ''' Product dictionaries of all products, in store order, generated one at a time '''
+        return (self.record(row) for row in range(len(self)))
+
+    def items(self):
+        ''' (name, product dictionary) of all products, in store order, generated one at a time '''
+        return ((self.names[row], self.record(row)) for row in range(len(self)))
+
+    def category_name(self, row):
+        ''' The category name of the product in a row, or None '''
+        code = int(self.category[row])
+        return self.categories[code] if code >= 0 else None
+
+    def record(self, row):
+        ''' Rebuild the product dictionary of one row with the same fields and formats the scrapers write
+        :param row: the row of the product
+        :return: dictionary '''
+        product = {'name': self.names[row]}
+        category = self.category_name(row)
+        if category is not None:
+            product['category'] = category
+        unit_price = self.unit_prices[row]
+        if self.store == 'Woolworths':
+            if not np.isnan(self.price[row]):
+                product['price'] = float(self.price[row])
+            if not np.isnan(self.special_price[row]):
+                product['special'] = float(self.special_price[row])
+            if unit_price:
+                product['unitPrice'] = unit_price
+        else:
+            product['special'] = 'True' if self.on_special[row] else 'False'
+            if unit_price:
+                product['price'] = unit_price
+        return product
+
+def open_store(directory):
+    ''' Open a product store written by write_store()
+    :param directory: the store directory
+    :return: ProductStore '''
+    return ProductStore(directory)
@@ -0,0 +1,8 @@
+'''
+
+    Components shared by the Woolworths and Coles scrapers.
+
+    The scrapers add the 'src' directory to the module search path so they can import this package, e.g.
+    from scraping.rate_limiter import AdaptiveRateLimiter
+
+'''
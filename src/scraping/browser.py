@@ -0,0 +1,148 @@
+'''
+
+    Browser sessions that start lazily, block resources the scrapers don't need and restart themselves periodically.
+
+    Both scrapers used to start a visible Chrome with webdriver.Chrome() as soon as they were imported - even just to
+    call get_all_categories() - and then kept it for the whole crawl while it loaded every image, font, video and
+    tracker on every page and its memory use kept growing.
+
+    A BrowserSession can be used anywhere a Selenium webdriver is used (anything it doesn't define itself is passed on
+    to the webdriver), but:
+
+    - Chrome is only started the first time the session is actually used, headless by default
+    - requests whose URLs match BLOCKED_URL_PATTERNS (images, fonts, media and third-party analytics / advertising) are
+      blocked by Chrome itself through the DevTools protocol, so they never leave the browser
+    - the browser is restarted before loading a page once it has loaded max_pages pages, or once Chrome and its child
+      processes use more than max_rss_mb MB of memory (measured with psutil, if it is installed)
+
+    See benchmarks/browser_sessions.py for the pages per minute and memory use with and without blocking.
+
+'''
+
+from selenium import webdriver
+from scraping.scripts import SCRIPT_TIMEOUT
+
+try:
+    import psutil
+except ImportError: # memory use isn't measured without psutil, sessions are still recycled after max_pages
+    psutil = None
+
+# URL patterns blocked by Chrome (* matches anything)
+BLOCKED_URL_PATTERNS = [
+    # Images - the scrapers read image URLs from the page but never need the images themselves
+    '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.svg', '*.ico',
+    # Fonts
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    # Media
+    '*.mp4', '*.webm', '*.mp3', '*.m3u8',
+    # Third-party analytics, advertising and tracking
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*googlesyndication.com*',
+    '*facebook.net*', '*facebook.com/tr*', '*hotjar.com*', '*newrelic.com*', '*nr-data.net*', '*optimizely.com*',
+    '*adobedtm.com*', '*omtrdc.net*', '*demdex.net*', '*bing.com/bat*', '*criteo.com*', '*tiktok.com*',
+]
+
+class BrowserSession:
+    ''' A lazily started, recycled Chrome session that can be used in place of a webdriver, see the module docstring '''
+    def __init__(self, headless=True, block_resources=True, max_pages=200, max_rss_mb=1500,
+                 blocked_url_patterns=BLOCKED_URL_PATTERNS):
+        ''' :param headless: boolean - run Chrome without a window
+        :param block_resources: boolean - block requests matching blocked_url_patterns
+        :param max_pages: restart the browser after it has loaded this many pages
+        :param max_rss_mb: restart the browser once it uses more than this much memory, in MB
+        :param blocked_url_patterns: list of URL patterns to block '''
+        self.headless = headless
+        self.block_resources = block_resources
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.blocked_url_patterns = blocked_url_patterns
+        self.webdriver = None # started by the driver property
+        self.pages = 0 # pages loaded since the browser was started
+        self.total_pages = 0 # pages loaded by this session
+        self.restarts = 0 # number of times the browser was recycled
+        self.peak_rss_mb = 0.0 # the most memory the browser was seen to use
+
+    @property
+    def driver(self):
+        ''' The webdriver of this session, starting the browser if it isn't running '''
+        if self.webdriver is None:
+            self.webdriver = self.start()
+        return self.webdriver
+
+    def start(self):
+        ''' Start Chrome with the options of this session
+        :return: Selenium webdriver '''
+        options = webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument('--headless')
+        if self.block_resources:
+            # Don't even decode images that slip past the URL patterns (e.g. data URLs)
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+        driver = webdriver.Chrome(options=options)
+        driver.set_script_timeout(SCRIPT_TIMEOUT)
+        if self.block_resources:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_url_patterns})
+        self.pages = 0
+        return driver
+
+    def rss_mb(self):
+        ''' The memory used by Chrome and all of its processes, in MB
+        :return: float, or None if the browser isn't running or psutil isn't installed '''
+        if psutil is None or self.webdriver is None:
+            return None
+        try:
+            process = psutil.Process(self.webdriver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            rss = 0
+            for child in processes:
+                try:
+                    rss += child.memory_info().rss
+                except psutil.NoSuchProcess: # a renderer that exited in the meantime
+                    pass
+        except (psutil.NoSuchProcess, AttributeError):
+            return None
+        rss_mb = rss / 1024 / 1024
+        self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+        return rss_mb
+
+    def needs_recycling(self):
+        ''' Check whether the browser has loaded max_pages pages or uses more than max_rss_mb of memory '''
+        if self.webdriver is None:
+            return False
+        if self.pages >= self.max_pages:
+            return True
+        rss_mb = self.rss_mb()
+        return rss_mb is not None and rss_mb > self.max_rss_mb
+
+    def recycle(self):
+        ''' Quit the browser, the next use of the session starts a new one '''
+        if self.webdriver is not None:
+            self.quit()
+            self.restarts += 1
+
+    def get(self, url):
+        ''' Load a page, restarting the browser first if it is due to be recycled
+        :param url: the URL of the page '''
+        if self.needs_recycling():
+            self.recycle()
+        self.driver.get(url)
+        self.pages += 1
+        self.total_pages += 1
+
+    def quit(self):
+        ''' Quit the browser if it is running '''
+        if self.webdriver is not None:
+            try:
+                self.webdriver.quit()
+            finally:
+                self.webdriver = None
+
+    def __getattr__(self, name):
+        # Everything else (execute_script, find_element, page_source...) is passed on to the webdriver
+        if name == 'webdriver':
+            raise AttributeError(name)
+        return getattr(self.driver, name)
+
+    def __str__(self):
+        return ('Browser session: ' + str(self.total_pages) + ' pages, ' + str(self.restarts) + ' restarts, peak memory '
+                + str(round(self.peak_rss_mb)) + ' MB')
@@ -0,0 +1,98 @@
+'''
+
+    Delta recrawls - only re-extract pages whose product listing changed since the previous crawl.
+
+    Most pages of a category look exactly the same from one daily crawl to the next. In a delta crawl the scraper first
+    runs a tiny script that returns just the product names and price strings of the page it loaded, and hashes them into
+    a fingerprint. If the fingerprint is the same as the page had in the previous crawl, the products extracted by the
+    previous crawl are reused and the page isn't extracted again (nor is the nutrition info of its products fetched).
+
+    Once stop_after pages of a category (or a Coles subcategory) in a row are unchanged, the rest of it is assumed to be
+    unchanged too: its pages are taken from the previous crawl without even being loaded, as long as the previous crawl
+    has them. The scheduled Coles crawl scrapes pages out of order, so it fingerprints every page instead.
+
+    The fingerprint and products of every page are kept per URL in a URLCache ('pages.cache' next to the category
+    files), which is compacted at the end of each crawl. At the end of a complete crawl (every category, every page,
+    nothing failed) the pages it didn't visit are dropped too, so pages that are no longer listed don't pile up.
+
+'''
+
+import hashlib, json, threading
+from scraping.url_cache import URLCache
+
+class DeltaCrawl:
+    ''' Page fingerprints and products from the previous crawl, and counts of what this crawl did with its pages '''
+    def __init__(self, filename, stop_after=3):
+        ''' :param filename: the page cache file, e.g. '../Datasets/Coles/pages.cache'
+        :param stop_after: the number of unchanged pages in a row after which the rest of a category is reused '''
+        self.pages = URLCache(filename)
+        self.stop_after = stop_after
+        self.lock = threading.Lock()
+        self.processed = 0 # pages extracted because they changed or weren't in the previous crawl
+        self.skipped = 0 # pages loaded and fingerprinted, but unchanged
+        self.reused = 0 # pages not even loaded after a run of unchanged pages
+        self.dropped = 0 # pages of earlier crawls dropped by close() because this crawl didn't visit them
+        self.visited = set() # URLs of the pages this crawl visited
+
+    def fingerprint(self, listing):
+        ''' Hash the product listing of a page
+        :param listing: JSON returned by a fingerprint script, e.g. a list of [name, price] pairs
+        :return: hex digest string '''
+        return hashlib.sha1(json.dumps(listing, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    def visit(self, url):
+        ''' Mark a page as part of this crawl without fingerprinting it, e.g. a page taken from the crawl journal
+        :param url: the URL of the page '''
+        with self.lock:
+            self.visited.add(url)
+
+    def unchanged(self, url, fingerprint):
+        ''' Look up a page's products from the previous crawl if its fingerprint hasn't changed
+        :param url: the URL of the page
+        :param fingerprint: the fingerprint of the page as just loaded
+        :return: the page data stored by the previous crawl, or None if the page changed or is new '''
+        self.visit(url)
+        previous = self.pages.get(url)
+        if previous is None or previous['fingerprint'] != fingerprint:
+            return None
+        with self.lock:
+            self.skipped += 1
+        return previous['page']
+
+    def record(self, url, fingerprint, page):
+        ''' Store the fingerprint and data of a page that was extracted
+        :param url: the URL of the page
+        :param fingerprint: the fingerprint of the page
+        :param page: the page data, any JSON serializable value '''
+        self.pages.put(url, {'fingerprint': fingerprint, 'page': page})
+        with self.lock:
+            self.visited.add(url)
+            self.processed += 1
+
+    def reuse(self, url):
+        ''' The data of a page from the previous crawl, without loading the page
+        :param url: the URL of the page
+        :return: the page data, or None if the previous crawl didn't have the page '''
+        previous = self.pages.get(url)
+        if previous is None:
+            return None
+        with self.lock:
+            self.visited.add(url)
+            self.reused += 1
+        return previous['page']
+
+    def close(self, complete=False):
+        ''' Compact and close the page cache
+        :param complete: boolean - this crawl visited every page of every category, so the pages it didn't visit are no
+                         longer listed and are dropped. A crawl limited to some pages, or with pages that failed, keeps
+                         them for the next crawl. '''
+        if complete:
+            with self.lock:
+                visited = set(self.visited)
+            self.dropped = self.pages.retain(visited)
+        self.pages.compact()
+        self.pages.close()
+
+    def __str__(self):
+        return ('Delta crawl: ' + str(self.processed) + ' pages processed, ' + str(self.skipped) + ' unchanged pages skipped, '
+                + str(self.reused) + ' pages reused without loading, ' + str(self.dropped) + ' pages no longer listed dropped')
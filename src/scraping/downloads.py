@@ -0,0 +1,174 @@
+'''
+
+    A background pipeline that downloads product images (or any other asset) while the crawl carries on.
+
+    The Woolworths scraper used to download every image inline with a fresh requests.get() - a new connection for every
+    image - while the browser sat idle. A DownloadPipeline instead runs a small pool of worker threads sharing one pooled
+    requests.Session. The crawler submits URLs as each page is extracted and moves straight on to the next page.
+
+    Files are stored content-addressed: a file is named after the SHA-1 hash of its contents, e.g.
+    'images/3f/3f786850e387550fdab836ed7e6dc881de23001b.jpg', so an image used by several products is stored once. An
+    append-only index ('index.ndjson', one {"url": ..., "file": ...} per line) maps every URL already downloaded to its
+    file, so a URL seen in this run or any earlier run is never fetched again.
+
+    Products are saved before their images have finished downloading, so a product only records the URL of its image
+    (e.g. 'imgSrc' for Woolworths) and the file is found through the index: read_index(directory)[product['imgSrc']].
+
+'''
+
+import hashlib, json, os, queue, threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+INDEX_FILENAME = 'index.ndjson'
+
+# File extensions for content types whose URLs don't end with an extension
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+
+def read_index(directory):
+    ''' Read the index of every URL downloaded into a directory, skipping a line cut short by a crash
+    :param directory: the directory the files and the index are stored in
+    :return: dictionary - key is URL, value is the file relative to the directory, only files that still exist '''
+    index = {}
+    filename = os.path.join(directory, INDEX_FILENAME)
+    if not os.path.exists(filename):
+        return index
+    f = open(filename, 'r')
+    for line in f:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        # The file may have been deleted since
+        if os.path.exists(os.path.join(directory, record['file'])):
+            index[record['url']] = record['file']
+    f.close()
+    return index
+
+class DownloadPipeline:
+    ''' A bounded pool of download threads with a content-addressed file cache, see the module docstring '''
+    def __init__(self, directory, workers=4, rate_limiter=None, max_queued=1000, timeout=30):
+        ''' :param directory: the directory to store files and the index in, created if it doesn't exist
+        :param workers: the number of download threads
+        :param rate_limiter: optional AdaptiveRateLimiter every download goes through
+        :param max_queued: the most URLs waiting to be downloaded, submit() blocks while the queue is full
+        :param timeout: seconds to wait for a server before giving up on a download '''
+        self.directory = directory
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.downloaded = 0 # files fetched in this run
+        self.cached = 0 # URLs submitted that were already downloaded or queued
+        self.failed = [] # (url, exception) for every download that failed
+        self.bytes = 0 # bytes fetched in this run
+
+        os.makedirs(directory, exist_ok=True)
+        self.index = read_index(directory)
+        self.index_file = open(os.path.join(directory, INDEX_FILENAME), 'a')
+        self.submitted = set(self.index) # URLs downloaded before or queued in this run
+
+        # One session shared by all threads, with a connection pool big enough for all of them
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for i in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, url):
+        ''' Queue a URL to be downloaded, unless it was downloaded before or is already queued
+        Blocks while the queue is full, so a crawler can never get too far ahead of its downloads
+        :param url: the URL of the file '''
+        if not url:
+            return
+        with self.lock:
+            if url in self.submitted:
+                self.cached += 1
+                return
+            self.submitted.add(url)
+        self.queue.put(url)
+
+    def path(self, url):
+        ''' The file a URL was downloaded to
+        :param url: the URL of the file
+        :return: the path of the file, or None if it hasn't been downloaded (yet) '''
+        with self.lock:
+            file = self.index.get(url)
+        return os.path.join(self.directory, file) if file else None
+
+    def file_extension(self, url, content_type):
+        ''' The extension to store a file with, from its URL or else its content type '''
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if extension:
+            return extension
+        return CONTENT_TYPE_EXTENSIONS.get((content_type or '').split(';')[0].strip(), '')
+
+    def store(self, url, content, content_type):
+        ''' Store downloaded content under the hash of its contents and record it in the index
+        :return: the file relative to the directory '''
+        digest = hashlib.sha1(content).hexdigest()
+        file = os.path.join(digest[:2], digest + self.file_extension(url, content_type))
+        filename = os.path.join(self.directory, file)
+        # Identical content from another URL is already stored
+        if not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            temporary_filename = filename + '.' + str(threading.get_ident()) + '.tmp'
+            f = open(temporary_filename, 'wb')
+            f.write(content)
+            f.close()
+            os.replace(temporary_filename, filename)
+        with self.lock:
+            self.index[url] = file
+            self.index_file.write(json.dumps({'url': url, 'file': file}) + '\n')
+            self.index_file.flush()
+        return file
+
+    def fetch(self, url):
+        ''' Download one URL and store it '''
+        if self.rate_limiter:
+            with self.rate_limiter.request(url) as outcome:
+                response = self.session.get(url, timeout=self.timeout)
+                outcome.error = response.status_code == 429 or response.status_code >= 500
+        else:
+            response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        self.store(url, response.content, response.headers.get('Content-Type'))
+        with self.lock:
+            self.downloaded += 1
+            self.bytes += len(response.content)
+
+    def worker(self):
+        ''' Download URLs from the queue until close() puts None on it '''
+        while True:
+            url = self.queue.get()
+            if url is None:
+                return
+            try:
+                self.fetch(url)
+            except Exception as e:
+                with self.lock:
+                    self.failed.append((url, e))
+
+    def close(self):
+        ''' Wait for every queued download to finish, then stop the threads and close the session and index
+        :return: self, so the statistics can be printed '''
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.session.close()
+        self.index_file.close()
+        return self
+
+    def __str__(self):
+        return ('Downloaded ' + str(self.downloaded) + ' files (' + str(round(self.bytes / 1024 / 1024, 1)) + ' MB), '
+                + str(self.cached) + ' already downloaded, ' + str(len(self.failed)) + ' failed')
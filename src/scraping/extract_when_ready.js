@@ -0,0 +1,72 @@
+/*
+
+    This script is a template wrapped around an extraction script (e.g. scrape_products.js) by scripts.py and run with
+    Selenium's execute_async_script().
+
+    Instead of Python polling the page for an element and then injecting the extraction script in a second round trip,
+    this script waits inside the page:
+
+    - a MutationObserver watches the page until an element matching the 'ready' CSS selector appears
+    - it then keeps waiting until the page has stopped changing for 'settle' milliseconds, so a product list that is
+      still being rendered is not cut short
+    - the extraction script is run and its result handed back to Selenium in the same call
+
+    If the ready element never appears the extraction script is still run once 'timeout' milliseconds have passed, so
+    the ready selector should match something every page has (the product list) rather than something only some pages
+    have (a 'next page' link is missing on the last page of a category).
+
+    Arguments: ready selector, timeout in milliseconds, settle time in milliseconds, and Selenium's callback.
+
+    It calls back with an object:
+    {
+      ready  - whether the ready element appeared (boolean)
+      result - whatever the extraction script returned, usually a JSON encoded string
+      error  - the message of an exception thrown by the extraction script, if any (text)
+    }
+
+*/
+
+var selector = arguments[0];
+var timeout = arguments[1];
+var settle = arguments[2];
+var callback = arguments[arguments.length - 1];
+
+// The extraction script, wrapped in a function so its top level 'return' statement returns from the function
+function extract() {
+/* EXTRACTION SCRIPT */
+}
+
+var finished = false;
+var settleTimer = null;
+var timeoutTimer = null;
+var observer = null;
+
+function finish() {
+  if (finished) return;
+  finished = true;
+  if (observer) observer.disconnect();
+  clearTimeout(settleTimer);
+  clearTimeout(timeoutTimer);
+  var ready = document.querySelector(selector) != null;
+  try {
+    callback({ready: ready, result: extract()});
+  }
+  catch (e) {
+    callback({ready: ready, error: String(e)});
+  }
+}
+
+// Restart the settle timer every time the page changes, the page is done once it is quiet and the ready element exists
+function changed() {
+  clearTimeout(settleTimer);
+  settleTimer = setTimeout(function () {
+    if (document.querySelector(selector) != null) finish();
+  }, settle);
+}
+
+observer = new MutationObserver(changed);
+observer.observe(document.documentElement, {childList: true, subtree: true});
+timeoutTimer = setTimeout(finish, timeout);
+
+// Wait for one quiet period even if the page is already complete
+changed();
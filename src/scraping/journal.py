@@ -0,0 +1,96 @@
+'''
+
+    A crawl journal that makes long crawls resumable.
+
+    The scrapers used to keep a whole category in memory and only write it after its last page, so a browser crash
+    or an exception halfway through a crawl lost everything and the next run started again from the first category.
+
+    The journal is an append-only file with one JSON record per line. A scraper records every piece of work as soon as
+    it has done it - the list of categories, every page it scraped along with the products extracted from it, every
+    category it saved - and each record is flushed and fsynced before the crawl moves on. When a crawl is started again
+    with resume=True the journal is read back and the scraper skips every page it already has.
+
+    Records are (kind, key, value) triples, e.g. ('page', url, products) or ('category', 'fruit-veg', True). A
+    half-written last line left behind by a crash, or any other line that isn't a record, is ignored, and a resumed
+    crawl starts a new line after it before appending.
+
+'''
+
+import json, os, threading
+
+class CrawlJournal:
+    ''' An append-only, fsynced crawl journal, see the module docstring. It is safe to share between threads. '''
+    def __init__(self, filename, resume=False):
+        ''' :param filename: the journal file
+        :param resume: boolean - keep the work recorded by a previous crawl, otherwise the journal is started afresh '''
+        self.filename = filename
+        self.records = {}
+        self.lock = threading.Lock()
+        torn = False
+        if resume and os.path.exists(filename):
+            self.load()
+            # Never append to the end of a line cut short by a crash, the next record would be lost with it
+            if os.path.getsize(filename) > 0:
+                f = open(filename, 'rb')
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+                f.close()
+        self.file = open(filename, 'a' if resume else 'w')
+        if torn:
+            self.file.write('\n')
+            self.file.flush()
+
+    def load(self):
+        ''' Read back every complete record in the journal file '''
+        f = open(self.filename, 'r')
+        for line in f:
+            try:
+                record = json.loads(line)
+                self.records[(record['kind'], record['key'])] = record['value']
+            except (ValueError, TypeError, KeyError): # a line cut short by a crash, or not a record at all
+                continue
+        f.close()
+
+    def get(self, kind, key, default=None):
+        ''' Look up a record
+        :param kind: the kind of record, e.g. 'page'
+        :param key: the key of the record, e.g. the page URL
+        :param default: returned if there is no such record
+        :return: the recorded value '''
+        with self.lock:
+            return self.records.get((kind, key), default)
+
+    def done(self, kind, key):
+        ''' Check whether a record exists '''
+        with self.lock:
+            return (kind, key) in self.records
+
+    def record(self, kind, key, value=True):
+        ''' Append a record to the journal and make sure it is on disk before returning
+        :param kind: the kind of record, e.g. 'page'
+        :param key: the key of the record, e.g. the page URL
+        :param value: any JSON serializable value '''
+        line = json.dumps({'kind': kind, 'key': key, 'value': value}) + '\n'
+        with self.lock:
+            self.records[(kind, key)] = value
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def forget(self, kind, key):
+        ''' Drop the value of a record from memory once it has been used, e.g. the products of a page once they are
+        saved. The record stays in the file and done() is still true, get() returns None. '''
+        with self.lock:
+            if (kind, key) in self.records:
+                self.records[(kind, key)] = None
+
+    def finish(self):
+        ''' Close the journal and delete it, called once a crawl has completed so the next crawl starts afresh '''
+        with self.lock:
+            self.file.close()
+            os.remove(self.filename)
+
+    def close(self):
+        ''' Close the journal, keeping it so the crawl can be resumed '''
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,177 @@
+'''
+
+    An adaptive, per-host rate limiter that replaces the fixed random sleep after every request.
+
+    Each host gets a token bucket. Taking a token before a request blocks until the bucket has one, so requests to a
+    host never go faster than its current rate. The rate adapts to how the host is coping (additive increase,
+    multiplicative decrease, the same idea TCP uses):
+
+    - every request that succeeds with a latency under the target nudges the rate up by a fixed step
+    - every error or timeout, or a smoothed latency above the target, cuts the rate by a factor
+
+    so the crawler ramps up while the site responds quickly and backs off on its own when it slows down or starts
+    failing. The current rate and the number of requests waiting for a token (the queue depth) of every host can be read
+    at any time, e.g. to log them.
+
+'''
+
+import threading, time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import instrumentation
+
+class HostBucket:
+    ''' The token bucket and adaptive state of one host
+    - rate is the number of requests per second currently allowed
+    - tokens is the number of requests that can be made right now, at most burst
+    - latency is an exponentially weighted moving average of request latency in seconds, None until measured
+    - waiting is the number of requests currently waiting for a token
+    - requests, errors count every request recorded for this host '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.latency = None
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+
+    def refill(self, now):
+        ''' Add the tokens earned since the last refill '''
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class RequestOutcome:
+    ''' Yielded by AdaptiveRateLimiter.request(), set error to true if the request failed without raising '''
+    def __init__(self):
+        self.error = False
+
+class AdaptiveRateLimiter:
+    ''' An adaptive token bucket rate limiter with one bucket per host, see the module docstring.
+    It is safe to share one limiter between threads. '''
+    def __init__(self, initial_rate=0.33, min_rate=0.05, max_rate=4.0, burst=1, target_latency=3.0,
+                 increase=0.02, decrease=0.5, smoothing=0.2):
+        ''' :param initial_rate: requests per second a new host starts at, the default matches the old average sleep of 3s
+        :param min_rate: the slowest the limiter backs off to, in requests per second
+        :param max_rate: politeness cap, the fastest the limiter ramps up to, in requests per second
+        :param burst: the most requests that can be made back to back after an idle period
+        :param target_latency: smoothed latency in seconds above which the host is considered to be struggling
+        :param increase: requests per second added to the rate after each fast, successful request
+        :param decrease: factor the rate is multiplied by after an error, timeout or slow response
+        :param smoothing: weight of the newest latency in the moving average, between 0 and 1 '''
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.smoothing = smoothing
+        self.hosts = {}
+        self.condition = threading.Condition()
+
+    def bucket(self, url):
+        ''' The bucket of the host of a URL, created on first use. Must be called holding self.condition '''
+        host = urlparse(url).netloc or url
+        if host not in self.hosts:
+            self.hosts[host] = HostBucket(self.initial_rate, self.burst)
+        return self.hosts[host]
+
+    def acquire(self, url):
+        ''' Block until a request may be made to the host of url
+        :param url: the URL about to be requested '''
+        with instrumentation.span('rate_limiter.wait'), self.condition:
+            bucket = self.bucket(url)
+            bucket.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    bucket.refill(now)
+                    if bucket.tokens >= 1:
+                        bucket.tokens -= 1
+                        return
+                    # Sleep until the next token is due, or until the rate changes
+                    self.condition.wait((1 - bucket.tokens) / bucket.rate)
+            finally:
+                bucket.waiting -= 1
+
+    def reserve(self, url, n):
+        ''' Block until a request may be made to the host of url, then take the tokens of n requests at once for a
+        caller that paces the requests itself, e.g. a batch of downloads run inside the browser. The bucket goes into
+        debt, so later requests wait until the batch has been paid for at the current rate.
+        :param url: a URL of the host about to be requested
+        :param n: the number of requests
+        :return: the seconds to leave between the starts of the requests to keep to the current rate '''
+        with instrumentation.span('rate_limiter.wait'), self.condition:
+            bucket = self.bucket(url)
+            bucket.waiting += 1
+            try:
+                while True:
+                    bucket.refill(time.monotonic())
+                    if bucket.tokens >= 1:
+                        bucket.tokens -= n
+                        return 1 / bucket.rate
+                    self.condition.wait((1 - bucket.tokens) / bucket.rate)
+            finally:
+                bucket.waiting -= 1
+
+    def record(self, url, latency, error=False):
+        ''' Record the outcome of a request and adapt the rate of its host
+        :param url: the URL that was requested
+        :param latency: how long the request took in seconds
+        :param error: boolean - the request failed or timed out '''
+        with self.condition:
+            bucket = self.bucket(url)
+            bucket.requests += 1
+            if bucket.latency is None:
+                bucket.latency = latency
+            else:
+                bucket.latency = self.smoothing * latency + (1 - self.smoothing) * bucket.latency
+
+            if error:
+                bucket.errors += 1
+            bucket.refill(time.monotonic())
+            if error or bucket.latency > self.target_latency:
+                bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+            else:
+                bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+            self.condition.notify_all()
+
+    @contextmanager
+    def request(self, url):
+        ''' Wait for a token, then time the body of the with statement as a request to url and record its outcome.
+        An exception raised by the body is recorded as an error and re-raised. The body can also mark a request that
+        didn't raise as failed (e.g. an HTTP 429 or 503 response) by setting error on the yielded outcome.
+
+        with rate_limiter.request(url) as outcome:
+            response = session.get(url)
+            outcome.error = response.status_code >= 500
+        '''
+        self.acquire(url)
+        outcome = RequestOutcome()
+        start = time.monotonic()
+        try:
+            yield outcome
+        except BaseException:
+            self.record(url, time.monotonic() - start, error=True)
+            raise
+        self.record(url, time.monotonic() - start, outcome.error)
+
+    def rate(self, url):
+        ''' The current rate of the host of url in requests per second '''
+        with self.condition:
+            return self.bucket(url).rate
+
+    def queue_depth(self, url):
+        ''' The number of requests currently waiting for a token for the host of url '''
+        with self.condition:
+            return self.bucket(url).waiting
+
+    def stats(self):
+        ''' The state of every host
+        :return: dictionary - key is host, value is a dictionary with rate, queue_depth, latency, requests and errors '''
+        with self.condition:
+            return {host: {'rate': bucket.rate, 'queue_depth': bucket.waiting, 'latency': bucket.latency,
+                           'requests': bucket.requests, 'errors': bucket.errors}
+                    for host, bucket in self.hosts.items()}
@@ -0,0 +1,211 @@
+'''
+
+    Record the pages a crawl visits and replay them from a local HTTP server, so scrapers can be run and benchmarked
+    without touching the live sites (or without any network at all).
+
+    Recording: a scraper started with --record DIRECTORY saves the rendered HTML of every category, subcategory and
+    product page it extracts (driver.page_source, taken after the extraction script ran so dynamically loaded products
+    are in it). Before a page is saved:
+
+    - <script>, <link> and <base> elements are removed, so the replayed page is a static snapshot of the rendered DOM
+      that doesn't start the site's own Javascript or fetch anything from the site
+    - links to the site's own origin are made relative to the root ('https://www.woolworths.com.au/shop/browse/bakery'
+      becomes '/shop/browse/bakery'), so links followed by the scrapers (next page, subcategories) lead back to the
+      replay server
+
+    Pages are stored content-addressed like downloads.py stores images, e.g. 'pages/3f/3f78...1b.html', and 'index.cache'
+    (a URLCache) maps the path and query of every URL recorded to its page.
+
+    Replaying: a ReplayServer serves a recording on a local port, waiting latency seconds (plus or minus up to jitter
+    seconds, at random) before every response to stand in for the site's response time. URLs that weren't recorded get
+    a 404. Point a scraper at the server with its set_site_url() function or --site-url option, e.g.:
+
+    python scrape_woolworths.py --record ../Datasets/recordings/woolworths (from the 'src/Woolworths' folder)
+    python -m scraping.replay Datasets/recordings/woolworths --port 8000 --latency 0.5 --jitter 0.25 (from 'src')
+    python scrape_woolworths.py --site-url http://127.0.0.1:8000 (from the 'src/Woolworths' folder)
+
+    See benchmarks/scrapers.py to benchmark crawls and the extraction scripts against a recording.
+
+'''
+
+import hashlib, os, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from scraping.url_cache import URLCache
+
+INDEX_FILENAME = 'index.cache'
+
+# Elements removed from recorded pages, with their contents
+SCRIPT_PATTERN = re.compile(r'<script\b[^>]*>.*?</script\s*>', re.IGNORECASE | re.DOTALL)
+# Elements removed from recorded pages, they have no contents
+EMPTY_ELEMENT_PATTERN = re.compile(r'<(?:link|base)\b[^>]*>', re.IGNORECASE)
+
+def url_key(url):
+    ''' The key a URL is recorded under - its path and query, the same whichever host the page is served from '''
+    parts = urlsplit(url)
+    return (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+def clean_page(html, origin):
+    ''' Prepare the HTML of a rendered page for replaying, see the module docstring
+    :param html: the page source
+    :param origin: the origin of the site, e.g. 'https://www.woolworths.com.au'
+    :return: HTML string '''
+    html = SCRIPT_PATTERN.sub('', html)
+    html = EMPTY_ELEMENT_PATTERN.sub('', html)
+    # Absolute links to the site (http, https or protocol relative) become relative to the root
+    host = urlsplit(origin).netloc
+    return re.sub(r'(?:https?:)?//' + re.escape(host) + r'(?![\w.-])', '', html)
+
+class Recording:
+    ''' The pages of a recorded crawl, see the module docstring. It is safe to record from several threads. '''
+    def __init__(self, directory, origin=None):
+        ''' :param directory: the directory of the recording, created if it doesn't exist
+        :param origin: the origin of the site being recorded, only needed to record pages '''
+        self.directory = directory
+        self.origin = origin
+        os.makedirs(directory, exist_ok=True)
+        self.index = URLCache(os.path.join(directory, INDEX_FILENAME))
+
+    def save(self, url, html):
+        ''' Store the HTML of a page
+        :param url: the URL the page was loaded from
+        :param html: the HTML to replay for the URL '''
+        data = html.encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+        name = os.path.join('pages', digest[:2], digest + '.html')
+        filename = os.path.join(self.directory, name)
+        if not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # Write to a temporary file first so a page is never read half written
+            temporary_filename = filename + '.' + str(threading.get_ident()) + '.tmp'
+            f = open(temporary_filename, 'wb')
+            f.write(data)
+            f.close()
+            os.replace(temporary_filename, filename)
+        self.index.put(url_key(url), name)
+
+    def record(self, driver, url):
+        ''' Store the page the browser is on
+        :param driver: the browser, after the page was extracted
+        :param url: the URL the page was loaded from '''
+        self.save(url, clean_page(driver.page_source, self.origin))
+
+    def page(self, url):
+        ''' The recorded HTML of a URL
+        :param url: the URL, or just its path and query
+        :return: bytes, or None if the URL wasn't recorded '''
+        name = self.index.get(url_key(url))
+        if name is None:
+            return None
+        f = open(os.path.join(self.directory, name), 'rb')
+        data = f.read()
+        f.close()
+        return data
+
+    def urls(self):
+        ''' The path and query of every URL recorded '''
+        return self.index.urls()
+
+    def close(self):
+        ''' Compact and close the index '''
+        self.index.compact()
+        self.index.close()
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    ''' Serves the pages of the ReplayServer the HTTP server belongs to '''
+    protocol_version = 'HTTP/1.1' # keep connections open, like the live sites
+
+    def do_GET(self):
+        replay = self.server.replay
+        time.sleep(replay.delay())
+        data = replay.recording.page(self.path)
+        replay.count(data is not None)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # every request would be printed otherwise
+
+class ReplayServer:
+    ''' A local HTTP server replaying a Recording with simulated latency, see the module docstring '''
+    def __init__(self, directory, latency=0.0, jitter=0.0, host='127.0.0.1', port=0, seed=None):
+        ''' :param directory: the directory of the recording
+        :param latency: seconds to wait before every response
+        :param jitter: the most seconds the wait is randomly longer or shorter than latency
+        :param host: the address to listen on
+        :param port: the port to listen on, 0 for any free port
+        :param seed: random seed of the jitter, the same seed gives the same waits in the same order '''
+        self.recording = Recording(directory)
+        self.latency = latency
+        self.jitter = jitter
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.served = 0 # pages served
+        self.missing = 0 # requests for URLs that weren't recorded
+        self.server = None
+        self.thread = None
+        self.url = None # e.g. 'http://127.0.0.1:8000', once started
+
+    def delay(self):
+        ''' The number of seconds to wait before the next response '''
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def count(self, found):
+        with self.lock:
+            if found:
+                self.served += 1
+            else:
+                self.missing += 1
+
+    def start(self):
+        ''' Start serving in a background thread
+        :return: the URL of the server, e.g. 'http://127.0.0.1:8000' '''
+        self.server = ThreadingHTTPServer((self.host, self.port), ReplayHandler)
+        self.server.daemon_threads = True
+        self.server.replay = self
+        self.port = self.server.server_address[1]
+        self.url = 'http://' + self.host + ':' + str(self.port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def close(self):
+        ''' Stop serving '''
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __str__(self):
+        return 'Replay server: ' + str(self.served) + ' pages served, ' + str(self.missing) + ' not recorded'
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay a recorded crawl from a local HTTP server')
+    parser.add_argument('directory', help='the directory of the recording')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='the most seconds the wait randomly differs by')
+    args = parser.parse_args()
+
+    server = ReplayServer(args.directory, args.latency, args.jitter, args.host, args.port)
+    print('Replaying ' + str(len(server.recording.urls())) + ' pages at ' + server.start())
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    print(server)
@@ -0,0 +1,70 @@
+'''
+
+    Load the Javascript files injected by a scraper once, and run them in one round trip.
+
+    execute_script() used to open and read its .js file from disk every time it was called, once or more for every page.
+    A ScriptCache reads every .js file in a scraper's directory when the scraper starts and keeps the source in memory.
+
+    Extracting a page also used to take two round trips to the browser: a WebDriverWait polling loop until an element
+    appeared, then the injection of the extraction script. When the element never appears - there is no 'next page'
+    link on the last page of a Woolworths category - the poll always sat out its whole 10 second timeout.
+    execute_when_ready() instead wraps the extraction script in extract_when_ready.js and runs it with
+    execute_async_script(), so the page waits for itself with a MutationObserver and returns the data in the same call.
+
+'''
+
+import json, os
+import instrumentation
+from selenium.common.exceptions import JavascriptException
+
+# The template extraction scripts are wrapped in, see extract_when_ready.js
+WRAPPER_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract_when_ready.js')
+WRAPPER_MARKER = '/* EXTRACTION SCRIPT */'
+
+# Selenium's script timeout must be longer than any in-page wait, in seconds
+SCRIPT_TIMEOUT = 30
+
+class ScriptCache:
+    ''' The source of every Javascript file in a directory, read once '''
+    def __init__(self, directory):
+        ''' :param directory: the directory containing the .js files, e.g. the directory of the scraper '''
+        self.sources = {}
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.js'):
+                f = open(os.path.join(directory, filename), 'r')
+                self.sources[filename] = f.read()
+                f.close()
+
+        # Every extraction script wrapped in extract_when_ready.js, built once
+        f = open(WRAPPER_FILENAME, 'r')
+        wrapper = f.read()
+        f.close()
+        self.wrapped = {filename: wrapper.replace(WRAPPER_MARKER, source) for filename, source in self.sources.items()}
+
+    def execute(self, driver, filename, *args):
+        ''' Inject a script into the browser and return its JSON
+        :param driver: the browser to inject into
+        :param filename: the name of the script, e.g. 'scrape_products.js'
+        :param args: arguments passed to the script
+        :return: JSON data - can be either a list or dictionary '''
+        with instrumentation.span('script.execute'):
+            response = driver.execute_script(self.sources[filename], *args)
+        with instrumentation.span('script.json_loads'):
+            return json.loads(response)
+
+    def execute_when_ready(self, driver, filename, ready_selector, timeout=10, settle=0.25):
+        ''' Wait inside the page until it is ready, then inject a script and return its JSON, all in one round trip
+        :param driver: the browser to inject into, its script timeout must be longer than timeout
+        :param filename: the name of the script, e.g. 'scrape_products.js'
+        :param ready_selector: CSS selector of an element that every page has once its content has loaded
+        :param timeout: the most seconds to wait for the ready element, the script is run anyway after this
+        :param settle: seconds the page must go without changing after the ready element appears
+        :return: JSON data - can be either a list or dictionary '''
+        # The span includes the time the page took to become ready
+        with instrumentation.span('script.execute_when_ready'):
+            response = driver.execute_async_script(self.wrapped[filename], ready_selector, int(timeout * 1000),
+                                                   int(settle * 1000))
+        if 'error' in response:
+            raise JavascriptException(filename + ': ' + response['error'])
+        with instrumentation.span('script.json_loads'):
+            return json.loads(response['result'])
@@ -0,0 +1,89 @@
+'''
+
+    A persistent cache of data scraped per URL, e.g. the nutrition information of every product page.
+
+    The cache is an append-only file with one {"url": ..., "value": ...} JSON record per line, so it survives between
+    crawls and a crash can at most lose the last record. A later record for the same URL replaces an earlier one, and
+    compact() drops the records that have been replaced.
+
+'''
+
+import json, os, threading
+
+class URLCache:
+    ''' A persistent, thread-safe mapping of URL to any JSON serializable value, see the module docstring '''
+    def __init__(self, filename):
+        ''' :param filename: the cache file, read now if it exists and created on the first put() '''
+        self.filename = filename
+        self.values = {}
+        self.lock = threading.Lock()
+        self.file = None
+        if os.path.exists(filename):
+            f = open(filename, 'r')
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError: # a line cut short by a crash
+                    continue
+                self.values[record['url']] = record['value']
+            f.close()
+
+    def __contains__(self, url):
+        with self.lock:
+            return url in self.values
+
+    def __len__(self):
+        with self.lock:
+            return len(self.values)
+
+    def urls(self):
+        ''' Every URL in the cache '''
+        with self.lock:
+            return list(self.values)
+
+    def get(self, url, default=None):
+        ''' The cached value of a URL, or default if it isn't cached '''
+        with self.lock:
+            return self.values.get(url, default)
+
+    def put(self, url, value):
+        ''' Cache the value of a URL and append it to the cache file
+        :param url: the URL
+        :param value: any JSON serializable value '''
+        line = json.dumps({'url': url, 'value': value}) + '\n'
+        with self.lock:
+            self.values[url] = value
+            if self.file is None:
+                self.file = open(self.filename, 'a')
+            self.file.write(line)
+            self.file.flush()
+
+    def retain(self, urls):
+        ''' Forget every URL that isn't in urls, the file keeps their records until the next compact()
+        :param urls: set of URLs to keep
+        :return: the number of URLs forgotten '''
+        with self.lock:
+            removed = [url for url in self.values if url not in urls]
+            for url in removed:
+                del self.values[url]
+            return len(removed)
+
+    def compact(self):
+        ''' Rewrite the cache file with only the latest record of every URL, replacing the file in one step '''
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            temporary_filename = self.filename + '.tmp'
+            f = open(temporary_filename, 'w')
+            for url, value in self.values.items():
+                f.write(json.dumps({'url': url, 'value': value}) + '\n')
+            f.close()
+            os.replace(temporary_filename, self.filename)
+
+    def close(self):
+        ''' Close the cache file, it is opened again by the next put() '''
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,242 @@
+'''
+
+    Summary statistics, t-tests, bootstrap confidence intervals and per-category breakdowns of prices and price
+    differences, computed over Numpy arrays so they stay fast with millions of matched products.
+
+    RunningStats keeps the count, total, mean, minimum, maximum and the sum of squared deviations from the mean (M2) of
+    a stream of values. Values are added a chunk (a Numpy array) at a time and every chunk is folded in with the
+    parallel form of Welford's algorithm, so one pass over the data gives the mean, variance and standard deviation
+    without the loss of precision of summing squares. Chunks of CHUNK_SIZE values stay in the CPU cache while their
+    sum, deviations, minimum and maximum are computed. The median can't be streamed, it is found with np.partition
+    instead of sorting.
+
+    t_test() computes the one sample t-test from the count, mean and standard deviation alone, with the same t-score
+    and p-value as scipy.stats.ttest_1samp but only importing scipy.special (scipy.stats takes about a second to
+    import). It works on Numpy arrays too, which tests every category at once.
+
+    bootstrap_ci() resamples with replacement in batches - a batch is a matrix of random indices, one row per resample,
+    so the means of a whole batch are computed by Numpy at once. Batches hold at most MAX_BOOTSTRAP_ELEMENTS values.
+    Drawing values at random indices is slow once the array no longer fits in the CPU cache, so arrays of more than
+    MAX_BOOTSTRAP_SAMPLE values are resampled MAX_BOOTSTRAP_SAMPLE values at a time (an 'm out of n' bootstrap) and the
+    spread of the resampled means is scaled down by sqrt(m / n) to the spread of means of n values.
+
+    grouped_stats() gives each category a code in one pass over the category names, then computes the count, mean,
+    standard deviation, median, minimum, maximum and t-test of every category at once with np.bincount and two sorts.
+
+'''
+
+import math
+import numpy as np
+
+# Values added to a RunningStats at a time
+CHUNK_SIZE = 65536
+
+# The most values drawn at once by bootstrap_ci(), 2^22 values and their indices take 48 MB
+MAX_BOOTSTRAP_ELEMENTS = 2 ** 22
+
+# The most values in each bootstrap resample, larger arrays are resampled m out of n (see the module docstring)
+MAX_BOOTSTRAP_SAMPLE = 100000
+
+class RunningStats:
+    ''' Streaming count, total, mean, variance, minimum and maximum of values, see the module docstring '''
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared deviations from the mean
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def update(self, values):
+        ''' Add a chunk of values
+        :param values: Numpy array or list of numbers
+        :return: self '''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return self
+        total = float(values.sum())
+        mean = total / len(values)
+        deviations = values - mean
+        self.combine(len(values), total, mean, float(np.dot(deviations, deviations)), float(values.min()),
+                     float(values.max()))
+        return self
+
+    def merge(self, other):
+        ''' Add every value of another RunningStats, e.g. one computed by another process
+        :return: self '''
+        if other.n:
+            self.combine(other.n, other.total, other.mean, other.m2, other.minimum, other.maximum)
+        return self
+
+    def combine(self, n, total, mean, m2, minimum, maximum):
+        ''' Fold in the statistics of n more values (Chan, Golub and LeVeque's parallel form of Welford's algorithm) '''
+        count = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / count
+        self.m2 += m2 + delta * delta * self.n * n / count
+        self.n = count
+        self.total += total
+        self.minimum = min(self.minimum, minimum)
+        self.maximum = max(self.maximum, maximum)
+
+    def variance(self, ddof=1):
+        ''' The sample variance, or the population variance with ddof=0, NaN without enough values '''
+        return self.m2 / (self.n - ddof) if self.n > ddof else math.nan
+
+    def stdev(self):
+        ''' The sample standard deviation, like statistics.stdev() '''
+        return math.sqrt(self.variance(1))
+
+    def pstdev(self):
+        ''' The population standard deviation, like statistics.pstdev() '''
+        return math.sqrt(self.variance(0))
+
+def running_stats(values, chunk_size=CHUNK_SIZE):
+    ''' Compute the RunningStats of an array one chunk at a time
+    :param values: Numpy array or list of numbers
+    :return: RunningStats '''
+    values = np.asarray(values, dtype=np.float64).ravel()
+    stats = RunningStats()
+    for start in range(0, len(values), chunk_size):
+        stats.update(values[start:start + chunk_size])
+    return stats
+
+def median(values):
+    ''' The median of an array, like statistics.median(), found by partitioning instead of sorting
+    :return: float, NaN for no values '''
+    values = np.asarray(values, dtype=np.float64).ravel()
+    n = len(values)
+    if n == 0:
+        return math.nan
+    middle = n // 2
+    if n % 2:
+        return float(np.partition(values, middle)[middle])
+    partitioned = np.partition(values, [middle - 1, middle])
+    return float((partitioned[middle - 1] + partitioned[middle]) / 2)
+
+def t_test(n, mean, stdev, popmean=0.0):
+    ''' One sample t-test of the hypothesis that the population mean is popmean, the same test as
+    scipy.stats.ttest_1samp. n, mean and stdev may be numbers or Numpy arrays (one test per element).
+    :param n: the number of values
+    :param mean: the sample mean
+    :param stdev: the sample standard deviation
+    :return: tuple (t-score, two sided p-value), NaN with fewer than two values '''
+    import scipy.special
+    n = np.asarray(n, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_statistic = (np.asarray(mean) - popmean) / (np.asarray(stdev) / np.sqrt(n))
+        two_sided_pvalue = 2 * scipy.special.stdtr(n - 1, -np.abs(t_statistic))
+    t_statistic = np.where(n > 1, t_statistic, np.nan)
+    two_sided_pvalue = np.where(n > 1, two_sided_pvalue, np.nan)
+    if t_statistic.ndim == 0:
+        return float(t_statistic), float(two_sided_pvalue)
+    return t_statistic, two_sided_pvalue
+
+def bootstrap_ci(values, num_resamples=1000, confidence=0.95, seed=0, max_elements=MAX_BOOTSTRAP_ELEMENTS,
+                 max_sample=MAX_BOOTSTRAP_SAMPLE):
+    ''' Percentile bootstrap confidence interval of the mean
+    :param values: Numpy array or list of numbers
+    :param num_resamples: the number of resamples
+    :param confidence: the confidence level of the interval, e.g. 0.95
+    :param seed: random seed, the same seed gives the same interval
+    :param max_elements: the most values drawn at once, bounding the memory used
+    :param max_sample: the most values in each resample, see the module docstring
+    :return: tuple (low, high), NaN for no values '''
+    values = np.asarray(values, dtype=np.float64).ravel()
+    n = len(values)
+    if n == 0 or num_resamples < 1:
+        return math.nan, math.nan
+    rng = np.random.default_rng(seed)
+    sample_size = min(n, max_sample)
+    index_type = np.int32 if n < 2 ** 31 else np.int64
+    batch_size = max(1, max_elements // sample_size)
+    means = np.empty(num_resamples)
+    for start in range(0, num_resamples, batch_size):
+        size = min(batch_size, num_resamples - start)
+        indices = rng.integers(0, n, size=(size, sample_size), dtype=index_type)
+        means[start:start + size] = values[indices].mean(axis=1)
+    if sample_size < n:
+        mean = values.mean()
+        means = mean + (means - mean) * math.sqrt(sample_size / n)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+def number(x):
+    ''' A statistic as a JSON serializable number, None instead of NaN '''
+    x = float(x)
+    return None if math.isnan(x) else x
+
+def summary(values, num_resamples=0, confidence=0.95, seed=0):
+    ''' Every summary statistic of an array
+    :param values: Numpy array or list of numbers
+    :param num_resamples: the number of bootstrap resamples for a confidence interval of the mean, 0 for none
+    :return: dictionary with n, total, mean, median, stdev, pstdev, min, max, t_statistic and two_sided_pvalue (of
+             the t-test that the mean is 0), and confidence_interval if num_resamples was given. Statistics that
+             can't be computed with so few values are None. '''
+    values = np.asarray(values, dtype=np.float64).ravel()
+    stats = running_stats(values)
+    t_statistic, two_sided_pvalue = t_test(stats.n, stats.mean, stats.stdev())
+    results = {
+        'n': stats.n,
+        'total': stats.total,
+        'mean': number(stats.mean) if stats.n else None,
+        'median': number(median(values)),
+        'stdev': number(stats.stdev()),
+        'pstdev': number(stats.pstdev()),
+        'min': number(stats.minimum) if stats.n else None,
+        'max': number(stats.maximum) if stats.n else None,
+        't_statistic': number(t_statistic),
+        'two_sided_pvalue': number(two_sided_pvalue),
+    }
+    if num_resamples:
+        low, high = bootstrap_ci(values, num_resamples, confidence, seed)
+        results['confidence_interval'] = {'confidence': confidence, 'low': number(low), 'high': number(high)}
+    return results
+
+def grouped_stats(values, groups):
+    ''' Summary statistics of the values in every group, e.g. the price differences of each category
+    :param values: Numpy array or list of numbers
+    :param groups: the group of every value, any hashable labels (None is a group too)
+    :return: dictionary - key is the group, value is a dictionary with n, total, mean, median, stdev, min, max,
+             t_statistic and two_sided_pvalue, largest groups first '''
+    values = np.asarray(values, dtype=np.float64).ravel()
+    codes = {}
+    group_codes = np.fromiter((codes.setdefault(group, len(codes)) for group in groups), dtype=np.intp, count=len(values))
+    if not codes:
+        return {}
+    names = list(codes)
+    counts = np.bincount(group_codes, minlength=len(names))
+    totals = np.bincount(group_codes, weights=values, minlength=len(names))
+    means = totals / counts
+    deviations = values - means[group_codes]
+    m2 = np.bincount(group_codes, weights=deviations * deviations, minlength=len(names))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stdevs = np.sqrt(m2 / (counts - 1))
+    t_statistics, two_sided_pvalues = t_test(counts, means, stdevs)
+
+    # Sort by value and then stably by group, so every group is a run of sorted values (faster than np.lexsort, the
+    # group codes are small integers)
+    order = np.argsort(values)
+    code_type = np.int16 if len(names) < 2 ** 15 else np.intp
+    order = order[np.argsort(group_codes[order].astype(code_type), kind='stable')]
+    sorted_values = values[order]
+    starts = np.cumsum(counts) - counts
+    medians = (sorted_values[starts + (counts - 1) // 2] + sorted_values[starts + counts // 2]) / 2
+    minimums = sorted_values[starts]
+    maximums = sorted_values[starts + counts - 1]
+
+    results = {}
+    for code in np.argsort(-counts, kind='stable').tolist():
+        results[names[code]] = {
+            'n': int(counts[code]),
+            'total': float(totals[code]),
+            'mean': number(means[code]),
+            'median': number(medians[code]),
+            'stdev': number(stdevs[code]),
+            'min': number(minimums[code]),
+            'max': number(maximums[code]),
+            't_statistic': number(t_statistics[code]),
+            'two_sided_pvalue': number(two_sided_pvalues[code]),
+        }
+    return results
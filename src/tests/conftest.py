@@ -0,0 +1,4 @@
+# The modules are imported from the 'src' folder, the way the scripts run them
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
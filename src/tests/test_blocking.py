@@ -0,0 +1,49 @@
+import random
+import numpy as np
+import matching
+
+def random_names(rng, words, count):
+    return [' '.join(rng.sample(words, rng.randint(1, 5))) + ' ' + str(rng.choice([100, 200, 500])) + 'g'
+            for i in range(count)]
+
+def pair_scores(rows, columns, scores):
+    return dict(zip(zip(rows.tolist(), columns.tolist()), scores.tolist()))
+
+def catalogues(seed):
+    rng = random.Random(seed)
+    # A few very common words and many rare ones, like real product names
+    words = ['coles', 'woolworths', 'milk', 'bread'] * 10 + ['word%d' % i for i in range(150)]
+    return random_names(rng, words, 300), random_names(rng, words, 250)
+
+def test_prefix_blocking_finds_every_match():
+    woolworths, coles = catalogues(0)
+    for threshold in [0.3, 0.5, 0.8]:
+        expected = pair_scores(*matching.similar_pairs(woolworths, coles, threshold))
+        rows, columns, scores, report = matching.blocked_pairs(woolworths, coles, threshold,
+                                                               matching.Blocking(verify=True))
+        result = pair_scores(rows, columns, scores)
+        assert result.keys() == expected.keys()
+        assert np.allclose([result[pair] for pair in expected], list(expected.values()))
+        assert report.lost_matches == 0
+        assert report.candidate_pairs < report.total_pairs
+
+def test_rare_token_blocking_finds_a_subset():
+    woolworths, coles = catalogues(1)
+    expected = pair_scores(*matching.similar_pairs(woolworths, coles, 0.5))
+    rows, columns, scores, report = matching.blocked_pairs(woolworths, coles, 0.5,
+                                                           matching.Blocking(max_document_frequency=0.01, verify=True))
+    result = pair_scores(rows, columns, scores)
+    assert set(result) <= set(expected)
+    assert report.lost_matches == len(expected) - len(result)
+
+def test_blocking_on_category():
+    woolworths, coles = catalogues(2)
+    rng = random.Random(3)
+    woolworths_categories = [rng.choice(['dairy', 'bakery', None]) for name in woolworths]
+    coles_categories = [rng.choice(['dairy', 'bakery', None]) for name in coles]
+    rows, columns, scores, report = matching.blocked_pairs(woolworths, coles, 0.5, woolworths_blocks=[woolworths_categories],
+                                                           coles_blocks=[coles_categories])
+    expected = {(row, column) for row, column in pair_scores(*matching.similar_pairs(woolworths, coles, 0.5))
+                if None in (woolworths_categories[row], coles_categories[column])
+                or woolworths_categories[row] == coles_categories[column]}
+    assert set(zip(rows.tolist(), columns.tolist())) == expected
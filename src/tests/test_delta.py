@@ -0,0 +1,23 @@
+import os
+from scraping.delta import DeltaCrawl
+
+def test_complete_crawl_drops_pages_it_did_not_visit(tmp_path):
+    filename = os.path.join(tmp_path, 'pages.cache')
+    delta = DeltaCrawl(filename)
+    for url in ['a?page=1', 'a?page=2', 'b?page=1']:
+        delta.record(url, delta.fingerprint([url]), [{'name': url}])
+    delta.close(complete=True)
+
+    # A crawl limited to some pages keeps the pages it didn't visit
+    delta = DeltaCrawl(filename)
+    assert delta.unchanged('a?page=1', delta.fingerprint(['a?page=1'])) == [{'name': 'a?page=1'}]
+    delta.close()
+    assert sorted(DeltaCrawl(filename).pages.urls()) == ['a?page=1', 'a?page=2', 'b?page=1']
+
+    # 'a?page=2' is no longer listed, 'b?page=1' came from the crawl journal
+    delta = DeltaCrawl(filename)
+    delta.unchanged('a?page=1', delta.fingerprint(['a?page=1']))
+    delta.visit('b?page=1')
+    delta.close(complete=True)
+    assert delta.dropped == 1
+    assert sorted(DeltaCrawl(filename).pages.urls()) == ['a?page=1', 'b?page=1']
@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import matching
+from match_cache import MatchCache
+
+WOOLWORTHS = ['woolworths full cream milk 2l', 'woolworths lite milk 2l', 'cavendish bananas each', 'pink lady apples 1kg',
+              'coca cola classic 1.25l', 'arnott tim tam original 200g', 'helga wholemeal bread 750g',
+              'vegemite spread 380g', 'kellogg corn flakes 380g', 'sanitarium weet bix 575g', 'smith chips original 170g',
+              'bega tasty cheese block 500g']
+COLES = ['coles full cream milk 2l', 'coles lite milk 2l', 'bananas each', 'pink lady apples 1kg', 'coca cola classic 1.25l',
+         'arnotts tim tam original 200g', 'helga wholemeal bread 750g', 'vegemite spread 380g', 'kellogg corn flakes 500g',
+         'sanitarium weet bix 1.2kg', 'smith crinkle cut chips original 170g', 'bega tasty cheese 500g']
+
+def pairs(result, woolworths_names, coles_names):
+    rows, columns, scores = result
+    return {(woolworths_names[row], coles_names[column]): score for row, column, score in
+            zip(rows.tolist(), columns.tolist(), scores.tolist())}
+
+def test_first_run_matches_similar_pairs(tmp_path):
+    cache = MatchCache(os.path.join(tmp_path, 'cache.pickle'))
+    result = pairs(cache.similar_pairs(WOOLWORTHS, COLES), WOOLWORTHS, COLES)
+    expected = pairs(matching.similar_pairs(WOOLWORTHS, COLES), WOOLWORTHS, COLES)
+    assert cache.rebuilt
+    assert result.keys() == expected.keys()
+    assert np.allclose([result[pair] for pair in expected], list(expected.values()))
+
+def test_adding_one_product_scores_only_that_product(tmp_path):
+    filename = os.path.join(tmp_path, 'cache.pickle')
+    MatchCache(filename).similar_pairs(WOOLWORTHS, COLES)
+
+    # Every word of the new name is already in the vocabulary
+    woolworths = WOOLWORTHS + ['woolworths bananas each']
+    cache = MatchCache(filename)
+    result = pairs(cache.similar_pairs(woolworths, COLES), woolworths, COLES)
+    assert not cache.rebuilt
+    assert cache.added == {'Woolworths': 1, 'Coles': 0}
+    assert cache.removed == {'Woolworths': 0, 'Coles': 0}
+    assert ('woolworths bananas each', 'bananas each') in result
+    assert ('cavendish bananas each', 'bananas each') in result
+
+def test_removed_products_are_evicted(tmp_path):
+    filename = os.path.join(tmp_path, 'cache.pickle')
+    MatchCache(filename).similar_pairs(WOOLWORTHS, COLES)
+    # The catalogue is tiny, removing a name moves the weights of its rarer words by more than the default drift
+    cache = MatchCache(filename, max_idf_drift=0.25)
+    result = pairs(cache.similar_pairs(WOOLWORTHS, COLES[1:]), WOOLWORTHS, COLES[1:])
+    assert not cache.rebuilt
+    assert cache.added == {'Woolworths': 0, 'Coles': 0}
+    assert cache.removed == {'Woolworths': 0, 'Coles': 1}
+    assert not any(coles == COLES[0] for woolworths, coles in result)
+
+def test_new_word_rebuilds(tmp_path):
+    filename = os.path.join(tmp_path, 'cache.pickle')
+    MatchCache(filename).similar_pairs(WOOLWORTHS, COLES)
+    cache = MatchCache(filename)
+    cache.similar_pairs(WOOLWORTHS + ['mango each'], COLES)
+    assert cache.rebuilt
+
+def test_idf_drift_rebuilds(tmp_path):
+    filename = os.path.join(tmp_path, 'cache.pickle')
+    MatchCache(filename).similar_pairs(WOOLWORTHS, COLES)
+    # Doubling the catalogue with names made of one common word moves every weight a long way
+    cache = MatchCache(filename)
+    cache.similar_pairs(WOOLWORTHS + ['milk'] * 24, COLES)
+    assert cache.rebuilt
+
+def test_changed_threshold_rebuilds(tmp_path):
+    filename = os.path.join(tmp_path, 'cache.pickle')
+    MatchCache(filename).similar_pairs(WOOLWORTHS, COLES, 0.5)
+    cache = MatchCache(filename)
+    cache.similar_pairs(WOOLWORTHS, COLES, 0.6)
+    assert cache.rebuilt
+
+def test_empty_catalogue_returns_no_pairs_and_keeps_the_cache(tmp_path):
+    filename = os.path.join(tmp_path, 'cache.pickle')
+    MatchCache(filename).similar_pairs(WOOLWORTHS, COLES)
+    modified = os.path.getmtime(filename)
+
+    for woolworths, coles in [([], COLES), (WOOLWORTHS, []), ([], [])]:
+        rows, columns, scores = MatchCache(filename).similar_pairs(woolworths, coles)
+        assert len(rows) == len(columns) == len(scores) == 0
+    assert os.path.getmtime(filename) == modified
+
+    cache = MatchCache(filename)
+    cache.similar_pairs(WOOLWORTHS, COLES)
+    assert not cache.rebuilt
@@ -0,0 +1,10 @@
+import matching
+
+def test_empty_name_lists_have_no_pairs():
+    names = ['coles full cream milk 2l', 'bananas each']
+    for woolworths, coles in [([], names), (names, []), ([], [])]:
+        rows, columns, scores = matching.similar_pairs(woolworths, coles)
+        assert len(rows) == len(columns) == len(scores) == 0
+        assert list(matching.iter_similar_names(woolworths, coles)) == []
+        rows, columns, scores, report = matching.blocked_pairs(woolworths, coles)
+        assert len(rows) == len(columns) == len(scores) == 0
@@ -0,0 +1,90 @@
+import json, os, random
+import merge, price_history, product_store
+
+def write_category(directory, name, products, mtime):
+    f = open(os.path.join(directory, name), 'w')
+    json.dump(products, f)
+    f.close()
+    os.utime(os.path.join(directory, name), (mtime, mtime))
+
+def random_products(rng, names, fields):
+    products = []
+    for name in rng.sample(names, rng.randint(0, 8)):
+        product = {'name': name, 'price': rng.choice([1, 2.5, 3.99, 4]), 'unitPrice': '$%d / 1KG' % rng.randint(1, 3),
+                   'category': rng.choice(['fruit-veg', 'bakery', 'dairy'])}
+        if rng.random() < 0.3:
+            product['special'] = rng.choice([1.5, 2])
+        products.append({field: product[field] for field in fields + ['name'] if field in product})
+    return products
+
+def combine(directory):
+    ''' What process.combine() did before merge.py: load every JSON file in the directory and concatenate them '''
+    products = []
+    for file in os.listdir(directory):
+        if file.endswith('.json') and file not in (merge.MERGED_FILENAME, merge.MANIFEST_FILENAME):
+            f = open(os.path.join(directory, file), 'r')
+            products += json.load(f)
+            f.close()
+    return products
+
+def canonical(products):
+    return sorted(json.dumps(product, sort_keys=True) for product in products)
+
+def test_merge_matches_combine(tmp_path):
+    directory = os.path.join(tmp_path, 'Other')
+    os.makedirs(directory)
+    rng = random.Random(1)
+    names = ['product %d' % i for i in range(20)]
+    for i in range(5):
+        write_category(directory, 'category%d.json' % i, random_products(rng, names, ['price', 'category']), 1000 + i)
+    expected = combine(directory)
+
+    merge.merge(directory + '/')
+    assert canonical(merge.load_merged(directory + '/')) == canonical(expected)
+
+    # Change one file and remove another, only the changed file is parsed again
+    write_category(directory, 'category2.json', random_products(rng, names, ['price', 'category']), 2000)
+    os.remove(os.path.join(directory, 'category4.json'))
+    expected = combine(directory)
+    report = merge.merge(directory + '/')
+    assert report['parsed'] == ['category2.json']
+    assert report['removed'] == ['category4.json']
+    assert canonical(merge.load_merged(directory + '/')) == canonical(expected)
+
+def test_incremental_store_and_history_match_full_rebuild(tmp_path):
+    directory = os.path.join(tmp_path, 'Woolworths')
+    os.makedirs(directory)
+    fields = price_history.FIELDS['Woolworths']
+    rng = random.Random(2)
+    names = ['product %d' % i for i in range(30)]
+    files = ['category%d.json' % i for i in range(6)]
+    mtime = 1600000000
+    for file in files[:4]:
+        write_category(directory, file, random_products(rng, names, fields), mtime)
+
+    for step in range(25):
+        merge.merge(directory + '/')
+        products = merge.load_merged(directory + '/')
+
+        # The store holds what writing every merged product at once would
+        product_store.write_store(os.path.join(tmp_path, 'expected.store'), products, 'Woolworths')
+        expected = product_store.open_store(os.path.join(tmp_path, 'expected.store'))
+        store = product_store.open_store(os.path.join(directory, product_store.STORE_DIRNAME))
+        assert list(store.values()) == list(expected.values())
+
+        # The latest snapshot holds the last record of every merged product
+        latest = {}
+        for product in products:
+            latest[product['name']] = dict({field: product[field] for field in fields if field in product},
+                                           name=product['name'])
+        history = price_history.open_history(directory + '/')
+        assert history.snapshot() == latest
+        assert len(history.snapshots) == step + 1
+
+        # Change, add or remove a category file
+        mtime += 3600
+        file = rng.choice(files)
+        if os.path.exists(os.path.join(directory, file)) and rng.random() < 0.25:
+            os.remove(os.path.join(directory, file))
+        else:
+            write_category(directory, file, random_products(rng, names, fields), mtime)
@@ -0,0 +1,48 @@
+import os
+import price_history
+
+def product(name, price, special=None):
+    product = {'name': name, 'price': price, 'unitPrice': '$%s / 1KG' % price, 'category': 'fruit-veg'}
+    if special is not None:
+        product['special'] = special
+    return product
+
+CRAWLS = [
+    (1000, [product('apples', 4.0), product('bananas', 3.5), product('pears', 5.0)]),
+    (2000, [product('apples', 4.0), product('bananas', 3.0, 2.5), product('pears', 5.0)]),
+    (3000, [product('apples', 4.5), product('bananas', 3.0, 2.5), product('kiwi', 1.0)]),
+    (4000, [product('apples', 4.5), product('pears', 5.5), product('kiwi', 1.0)]),
+]
+
+def expected(crawl):
+    return {p['name']: p for p in crawl}
+
+def ingest_all(directory, compact_every):
+    history = price_history.PriceHistory(directory, 'Woolworths', compact_every=compact_every, max_segments=2)
+    return history, [history.ingest(products, timestamp) for timestamp, products in CRAWLS]
+
+def test_snapshot_rebuilds_every_crawl(tmp_path):
+    for compact_every in [1, 2, 1000]: # every change in segments, some merged, all in the log
+        directory = os.path.join(tmp_path, str(compact_every))
+        history, changes = ingest_all(directory, compact_every)
+        assert changes == [3, 1, 3, 2]
+        for reopened in [history, price_history.PriceHistory(directory, 'Woolworths')]:
+            for timestamp, products in CRAWLS:
+                assert reopened.snapshot(timestamp) == expected(products)
+                assert reopened.snapshot(timestamp + 999) == expected(products)
+            assert reopened.snapshot(999) == {}
+            assert reopened.snapshot() == expected(CRAWLS[-1][1])
+
+def test_series_and_changes(tmp_path):
+    history, changes = ingest_all(str(tmp_path), compact_every=2)
+    assert history.series('pears') == [(1000, product('pears', 5.0)), (3000, None), (4000, product('pears', 5.5))]
+    assert history.series('durian') == []
+    assert history.changes(2500, 3500) == [(3000, 'apples', product('apples', 4.5)), (3000, 'pears', None),
+                                           (3000, 'kiwi', product('kiwi', 1.0))]
+
+def test_earlier_crawl_is_ingested_at_the_latest_snapshot(tmp_path):
+    history, changes = ingest_all(str(tmp_path), compact_every=1000)
+    history.ingest(CRAWLS[0][1], 500)
+    assert history.snapshots[-1] == 4000
+    assert history.snapshot() == expected(CRAWLS[0][1])
+    assert history.snapshot(3999) == expected(CRAWLS[2][1])
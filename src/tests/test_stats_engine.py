@@ -0,0 +1,46 @@
+import math, statistics
+import numpy as np
+import scipy.stats
+import stats_engine
+
+def test_running_stats_matches_numpy():
+    values = np.random.default_rng(0).normal(1e6, 3.0, 200001) # a large mean loses precision if squares are summed
+    stats = stats_engine.running_stats(values, chunk_size=1000)
+    assert stats.n == len(values)
+    assert math.isclose(stats.total, values.sum(), rel_tol=1e-12)
+    assert math.isclose(stats.mean, values.mean(), rel_tol=1e-12)
+    assert math.isclose(stats.variance(), values.var(ddof=1), rel_tol=1e-9)
+    assert math.isclose(stats.pstdev(), values.std(), rel_tol=1e-9)
+    assert stats.minimum == values.min() and stats.maximum == values.max()
+
+def test_merged_running_stats_match_one_pass():
+    values = np.random.default_rng(1).exponential(5.0, 10000)
+    merged = stats_engine.running_stats(values[:3000]).merge(stats_engine.running_stats(values[3000:]))
+    assert math.isclose(merged.mean, values.mean(), rel_tol=1e-12)
+    assert math.isclose(merged.stdev(), values.std(ddof=1), rel_tol=1e-9)
+
+def test_running_stats_with_too_few_values():
+    assert math.isnan(stats_engine.RunningStats().variance())
+    assert math.isnan(stats_engine.running_stats([2.0]).stdev())
+    assert stats_engine.running_stats([2.0]).pstdev() == 0.0
+
+def test_median_and_t_test():
+    values = np.random.default_rng(2).normal(0.3, 1.0, 501)
+    assert stats_engine.median(values) == statistics.median(values.tolist())
+    assert stats_engine.median(values[:-1]) == statistics.median(values[:-1].tolist())
+    result = stats_engine.summary(values)
+    expected = scipy.stats.ttest_1samp(values, 0.0)
+    assert math.isclose(result['t_statistic'], expected.statistic, rel_tol=1e-9)
+    assert math.isclose(result['two_sided_pvalue'], expected.pvalue, rel_tol=1e-6)
+
+def test_grouped_stats_match_each_group():
+    rng = np.random.default_rng(3)
+    values = rng.normal(0, 2, 3000)
+    groups = rng.choice(['dairy', 'bakery', None], 3000).tolist()
+    results = stats_engine.grouped_stats(values, groups)
+    for group in set(groups):
+        group_values = values[np.array([g == group for g in groups])]
+        assert results[group]['n'] == len(group_values)
+        assert math.isclose(results[group]['mean'], group_values.mean(), rel_tol=1e-9)
+        assert math.isclose(results[group]['stdev'], group_values.std(ddof=1), rel_tol=1e-9)
+        assert results[group]['median'] == float(np.median(group_values))
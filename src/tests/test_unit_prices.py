@@ -0,0 +1,36 @@
+import numpy as np
+import unit_prices
+from unit_prices import UNIT_KG, UNIT_GRAMS, UNIT_EACH, UNIT_ML, UNIT_LITRE, UNIT_UNKNOWN
+
+def test_parse_unit_price_formats():
+    assert unit_prices.parse_unit_price('$22.50 per 1Kg') == (22.5, 1.0, UNIT_KG)
+    assert unit_prices.parse_unit_price('$2 / 10g') == (2.0, 10.0, UNIT_GRAMS)
+    assert unit_prices.parse_unit_price('$1.20 ea') == (1.2, 1.0, UNIT_EACH)
+    assert unit_prices.parse_unit_price('$3.00 per 100mL') == (3.0, 100.0, UNIT_ML)
+    assert unit_prices.parse_unit_price('$1,234.50 / 1L') == (1234.5, 1.0, UNIT_LITRE)
+    assert unit_prices.parse_unit_price('$0.75 each') == (0.75, 1.0, UNIT_EACH)
+
+def test_parse_unit_price_failures():
+    for s in [None, '', 'per kg', '$2 per 10 boxes', '2 per kg', 5]:
+        assert unit_prices.parse_unit_price(s) is None
+
+def test_parse_unit_prices_column():
+    price, quantity, unit, failed = unit_prices.parse_unit_prices(['$22.50 per 1Kg', '$2 / 10g', None, '$2 / 10g', 'junk'])
+    assert np.allclose(price[[0, 1, 3]], [22.5, 2.0, 2.0])
+    assert np.allclose(quantity[[0, 1, 3]], [1.0, 10.0, 10.0])
+    assert np.isnan(price[[2, 4]]).all() and np.isnan(quantity[[2, 4]]).all()
+    assert unit.tolist() == [UNIT_KG, UNIT_GRAMS, UNIT_UNKNOWN, UNIT_GRAMS, UNIT_UNKNOWN]
+    assert failed.tolist() == [False, False, True, False, True]
+
+def test_parse_unit_prices_empty_column():
+    price, quantity, unit, failed = unit_prices.parse_unit_prices([])
+    assert len(price) == len(quantity) == len(unit) == len(failed) == 0
+
+def test_price_per_base_unit():
+    strings = ['$2 / 100g', '$3 per 150g', '$3 per 2L', '$4.50 per 500mL', '$1.20 ea', '$5 per 0kg', None]
+    normalized, base_unit = unit_prices.normalize_unit_prices(strings)
+    assert np.allclose(normalized[:5], [20.0, 20.0, 1.5, 9.0, 1.2])
+    assert base_unit.tolist() == [unit_prices.BASE_KG, unit_prices.BASE_KG, unit_prices.BASE_LITRE, unit_prices.BASE_LITRE,
+                                  unit_prices.BASE_EACH, unit_prices.BASE_UNKNOWN, unit_prices.BASE_UNKNOWN]
+    # A zero quantity and a string that can't be parsed have no price per base unit
+    assert np.isnan(normalized[5:]).all()
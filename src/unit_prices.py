@@ -0,0 +1,148 @@
+'''
+
+    Parse unit price strings such as "$22.50 per 1Kg", "$2 / 10g" or "$1.20 ea" for whole columns of products at once.
+
+    Coles and Woolworths use the following formats for unit prices:
+    "$price per quantity unit"
+    "$price / quantity unit"
+    "$price unit"
+
+    where the quantity is optional (it defaults to 1) and unit is one of 'kg', 'g', 'L', 'mL' or 'ea'/'each' in any case.
+
+    Every string is matched against one compiled regular expression and the result is memoized, so a string that
+    appears many times (most unit price strings do) is only ever parsed once.
+
+    Parsed unit prices are then normalized to a price per canonical base unit - per kg, per litre or per each - so
+    '$2 / 100g' and '$3 per 150g' become $20/kg and $20/kg and any two products with the same base unit can be compared
+    with a single array subtraction.
+
+'''
+
+import re
+from functools import lru_cache
+import numpy as np
+
+# Unit codes used in the unit column returned by parse_unit_prices()
+UNIT_UNKNOWN = 0
+UNIT_KG = 1
+UNIT_GRAMS = 2
+UNIT_EACH = 3
+UNIT_ML = 4
+UNIT_LITRE = 5
+
+# The name of each unit code, the same names convert_unit_price() in process.py returns
+UNIT_NAMES = ['unknown', 'kg', 'grams', 'each', 'ml', 'litre']
+
+# Every spelling of a unit that appears on Woolworths.com.au and Coles.com.au
+UNITS = {
+    'kg': UNIT_KG,
+    'g': UNIT_GRAMS,
+    'gm': UNIT_GRAMS,
+    'gram': UNIT_GRAMS,
+    'grams': UNIT_GRAMS,
+    'ea': UNIT_EACH,
+    'each': UNIT_EACH,
+    'ml': UNIT_ML,
+    'l': UNIT_LITRE,
+    'lt': UNIT_LITRE,
+    'ltr': UNIT_LITRE,
+    'litre': UNIT_LITRE,
+    'litres': UNIT_LITRE,
+    'liter': UNIT_LITRE,
+    'liters': UNIT_LITRE,
+}
+
+# Base unit codes returned by price_per_base_unit()
+BASE_UNKNOWN = 0
+BASE_KG = 1
+BASE_LITRE = 2
+BASE_EACH = 3
+
+# The name of each base unit code
+BASE_UNIT_NAMES = ['unknown', 'kg', 'litre', 'each']
+
+# For every unit code, the base unit it is measured in and how many base units one unit is
+# e.g. one gram is 0.001 kg
+UNIT_TABLE = {
+    UNIT_UNKNOWN: (BASE_UNKNOWN, np.nan),
+    UNIT_KG: (BASE_KG, 1.0),
+    UNIT_GRAMS: (BASE_KG, 0.001),
+    UNIT_EACH: (BASE_EACH, 1.0),
+    UNIT_ML: (BASE_LITRE, 0.001),
+    UNIT_LITRE: (BASE_LITRE, 1.0),
+}
+
+# UNIT_TABLE as lookup arrays indexed by unit code
+BASE_UNITS = np.array([UNIT_TABLE[code][0] for code in range(len(UNIT_NAMES))], dtype=np.int8)
+BASE_FACTORS = np.array([UNIT_TABLE[code][1] for code in range(len(UNIT_NAMES))])
+
+UNIT_PRICE_PATTERN = re.compile(r'''
+    ^\s*\$\s*(?P<price>\d[\d,]*(?:\.\d+)?|\.\d+)    # price in dollars
+    \s*(?:(?:per|/)\s*)?                            # 'per' or '/', missing for strings like '$1.20 ea'
+    (?P<quantity>\d+(?:\.\d+)?|\.\d+)?              # quantity, defaults to 1
+    \s*(?P<unit>[a-z]+)\s*$                         # unit
+''', re.IGNORECASE | re.VERBOSE)
+
+@lru_cache(maxsize=None)
+def parse_unit_price(s):
+    ''' Parse a single unit price string, memoized so repeated strings are only parsed once
+    :param s: unit price string, e.g. '$22.50 per 1Kg'
+    :return: tuple (price, quantity, unit code) or None if the string can't be parsed '''
+    if not isinstance(s, str):
+        return None
+    match = UNIT_PRICE_PATTERN.match(s)
+    if match is None:
+        return None
+    unit = UNITS.get(match.group('unit').lower())
+    if unit is None:
+        return None
+    price = float(match.group('price').replace(',', ''))
+    quantity = float(match.group('quantity')) if match.group('quantity') else 1.0
+    return (price, quantity, unit)
+
+def parse_unit_prices(strings):
+    ''' Parse a whole column of unit price strings
+
+    For example ['$22.50 per 1Kg', '$2 / 10g', None] is parsed into:
+    price    = [22.5, 2.0, nan]
+    quantity = [1.0, 10.0, nan]
+    unit     = [UNIT_KG, UNIT_GRAMS, UNIT_UNKNOWN]
+    failed   = [False, False, True]
+
+    :param strings: list of unit price strings, None for products without a unit price
+    :return: tuple of Numpy arrays (price, quantity, unit, failed), failed is true for rows that couldn't be parsed '''
+    price = np.full(len(strings), np.nan)
+    quantity = np.full(len(strings), np.nan)
+    unit = np.zeros(len(strings), dtype=np.int8)
+    failed = np.ones(len(strings), dtype=np.bool_)
+    for row, s in enumerate(strings):
+        parsed = parse_unit_price(s)
+        if parsed is not None:
+            price[row], quantity[row], unit[row] = parsed
+            failed[row] = False
+    return price, quantity, unit, failed
+
+def price_per_base_unit(price, quantity, unit, failed):
+    ''' Normalize parsed unit prices to a price per canonical base unit
+
+    For example $2 per 100 grams is $2 / (100 * 0.001 kg) = $20 per kg, and $3 per 2 L is $1.50 per litre.
+
+    :param price: Numpy array of prices as returned by parse_unit_prices()
+    :param quantity: Numpy array of quantities as returned by parse_unit_prices()
+    :param unit: Numpy array of unit codes as returned by parse_unit_prices()
+    :param failed: Numpy array, true for rows that couldn't be parsed, as returned by parse_unit_prices()
+    :return: tuple of Numpy arrays (price per base unit, base unit code), NaN and BASE_UNKNOWN where failed or where the
+    quantity is zero '''
+    base_unit = BASE_UNITS[unit]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = price / (quantity * BASE_FACTORS[unit])
+    unusable = failed | ~np.isfinite(normalized)
+    normalized[unusable] = np.nan
+    base_unit[unusable] = BASE_UNKNOWN
+    return normalized, base_unit
+
+def normalize_unit_prices(strings):
+    ''' Parse a whole column of unit price strings and normalize them to a price per canonical base unit
+    :param strings: list of unit price strings, None for products without a unit price
+    :return: see price_per_base_unit() '''
+    return price_per_base_unit(*parse_unit_prices(strings))